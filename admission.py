@@ -0,0 +1,405 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+
+# ---------------------- Settings ------------------------
+# Traffic classes in the order they are served; a waiting "interactive" request
+# always goes before any "bulk" one
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+# Tokens charged for a call before its real usage is known, until calls have reported some
+DEFAULT_TOKENS_PER_CALL = 1500
+
+# Weight of the newest sample in the service-time and token averages
+EWMA_WEIGHT = 0.2
+
+
+class Overloaded(Exception):
+    """
+    The request was turned away instead of queued (or waited too long);
+    retry_after is a whole-second hint for the Retry-After header
+    """
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Server busy ({reason}), retry in {retry_after} s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# ---------------------- Token buckets ------------------------
+class TokenBucket:
+    """rate per minute on average, with bursts of up to burst; never blocks"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def refill(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_for(self, amount):
+        """
+        Returns: seconds until amount tokens are available (0.0 if they are now)
+        """
+        self.refill()
+        return max(0.0, (amount - self.tokens) / self.rate) if self.rate else math.inf
+
+    def take(self, amount):
+        # May go negative: a call's real cost is only known afterwards
+        self.refill()
+        self.tokens -= amount
+
+
+class ClientLimiter:
+    """
+    One token bucket per client (IP address or API key): at most rate_per_minute requests on
+    average, bursts of up to burst. Least recently seen clients are forgotten past max_clients.
+
+    With a store (shared_store.py) the buckets live there, so the limit holds across worker
+    processes and hosts; while the store cannot be reached, requests are allowed.
+    """
+
+    def __init__(self, rate_per_minute, burst, max_clients=10000, store=None):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_clients = max_clients
+        self.store = store
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"allowed": 0, "limited": 0, "store_errors": 0}
+
+    def check(self, client):
+        """
+        Take one request from client's bucket
+        Returns: 0 when allowed, else whole seconds until the client may retry
+        """
+        if self.store is not None:
+            return self._check_shared(client)
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate_per_minute, self.burst)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(client)
+            wait = bucket.wait_for(1)
+            if wait > 0:
+                self.counters["limited"] += 1
+                return math.ceil(wait)
+            bucket.take(1)
+            self.counters["allowed"] += 1
+            return 0
+
+    def _check_shared(self, client):
+        try:
+            wait = self.store.take(f"client:{client}", self.rate_per_minute / 60.0, self.burst)
+        except Exception:
+            wait = 0
+            with self._lock:
+                self.counters["store_errors"] += 1
+        with self._lock:
+            if wait > 0:
+                self.counters["limited"] += 1
+                return math.ceil(wait)
+            self.counters["allowed"] += 1
+            return 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, clients=len(self._buckets), rate_per_minute=self.rate_per_minute,
+                        burst=self.burst)
+
+
+# ---------------------- Admission ------------------------
+_traffic = contextvars.ContextVar("meal_mingle_traffic", default="interactive")
+
+
+@contextmanager
+def traffic(name):
+    """
+    Mark the model calls made inside the block as one traffic class (see PRIORITIES);
+    calls outside any block are "interactive"
+    """
+    token = _traffic.set(name)
+    try:
+        yield
+    finally:
+        _traffic.reset(token)
+
+
+def current_traffic():
+    """Returns: the traffic class set with traffic() ("interactive" outside any block)"""
+    return _traffic.get()
+
+
+class Ticket:
+    """A granted upstream slot; set tokens to the call's real usage to settle the budget"""
+
+    __slots__ = ("charged", "tokens")
+
+    def __init__(self, charged):
+        self.charged = charged
+        self.tokens = None
+
+
+class AdmissionController:
+    """
+    Gate in front of the upstream model API:
+
+        with admission.slot() as ticket:
+            response = call_model()
+            ticket.tokens = response_usage_total
+
+    At most max_concurrency calls are in flight (size it to the provider's concurrency
+    quota, per server process). Callers beyond that wait in one queue, ordered by traffic
+    class and then arrival, up to max_queue of them. A caller that would not get a slot
+    within its class's max wait (estimated from the queue ahead and the recent service time)
+    is turned away at once with Overloaded rather than after waiting; so is one whose wait
+    runs out. tokens_per_minute adds an upstream token budget: each call is charged the
+    average tokens per call when admitted and settled with its real usage afterwards.
+    backoff(seconds) holds every admission, e.g. when the provider answers 429.
+    """
+
+    def __init__(self, max_concurrency, max_queue=256, max_wait=None, tokens_per_minute=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        # traffic class -> seconds a caller of that class may wait for a slot
+        self.max_wait = {"interactive": 15.0, "bulk": 300.0, **(max_wait or {})}
+        self.budget = TokenBucket(tokens_per_minute, tokens_per_minute) if tokens_per_minute else None
+
+        self._changed = threading.Condition()
+        # (event loop, asyncio.Event) of each waiting coroutine, woken with the waiting threads
+        self._async_waiters = set()
+        self._in_flight = 0
+        # (priority, arrival number) of each waiting caller
+        self._queue = []
+        self._arrivals = itertools.count()
+        self._paused_until = 0.0
+        self._service_seconds = None
+        self._tokens_per_call = DEFAULT_TOKENS_PER_CALL
+        self.counters = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_deadline": 0,
+                         "timed_out": 0, "backoffs": 0, "wait_seconds": 0.0}
+
+    # ---------------------- Caller side ------------------------
+    @contextmanager
+    def slot(self, traffic_class=None):
+        """
+        Hold one upstream slot for the block
+        traffic_class: default the class set with traffic(), else "interactive"
+        Raises Overloaded when the caller is shed
+        Yields: Ticket
+        """
+        ticket = self.acquire(traffic_class or _traffic.get())
+        start = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot_async(self, traffic_class=None):
+        """slot() for coroutines: waiting does not block the event loop"""
+        ticket = await self.acquire_async(traffic_class or _traffic.get())
+        start = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, time.monotonic() - start)
+
+    def acquire(self, traffic_class="interactive"):
+        with self._changed:
+            ticket, entry = self._enter(traffic_class)
+            if ticket is not None:
+                return ticket
+            try:
+                while True:
+                    ticket, blocked_for = self._poll(entry)
+                    if ticket is not None:
+                        return ticket
+                    self._changed.wait(blocked_for)
+            except BaseException:
+                self._leave(entry)
+                raise
+
+    async def acquire_async(self, traffic_class="interactive"):
+        with self._changed:
+            ticket, entry = self._enter(traffic_class)
+        if ticket is not None:
+            return ticket
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        try:
+            while True:
+                with self._changed:
+                    # Cleared before polling, so a release after this poll still wakes us
+                    waiter[1].clear()
+                    self._async_waiters.add(waiter)
+                    ticket, blocked_for = self._poll(entry)
+                if ticket is not None:
+                    return ticket
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), None if math.isinf(blocked_for) else blocked_for)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._changed:
+                self._leave(entry)
+            raise
+        finally:
+            with self._changed:
+                self._async_waiters.discard(waiter)
+
+    def check(self, traffic_class=None):
+        """
+        Shed a request before any work is done for it: raises Overloaded when a call made
+        now would be turned away by acquire() (the verdict may change by the time it calls)
+        """
+        with self._changed:
+            now = time.monotonic()
+            if self._queue or self._admissible(now) != 0:
+                self._shed(traffic_class or _traffic.get(), now)
+
+    def release(self, ticket, seconds):
+        with self._changed:
+            self._in_flight -= 1
+            self._service_seconds = seconds if self._service_seconds is None else (
+                (1 - EWMA_WEIGHT) * self._service_seconds + EWMA_WEIGHT * seconds
+            )
+            if ticket.tokens is not None:
+                self._tokens_per_call = (1 - EWMA_WEIGHT) * self._tokens_per_call + EWMA_WEIGHT * ticket.tokens
+                if self.budget is not None:
+                    # Give back (or charge) the difference from the admission estimate
+                    self.budget.take(ticket.tokens - ticket.charged)
+            self._notify()
+
+    def backoff(self, seconds):
+        """Admit nothing for seconds (upstream asked us to slow down)"""
+        with self._changed:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.counters["backoffs"] += 1
+
+    def stats(self):
+        with self._changed:
+            admitted = self.counters["admitted"]
+            stats = dict(self.counters)
+            stats.update(
+                in_flight=self._in_flight,
+                waiting=len(self._queue),
+                max_concurrency=self.max_concurrency,
+                max_queue=self.max_queue,
+                mean_wait_ms=round(1000 * stats.pop("wait_seconds") / admitted, 1) if admitted else None,
+                service_seconds=round(self._service_seconds, 3) if self._service_seconds is not None else None,
+                tokens_per_call=round(self._tokens_per_call),
+                budget_tokens=round(self.budget.tokens) if self.budget is not None else None,
+            )
+            return stats
+
+    # ---------------------- Internals (hold _changed) ------------------------
+    def _notify(self):
+        """Wake every waiter, threads and coroutines, to re-check the queue"""
+        self._changed.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Its loop has closed
+                pass
+
+    def _enter(self, traffic_class):
+        """
+        Admit at once, shed, or queue a caller
+        Returns: (Ticket, None) when admitted, else (None, queue entry to _poll)
+        """
+        now = time.monotonic()
+        if not self._queue and self._admissible(now) == 0:
+            return self._admit(now, now), None
+        self._shed(traffic_class, now)
+
+        # (priority, arrival number) orders the heap; arrival time and deadline ride along
+        entry = (PRIORITIES[traffic_class], next(self._arrivals), now, now + self.max_wait[traffic_class])
+        heapq.heappush(self._queue, entry)
+        self.counters["queued"] += 1
+        return None, entry
+
+    def _shed(self, traffic_class, now):
+        """Raises Overloaded when a caller arriving now could not be queued or served in time"""
+        if len(self._queue) >= self.max_queue:
+            self.counters["shed_queue_full"] += 1
+            raise Overloaded("queue full", self._retry_after(len(self._queue)))
+        priority = PRIORITIES[traffic_class]
+        ahead = sum(1 for entry in self._queue if entry[0] <= priority)
+        if self._expected_wait(ahead, now) > self.max_wait[traffic_class]:
+            self.counters["shed_deadline"] += 1
+            raise Overloaded("expected wait too long", self._retry_after(ahead))
+
+    def _poll(self, entry):
+        """
+        Raises Overloaded once the entry's deadline has passed
+        Returns: (Ticket, 0) when the queued caller is admitted, else (None, seconds to wait before polling again)
+        """
+        _, _, arrived, deadline = entry
+        now = time.monotonic()
+        if self._queue[0] == entry:
+            blocked_for = self._admissible(now)
+            if blocked_for == 0:
+                heapq.heappop(self._queue)
+                # The next caller may be admissible too (several slots freed at once)
+                self._notify()
+                return self._admit(arrived, now), 0
+        else:
+            blocked_for = math.inf
+        if now >= deadline:
+            self.counters["timed_out"] += 1
+            raise Overloaded("waited too long", self._retry_after(0))
+        return None, min(blocked_for, deadline - now)
+
+    def _leave(self, entry):
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._notify()
+
+    def _admissible(self, now):
+        """
+        Returns: 0 when a call may start now, else seconds until it might (inf: until a slot frees)
+        """
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= self.max_concurrency:
+            return math.inf
+        if self.budget is not None:
+            return self.budget.wait_for(self._tokens_per_call)
+        return 0.0
+
+    def _admit(self, arrived, now):
+        self._in_flight += 1
+        self.counters["admitted"] += 1
+        self.counters["wait_seconds"] += now - arrived
+        charged = self._tokens_per_call
+        if self.budget is not None:
+            self.budget.take(charged)
+        return Ticket(charged)
+
+    def _expected_wait(self, ahead, now):
+        # Each slot serves one queued caller per service time; before any call has
+        # finished there is nothing to go on, so the caller is let into the queue
+        wait = max(0.0, self._paused_until - now)
+        if self._service_seconds is not None:
+            wait += (ahead + 1) * self._service_seconds / self.max_concurrency
+        if self.budget is not None and self.budget.rate:
+            needed = (ahead + 1) * self._tokens_per_call - self.budget.tokens
+            wait = max(wait, needed / self.budget.rate)
+        return wait
+
+    def _retry_after(self, ahead):
+        return max(1, math.ceil(self._expected_wait(ahead, time.monotonic())))
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from shared_store import pack, unpack
+
+
+# ---------------------- Cache key ------------------------
+def make_cache_key(image_bytes, model, prompt_version):
+    """
+    Build a content-addressed key for an analysis
+    Returns: sha256 of the image bytes + model + prompt version (see make_content_cache_key)
+    """
+    return make_content_cache_key(hashlib.sha256(image_bytes).hexdigest(), model, prompt_version)
+
+
+def make_content_cache_key(content_key, model, prompt_version):
+    """
+    Key for the analysis of content already identified by its sha256 hex digest,
+    e.g. a BlobStore key, so an upload and its analysis share one key
+    Returns: "<sha256>:<model>:v<prompt version>"
+    """
+    return f"{content_key}:{model}:v{prompt_version}"
+
+
+# ---------------------- Two-tier cache ------------------------
+class AnalysisCache:
+    """
+    Two-tier cache for model responses:
+      - memory: LRU bounded by max_entries
+      - disk:   SQLite table bounded by max_disk_mb (least recently used rows go first)
+    Entries older than ttl_seconds are treated as misses and removed.
+
+    With a store (shared_store.py) the second tier is that store instead of the SQLite table,
+    so every worker process and host reuses the others' analyses; the memory tier stays as a
+    near-cache in front of it. A store that cannot be reached counts as a miss. The store's
+    connections are its owner's to close and reopen around a fork.
+    """
+
+    def __init__(self, path=None, max_entries=512, max_disk_mb=256, ttl_seconds=30 * 24 * 3600, store=None):
+        self.path = None if store is not None else path
+        self.store = store
+        self.max_entries = max_entries
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        self._disk_bytes = 0
+
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "store_hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expirations": 0,
+            "store_errors": 0,
+        }
+
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.reopen()
+
+    # ---------------------- Connection ------------------------
+    def reopen(self):
+        """
+        Open the disk tier's connection (again). Server workers call this after fork:
+        an SQLite connection must not cross a fork, see close()
+        """
+        if not self.path:
+            return
+        with self._lock:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL: worker processes sharing the file read while one of them writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS analyses_accessed ON analyses (accessed)")
+            self._db.commit()
+            row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()
+            self._disk_bytes = row[0]
+
+    def close(self):
+        """
+        Close the disk tier's connection; the memory tier keeps working and reopen() restores the disk tier
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get(self, key, count=True):
+        """
+        Look up a cached response
+        count=False leaves the hit and miss counters alone, for a second look at a key
+        whose lookup the caller has already counted (e.g. just before calling the model)
+        Returns: cached value or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._count("memory_hits", count)
+                    return value
+                del self._memory[key]
+                self.counters["expirations"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, size, created FROM analyses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, size, created = row
+                    if now - created <= self.ttl_seconds:
+                        self._db.execute("UPDATE analyses SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, created, value)
+                        self._count("disk_hits", count)
+                        return value
+                    self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._disk_bytes -= size
+                    self.counters["expirations"] += 1
+
+            if self.store is None:
+                self._count("misses", count)
+                return None
+
+        # The store may be across the network: no lock held while waiting on it. A value this
+        # process cannot read (e.g. written with msgpack, which is not installed here) is a miss
+        try:
+            data = self.store.get(key)
+            entry = unpack(data) if data is not None else None
+        except Exception:
+            entry = None
+            with self._lock:
+                self.counters["store_errors"] += 1
+        with self._lock:
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl_seconds:
+                    self._remember(key, created, value)
+                    self._count("store_hits", count)
+                    return value
+                self.counters["expirations"] += 1
+            self._count("misses", count)
+            return None
+
+    def _count(self, counter, count):
+        # Hold _lock
+        if count:
+            self.counters[counter] += 1
+
+    def put(self, key, value):
+        """
+        Store a response in both tiers, evicting old entries if over budget
+        """
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self.counters["puts"] += 1
+            self._remember(key, now, value)
+
+            if self._db is not None:
+                old = self._db.execute("SELECT size FROM analyses WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    self._disk_bytes -= old[0]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analyses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now),
+                )
+                self._disk_bytes += size
+                self._evict_disk()
+                self._db.commit()
+
+        if self.store is not None:
+            try:
+                self.store.set(key, pack([now, value]), ttl=self.ttl_seconds)
+            except Exception:
+                with self._lock:
+                    self.counters["store_errors"] += 1
+
+    def stats(self):
+        """
+        Returns: dict of counters plus current tier sizes
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+            hits = stats["memory_hits"] + stats["disk_hits"] + stats["store_hits"]
+            lookups = hits + stats["misses"]
+            stats["hit_ratio"] = hits / lookups if lookups else 0.0
+            return stats
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    def _evict_disk(self):
+        # Drop least recently accessed rows until the table fits the budget
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM analyses ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self._disk_bytes -= size
+                self.counters["disk_evictions"] += 1
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
@@ -0,0 +1,325 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from quart import Quart, Response, abort, g, request, render_template, jsonify, send_file, url_for
+
+from final import (
+    QWEN_API_URL,
+    QWEN_MODEL,
+    PROMPT_VERSION,
+    MICRO_BATCH_ENABLED,
+    model_router,
+    analysis_cache,
+    phash_index,
+    IMMUTABLE_MAX_AGE,
+    NUTRITION_PROMPT,
+    NUTRITION_QUICK_PROMPT,
+    upload_store,
+    image_derivatives,
+    servable,
+    UNTRACED_ENDPOINTS,
+    admission,
+    in_flight,
+    COALESCING_ENABLED,
+    qwen_breaker,
+    breaker_summary,
+    client_limiter,
+    shared_store,
+    LIMITED_ENDPOINTS,
+    CLIENT_ID_HEADER,
+    build_qwen_request,
+    answer_text,
+    cache_answer,
+    complete_answer,
+    count_analysis,
+    parse_nutrition_response,
+    prepare_saved_upload,
+    quick_answer_complete,
+    request_analysis,
+    upstream_throttled,
+    upstream_verdict,
+    usage_tokens,
+)
+from admission import Overloaded
+from circuit_breaker import CircuitOpen
+from analysis_cache import make_content_cache_key
+from image_derivatives import DERIVATIVE_VERSION
+from image_encoder import sniff_image
+from tracing import begin_trace, end_trace, metrics, model_calls, span
+
+
+# ---------------------- Quart setup ------------------------
+# Async twin of final.py: the upstream model call no longer holds a worker,
+# so one process can keep hundreds of analyses in flight.
+# Run with: hypercorn async_app:app --bind 0.0.0.0:5000 --backlog 2048
+app = Quart(__name__)
+
+# Decode, hashing and JPEG encoding are CPU-bound and stay off the event loop
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 4)))
+image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+# Router (MODEL_BACKENDS) and micro-batched (MICRO_BATCH_ENABLED) calls block a thread for the
+# whole model call: they get their own pool so they do not hold up decoding
+MODEL_THREADS = int(os.getenv("ASYNC_MODEL_THREADS", "64"))
+model_pool = ThreadPoolExecutor(max_workers=MODEL_THREADS, thread_name_prefix="model")
+
+# Pooled keep-alive connections to OpenRouter
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "200"))
+http_client = None
+
+
+@app.before_serving
+async def open_http_client():
+    global http_client
+    http_client = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=60, connect=10),
+        connector=aiohttp.TCPConnector(limit=OPENROUTER_MAX_CONNECTIONS, keepalive_timeout=60),
+    )
+
+
+@app.after_serving
+async def close_http_client():
+    await http_client.close()
+    image_pool.shutdown(wait=False)
+    model_pool.shutdown(wait=False)
+
+
+async def run_blocking(func, *args, pool=None):
+    # In the caller's context, so spans on the pool (default image_pool) land in the request's trace
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(pool or image_pool, context.run, func, *args)
+
+
+# Same request traces and /metrics as final.py
+@app.before_request
+async def start_request_trace():
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        g.trace = begin_trace(request.endpoint, method=request.method)
+
+
+@app.teardown_request
+async def finish_request_trace(error=None):
+    handle = g.pop("trace", None)
+    if handle is not None:
+        end_trace(handle)
+
+
+# Same per-client limit as final.py
+@app.before_request
+async def admit_request():
+    if request.method != "POST" or request.endpoint not in LIMITED_ENDPOINTS:
+        return None
+    if client_limiter is not None:
+        client = request.headers.get(CLIENT_ID_HEADER) if CLIENT_ID_HEADER else None
+        # The buckets may live in the shared store: a network or SQLite round trip
+        retry_after = await run_blocking(client_limiter.check,
+                                         "key:" + client if client else "addr:" + (request.remote_addr or ""))
+        if retry_after:
+            return jsonify({"error": "Too many requests", "retry_after": retry_after}), 429, {"Retry-After": str(retry_after)}
+    # Admission is checked at the model call, after the cache lookup (see final.admit_request)
+    return None
+
+
+@app.errorhandler(Overloaded)
+@app.errorhandler(CircuitOpen)
+async def overloaded(error):
+    return jsonify({"error": str(error), "retry_after": error.retry_after}), 503, {"Retry-After": str(error.retry_after)}
+
+
+# ---------------------- OpenRouter (async) ------------------------
+async def analyze_food_with_qwen_async(compressed_image, cache_key, prompt=None):
+    """
+    Non-blocking version of analyze_food_with_qwen for an already encoded image
+    prompt: None for NUTRITION_PROMPT; a NUTRITION_QUICK_PROMPT answer the nutrient table
+    cannot complete is asked again in full, as in request_qwen_analysis
+    Returns: response text or error message
+    """
+    headers, payload = build_qwen_request(compressed_image, prompt or NUTRITION_PROMPT)
+
+    try:
+        with qwen_breaker.attempt() as attempt:
+            async with admission.slot_async() as ticket:
+                attempt.start()
+                connect, read = attempt.timeout
+                timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+                with span("model.call"):
+                    async with http_client.post(QWEN_API_URL, json=payload, headers=headers, timeout=timeout) as response:
+                        result = await response.json() if response.status == 200 else None
+                        text = None if result is not None else await response.text()
+                ticket.tokens = usage_tokens(result)
+                upstream_verdict(attempt, response.status)
+        model_calls.inc(backend="qwen", status=response.status)
+        upstream_throttled(response.status, response.headers)
+        if result is not None:
+            content = answer_text(result)
+            if prompt is NUTRITION_QUICK_PROMPT and not await run_blocking(quick_answer_complete, content):
+                return await analyze_food_with_qwen_async(compressed_image, cache_key)
+            await run_blocking(cache_answer, cache_key, content)
+            return content
+        else:
+            return f"API Error: {response.status} - {text}"
+
+    except (Overloaded, CircuitOpen):
+        raise
+    except Exception as e:
+        model_calls.inc(backend="qwen", status="exception")
+        return f"Error: {str(e)}"
+
+
+async def analyze_new_upload_async(upload_key, cache_key):
+    """
+    Async final.analyze_new_upload
+    Returns: parsed result dict
+    """
+    # One decode on image_pool: hash, near-duplicate lookup, screen, page and model renditions
+    image_hash, result, compressed_image, prompt = await run_blocking(prepare_saved_upload, upload_key)
+    if result is not None:
+        return result
+
+    if model_router is not None or MICRO_BATCH_ENABLED:
+        # Same backends and batches as final.py; they are driven by threads
+        result_text = await run_blocking(request_analysis, compressed_image, cache_key, prompt, pool=model_pool)
+    else:
+        result_text = await analyze_food_with_qwen_async(compressed_image, cache_key, prompt)
+    # Nutrient-table lookups and parsing stay off the event loop
+    parsed_result = await run_blocking(parse_nutrition_response, result_text)
+    if complete_answer(result_text):
+        await run_blocking(phash_index.add, image_hash, parsed_result)
+    return count_analysis("model", parsed_result)
+
+
+# ---------------------- Routes ------------------------
+@app.route("/", methods=["GET", "POST"])
+async def index():
+    nutrition_info = []
+    description = None
+    portion_estimate = None
+    img_src = None
+    dish_name = None
+
+    if request.method == "POST":
+        files = await request.files
+        if "file" not in files:
+            return "No file uploaded", 400
+
+        file = files["file"]
+        if file.filename == "":
+            return "No file selected", 400
+
+        # Only images are stored, under the type Pillow finds (see final.index)
+        mime = await run_blocking(sniff_image, file.stream)
+        if mime is None:
+            return "Not a supported image", 400
+
+        # Stream the upload into the shared store and show a resized rendition instead of inlining it as base64
+        with span("upload.store"):
+            upload_key = await run_blocking(upload_store.put_stream, file.stream, mime)
+        img_src = url_for("upload_derivative", key=upload_key, variant="display", v=DERIVATIVE_VERSION)
+
+        # A repeat upload is answered before the image is even decoded
+        cache_key = make_content_cache_key(upload_key, QWEN_MODEL, PROMPT_VERSION)
+        with span("cache.lookup"):
+            cached = await run_blocking(analysis_cache.get, cache_key)
+        if cached is not None:
+            parsed_result = count_analysis("cache", await run_blocking(parse_nutrition_response, cached))
+        else:
+            # Concurrent uploads of the same photo wait for one analysis; a client that
+            # disconnects stops waiting without cancelling it for the others
+            if COALESCING_ENABLED:
+                parsed_result, shared = await in_flight.do_async(
+                    cache_key, lambda: analyze_new_upload_async(upload_key, cache_key)
+                )
+                if shared:
+                    count_analysis("coalesced", parsed_result)
+            else:
+                parsed_result = await analyze_new_upload_async(upload_key, cache_key)
+
+        dish_name = parsed_result['dish_name']
+        description = parsed_result['description']
+        nutrition_info = parsed_result['nutrition_info']
+        portion_estimate = parsed_result['portion_estimate']
+
+    with span("render"):
+        return await render_template(
+            "claude.html",
+            img_src=img_src,
+            description=description,
+            nutrition_info=nutrition_info,
+            portion_estimate=portion_estimate,
+            dish_name=dish_name
+        )
+
+
+async def send_blob(blob):
+    """Same headers as final.send_blob: the blob key as a strong ETag, cached for good, no sniffing"""
+    response = await send_file(
+        blob["path"],
+        mimetype=blob["mime"],
+        add_etags=False,
+        cache_timeout=IMMUTABLE_MAX_AGE,
+    )
+    response.set_etag(blob["key"])
+    response.cache_control.immutable = True
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    await response.make_conditional(request, accept_ranges=True, complete_length=blob["size"])
+    return response
+
+
+@app.route("/uploads/<key>")
+async def upload_blob(key):
+    blob = await run_blocking(upload_store.get, key) if len(key) == 64 else None
+    if not servable(blob):
+        abort(404)
+    return await send_blob(blob)
+
+
+@app.route("/uploads/<key>/<variant>")
+async def upload_derivative(key, variant):
+    blob = await run_blocking(image_derivatives.get, key, variant) if len(key) == 64 else None
+    if not servable(blob):
+        abort(404)
+    return await send_blob(blob)
+
+
+@app.route("/metrics")
+async def metrics_export():
+    # The collectors read SQLite stats
+    return Response(await run_blocking(metrics.render), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache/stats")
+async def cache_stats():
+    return jsonify(await run_blocking(analysis_cache.stats))
+
+
+@app.route("/store/stats")
+async def store_stats():
+    if shared_store is None:
+        abort(404)
+    return jsonify(dict(await run_blocking(shared_store.stats), kind=shared_store.kind, phashes=len(phash_index)))
+
+
+@app.route("/coalescing/stats")
+async def coalescing_stats():
+    return jsonify(in_flight.stats())
+
+
+@app.route("/breakers/stats")
+async def breaker_stats():
+    return jsonify(breaker_summary())
+
+
+@app.route("/admission/stats")
+async def admission_stats():
+    stats = {"admission": admission.stats()}
+    if client_limiter is not None:
+        stats["clients"] = client_limiter.stats()
+    return jsonify(stats)
+
+
+# ---------------------- Run ------------------------
+if __name__ == "__main__":
+    app.run(debug=True)
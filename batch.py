@@ -0,0 +1,319 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image
+
+from food_screen import screen_image
+from image_encoder import encode_image_for_model, load_for_model
+from nutrition_facts import to_array, totals
+from phash_index import dhash
+
+
+# ---------------------- Settings ------------------------
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+# Bytes hashed at a time for images given as paths
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# ---------------------- Rate budget ------------------------
+class RateLimiter:
+    """
+    Token bucket shared by the model-call threads: at most rate_per_minute calls
+    per minute on average, with bursts of up to `burst`
+    """
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+# ---------------------- Decode processes ------------------------
+# One pool per process, started on first use. Its processes come from a forkserver (spawn where
+# there is none) rather than a fork of this process: a server worker has threads, locks and
+# connections that a forked child would inherit mid-use
+_cpu_pool = None
+_cpu_pool_lock = threading.Lock()
+
+
+def cpu_pool(processes=None):
+    """
+    Returns: the process pool that decodes and encodes batch images, created with `processes`
+    workers (default: CPU count) on first use
+    """
+    global _cpu_pool
+    with _cpu_pool_lock:
+        if _cpu_pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            context = multiprocessing.get_context(method)
+            if method == "forkserver":
+                # Each decode process starts with PIL and NumPy already imported
+                context.set_forkserver_preload(["batch"])
+            _cpu_pool = ProcessPoolExecutor(processes, mp_context=context)
+        return _cpu_pool
+
+
+def shutdown_cpu_pool():
+    """Stop the decode processes (before a fork, at exit, or when one died); the next batch starts new ones"""
+    global _cpu_pool
+    with _cpu_pool_lock:
+        pool, _cpu_pool = _cpu_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------------------- Inputs ------------------------
+def iter_directory(directory):
+    """
+    Walk a folder for images; zip archives inside it are expanded too
+    Yields: (name, path) for image files, (name, bytes) for images inside archives
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, directory)
+            extension = os.path.splitext(filename)[1].lower()
+            if extension == ".zip":
+                yield from iter_zip(path, prefix=name)
+            elif extension in IMAGE_EXTENSIONS:
+                yield name, path
+
+
+def iter_zip(archive_file, prefix="", read=True, images_only=True):
+    """
+    archive_file: path or binary file object of a zip archive
+    images_only=False also yields members without an image extension, for the caller to reject
+    Yields: (name, bytes) for every image inside it; with read=False (name, member stream)
+    instead, each stream open until the next item is taken
+    """
+    with zipfile.ZipFile(archive_file) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            if images_only and os.path.splitext(info.filename)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            name = f"{prefix}/{info.filename}" if prefix else info.filename
+            if read:
+                yield name, archive.read(info)
+            else:
+                with archive.open(info) as member:
+                    yield name, member
+
+
+def source_sha256(source):
+    """
+    source: image bytes, or the path of an image file (read in chunks)
+    Returns: sha256 hex digest of the image bytes
+    """
+    if not isinstance(source, str):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_completed(output_path):
+    """
+    Read an existing results file so a restarted batch can skip finished images
+    Returns: set of sha256 hex digests with status "ok"
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a half-written last line
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["sha256"])
+    return completed
+
+
+# ---------------------- Pipeline ------------------------
+def prepare_image(name, source, screen=False, screen_food=False):
+    """
+    CPU stage, runs in a worker process: decode once for the perceptual hash, encode for the model
+    source: image bytes, or the path of an image file (read here rather than sent over a pipe)
+    screen: check the model-size decode first (see food_screen.screen_image, food=screen_food);
+    a rejected image is not encoded and gets its retake answer as "result"
+    Returns: dict with name, dhash and model-ready JPEG (or result)
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            image_bytes = f.read()
+    else:
+        image_bytes = source
+    image = Image.open(BytesIO(image_bytes))
+    prepared = {"name": name, "dhash": dhash(image)}
+    model_image = load_for_model(image_bytes)
+    if screen:
+        screening = screen_image(model_image, food=screen_food)
+        if not screening.ok:
+            prepared["result"] = screening.result()
+            return prepared
+    prepared["jpeg"] = encode_image_for_model(model_image, max_size_mb=4.5)
+    return prepared
+
+
+def run_batch(items, analyze, concurrency=4, rate_per_minute=None, processes=None, skip_hashes=(),
+              screen=False, screen_food=False):
+    """
+    Analyze many images: decode/encode across processes (cpu_pool), model calls on `concurrency`
+    threads under an optional rate budget
+    items: iterable of (name, source): source is image bytes, the path of an image file, or None
+    for an upload that is not an image (reported as an error)
+    analyze: function(jpeg_bytes, dhash, sha256 of the source bytes) -> parsed result dict
+    skip_hashes: sha256 digests of source bytes that are already done
+    screen, screen_food: reject poor photos (and with screen_food, colourless ones) in the
+    decode processes, without a model call (see prepare_image)
+    Yields: one result record per image, in completion order
+    """
+    limiter = RateLimiter(rate_per_minute) if rate_per_minute else None
+    items = iter(items)
+    # Bound the number of decoded images held in memory at once
+    max_in_flight = concurrency * 4
+
+    def call_model(sha256, prepared):
+        if limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter()
+        result = analyze(prepared["jpeg"], prepared["dhash"], sha256)
+        ok = result["dish_name"] not in ("Error", "Parsing Error")
+        return {
+            "file": prepared["name"],
+            "sha256": sha256,
+            "status": "ok" if ok else "error",
+            "result": result,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+    with ThreadPoolExecutor(concurrency) as model_pool:
+        pending = {}
+        # Items that are not images, reported without being prepared
+        rejected = []
+
+        def fill():
+            while len(pending) < max_in_flight:
+                try:
+                    name, source = next(items)
+                except StopIteration:
+                    return
+                if source is None:
+                    rejected.append(name)
+                    continue
+                sha256 = source_sha256(source)
+                if sha256 in skip_hashes:
+                    continue
+                future = cpu_pool(processes).submit(prepare_image, name, source, screen, screen_food)
+                pending[future] = ("prepare", name, sha256)
+
+        fill()
+        while pending or rejected:
+            while rejected:
+                yield {"file": rejected.pop(), "sha256": None, "status": "error", "error": "Not a supported image"}
+            if not pending:
+                fill()
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, name, sha256 = pending.pop(future)
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        # A decode process died (e.g. out of memory); later items get a new pool
+                        shutdown_cpu_pool()
+                    yield {"file": name, "sha256": sha256, "status": "error", "error": str(e)}
+                    continue
+                if stage == "prepare" and "result" in outcome:
+                    # Rejected by the screen: no rate budget or model call spent
+                    yield {"file": name, "sha256": sha256, "status": "error", "result": outcome["result"], "seconds": 0.0}
+                elif stage == "prepare":
+                    pending[model_pool.submit(call_model, sha256, outcome)] = ("model", name, sha256)
+                else:
+                    yield outcome
+            fill()
+
+
+# ---------------------- CLI ------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Analyze every image in a folder and write JSONL results")
+    parser.add_argument("directory", help="folder of images (zip archives inside it are expanded)")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file, appended to and used to resume")
+    parser.add_argument("--concurrency", type=int, default=4, help="model calls in flight")
+    parser.add_argument("--rate", type=float, default=None, help="max model calls per minute")
+    parser.add_argument("--processes", type=int, default=None, help="decode/encode processes (default: CPU count)")
+    args = parser.parse_args()
+
+    # Imported here so worker processes do not start the Flask app
+    from final import SCREEN_ENABLED, analyze_bulk, food_screen
+
+    completed = load_completed(args.output)
+    if completed:
+        print(f"Resuming: {len(completed)} images already done", file=sys.stderr)
+
+    counts = {"ok": 0, "error": 0}
+    meals = []
+    start = time.perf_counter()
+    with open(args.output, "a", encoding="utf-8") as out:
+        records = run_batch(
+            iter_directory(args.directory),
+            analyze_bulk,
+            concurrency=args.concurrency,
+            rate_per_minute=args.rate,
+            processes=args.processes,
+            skip_hashes=completed,
+            screen=food_screen is not None,
+            screen_food=SCREEN_ENABLED,
+        )
+        for record in records:
+            out.write(json.dumps(record) + "\n")
+            # Flush every line so a crash loses at most the images in flight
+            out.flush()
+            counts[record["status"]] += 1
+            if record["status"] == "ok" and record["result"].get("nutrition"):
+                meals.append(record["result"]["nutrition"])
+            print(f"[{record['status']}] {record['file']}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {counts['ok']} ok, {counts['error']} errors in {elapsed:.1f} s", file=sys.stderr)
+    if meals:
+        summed = totals(to_array(meals))
+        print(
+            f"Total over {len(meals)} meals: " + ", ".join(f"{key} {value}" for key, value in summed.items()),
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
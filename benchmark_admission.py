@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmark_async import start, unique_images
+from benchmark_e2e import percentile
+
+
+# ---------------------- Settings ------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+MOCK_PORT = 8102
+APP_PORT = 8103
+
+# App settings per scenario; "off" leaves the upstream quota to the provider's 429s
+SCENARIOS = {
+    "off": {"ADMISSION_MAX_CONCURRENCY": "100000", "CLIENT_RATE_PER_MINUTE": "0"},
+    "on": {"CLIENT_RATE_PER_MINUTE": "60", "CLIENT_BURST": "10", "CLIENT_ID_HEADER": "X-Client-Id"},
+}
+
+
+# ---------------------- Load ------------------------
+async def interactive(client, uploads, concurrency, clients):
+    """
+    Page uploads, spread over `clients` client ids, at most `concurrency` in flight
+    Returns: list of (HTTP status, seconds, answered by the model)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def upload(index, image_bytes):
+        async with semaphore:
+            form = aiohttp.FormData()
+            form.add_field("file", image_bytes, filename=f"page_{index}.png", content_type="image/png")
+            start_time = time.perf_counter()
+            async with client.post(f"http://127.0.0.1:{APP_PORT}/", data=form,
+                                   headers={"X-Client-Id": f"user-{index % clients}"}) as response:
+                body = await response.text()
+            # The page shows "Error" as the dish name when the model call failed
+            results.append((response.status, time.perf_counter() - start_time, "Mock Dish" in body))
+
+    await asyncio.gather(*(upload(index, data) for index, data in enumerate(uploads)))
+    return results
+
+
+async def bulk(client, uploads, batches):
+    """
+    The same images split over `batches` concurrent /batch requests
+    Returns: (record statuses, seconds until the last batch finished)
+    """
+    statuses = []
+
+    async def post(part):
+        form = aiohttp.FormData()
+        for index, data in part:
+            form.add_field("files", data, filename=f"bulk_{index}.png", content_type="image/png")
+        async with client.post(f"http://127.0.0.1:{APP_PORT}/batch", data=form,
+                               headers={"X-Client-Id": "bulk"}) as response:
+            if response.status != 200:
+                statuses.extend([f"http_{response.status}"] * len(part))
+                return
+            async for line in response.content:
+                record = json.loads(line)
+                ok = record["status"] == "ok" and record["result"]["dish_name"] == "Mock Dish"
+                statuses.append("ok" if ok else "error")
+
+    start_time = time.perf_counter()
+    items = list(enumerate(uploads))
+    await asyncio.gather(*(post(items[i::batches]) for i in range(batches)))
+    return statuses, time.perf_counter() - start_time
+
+
+async def greedy(client, image_bytes, count):
+    # One client posting far faster than its limit
+    statuses = []
+    for _ in range(count):
+        form = aiohttp.FormData()
+        form.add_field("file", image_bytes, filename="greedy.png", content_type="image/png")
+        async with client.post(f"http://127.0.0.1:{APP_PORT}/", data=form, headers={"X-Client-Id": "greedy"}) as response:
+            await response.read()
+            statuses.append(response.status)
+    return statuses
+
+
+async def run_load(args):
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=900),
+                                     connector=aiohttp.TCPConnector(limit=0)) as client:
+        bulk_task = asyncio.create_task(bulk(client, unique_images(args.bulk, seed=1), args.batches))
+        # Page traffic arrives once the bulk work has filled the upstream quota
+        await asyncio.sleep(args.bulk_head_start)
+        page = await interactive(client, unique_images(args.interactive, seed=2), args.concurrency, args.clients)
+        bulk_statuses, bulk_seconds = await bulk_task
+        greedy_statuses = await greedy(client, unique_images(1, seed=3)[0], args.greedy)
+        async with client.get(f"http://127.0.0.1:{APP_PORT}/admission/stats") as response:
+            admission = await response.json()
+        async with client.get(f"http://127.0.0.1:{MOCK_PORT}/mock/stats") as response:
+            quota = await response.json()
+    return page, bulk_statuses, bulk_seconds, greedy_statuses, admission, quota
+
+
+def summarize(name, page, bulk_statuses, bulk_seconds, greedy_statuses, admission, quota):
+    answered = [seconds for status, seconds, ok in page if status == 200 and ok]
+    shed = [seconds for status, seconds, _ in page if status == 503]
+    return {
+        "scenario": name,
+        "page_answered": len(answered),
+        "page_failed": sum(1 for status, _, ok in page if status == 200 and not ok),
+        "page_shed": len(shed),
+        "page_p50_ms": round(1000 * percentile(answered, 0.50)) if answered else None,
+        "page_p95_ms": round(1000 * percentile(answered, 0.95)) if answered else None,
+        "shed_p50_ms": round(1000 * percentile(shed, 0.50)) if shed else None,
+        "shed_p95_ms": round(1000 * percentile(shed, 0.95)) if shed else None,
+        "bulk_ok": bulk_statuses.count("ok"),
+        "bulk_failed": len(bulk_statuses) - bulk_statuses.count("ok"),
+        "bulk_seconds": round(bulk_seconds, 1),
+        "greedy_429": greedy_statuses.count(429),
+        "upstream_429": quota["rejected"],
+        "upstream_peak": quota["peak"],
+        "admission": admission["admission"],
+    }
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Page uploads during a bulk backlog against a quota-limited mock: admission control off vs on"
+    )
+    parser.add_argument("--quota", type=int, default=8, help="mock provider's concurrency quota")
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds per answer")
+    parser.add_argument("--interactive", type=int, default=200, help="page uploads")
+    parser.add_argument("--concurrency", type=int, default=96, help="page uploads in flight")
+    parser.add_argument("--clients", type=int, default=40, help="client ids the page uploads come from")
+    parser.add_argument("--bulk", type=int, default=96, help="images in /batch requests")
+    parser.add_argument("--batches", type=int, default=4, help="concurrent /batch requests")
+    parser.add_argument("--bulk-head-start", type=float, default=2.0, help="seconds of bulk load before page traffic")
+    parser.add_argument("--max-wait", type=float, default=3.0, help="ADMISSION_INTERACTIVE_MAX_WAIT")
+    parser.add_argument("--greedy", type=int, default=20, help="back-to-back uploads from one client at the end")
+    parser.add_argument("--scenarios", default="off,on")
+    args = parser.parse_args()
+
+    env = dict(
+        os.environ,
+        QWEN_API_URL=f"http://127.0.0.1:{MOCK_PORT}/api/v1/chat/completions",
+        QWEN_API_KEY="mock",
+        PYTHONPATH=HERE,
+        # Noise images are smaller than the quality gate allows
+        QUALITY_GATE_ENABLED="0",
+        BATCH_CONCURRENCY=str(args.quota),
+        ADMISSION_MAX_CONCURRENCY=str(args.quota),
+        ADMISSION_INTERACTIVE_MAX_WAIT=str(args.max_wait),
+        TRACE_SAMPLE_RATE="0",
+        TRACE_SLOW_SECONDS="inf",
+    )
+
+    rows = []
+    for name in args.scenarios.split(","):
+        workdir = tempfile.mkdtemp(prefix="bench_admission_")
+        scenario_env = dict(env, BENCH_WORKDIR=workdir, **SCENARIOS[name])
+        # A fresh mock per scenario, so its quota counters start at zero
+        mock = start([sys.executable, os.path.join(HERE, "mock_openrouter.py"), "--port", str(MOCK_PORT),
+                      "--latency", str(args.latency), "--jitter", str(args.latency / 5),
+                      "--max-concurrency", str(args.quota), "--seed", "0"], scenario_env, MOCK_PORT)
+        server = start([sys.executable, "-c", f"import final; final.app.run(port={APP_PORT}, threaded=True)"],
+                       scenario_env, APP_PORT)
+        try:
+            rows.append(summarize(name, *asyncio.run(run_load(args))))
+        finally:
+            for process in (server, mock):
+                process.terminate()
+                process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"mock quota {args.quota} in flight, {args.latency} s per answer; {args.interactive} page uploads "
+          f"({args.concurrency} in flight) during {args.bulk} /batch images")
+    columns = ["scenario", "page_answered", "page_failed", "page_shed", "page_p50_ms", "page_p95_ms", "shed_p50_ms", "shed_p95_ms",
+               "bulk_ok", "bulk_failed", "bulk_seconds", "greedy_429", "upstream_429", "upstream_peak"]
+    print(" ".join(f"{column:>13}" for column in columns))
+    for row in rows:
+        print(" ".join(f"{str(row[column]):>13}" for column in columns))
+    for row in rows:
+        print(f"{row['scenario']}: {json.dumps(row['admission'])}")
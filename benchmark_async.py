@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import aiohttp
+import numpy as np
+from PIL import Image
+
+
+# ---------------------- Settings ------------------------
+MOCK_PORT = 8090
+SYNC_PORT = 8091
+ASYNC_PORT = 8092
+
+
+def start(command, env, port):
+    """
+    Start a server subprocess and wait until its port accepts connections
+    Returns: Popen handle
+    """
+    process = subprocess.Popen(
+        command, env=env, cwd=env["BENCH_WORKDIR"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"server on port {port} did not start: {command}")
+
+
+def unique_images(count, seed=0):
+    """
+    Random-noise PNGs so neither the analysis cache nor the perceptual index can answer
+    Returns: list of PNG bytes
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        output = BytesIO()
+        Image.fromarray(rng.integers(0, 255, (96, 96, 3), dtype=np.uint8)).save(output, format="PNG")
+        images.append(output.getvalue())
+    return images
+
+
+async def drive(port, images, concurrency):
+    """
+    Upload every image with at most concurrency requests in flight
+    Returns: (wall seconds, sorted per-request latencies, failures)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=600), connector=aiohttp.TCPConnector(limit=concurrency)
+    ) as client:
+        async def upload(i, image_bytes):
+            nonlocal failures
+            async with semaphore:
+                form = aiohttp.FormData()
+                form.add_field("file", image_bytes, filename=f"load_{i}.png", content_type="image/png")
+                start = time.perf_counter()
+                async with client.post(f"http://127.0.0.1:{port}/", data=form) as response:
+                    body = await response.read()
+                latencies.append(time.perf_counter() - start)
+                if response.status != 200 or b"Mock Dish" not in body:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(upload(i, image) for i, image in enumerate(images)))
+        return time.perf_counter() - start, sorted(latencies), failures
+
+
+def report(name, wall, latencies, failures):
+    count = len(latencies)
+    print(
+        f"{name:<22} {count:>6} {wall:>8.2f} {count / wall:>8.1f}"
+        f" {latencies[count // 2]:>8.2f} {latencies[int(count * 0.95) - 1]:>8.2f} {failures:>6}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync Flask vs async Quart against a mock OpenRouter")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock model latency in seconds")
+    parser.add_argument("--requests", type=int, default=300, help="uploads sent to the async app")
+    parser.add_argument("--sync-requests", type=int, default=10, help="uploads sent to the sync app")
+    parser.add_argument("--concurrency", type=int, default=300)
+    args = parser.parse_args()
+
+    # Servers run inside a scratch directory so uploads and cache files do not land in the repo
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="bench_async_")
+    env = dict(
+        os.environ,
+        QWEN_API_URL=f"http://127.0.0.1:{MOCK_PORT}/api/v1/chat/completions",
+        QWEN_API_KEY="mock",
+        BENCH_WORKDIR=workdir,
+        PYTHONPATH=here,
+        ANALYSIS_CACHE_PATH=os.path.join(workdir, "analysis.sqlite3"),
+        PHASH_INDEX_PATH=os.path.join(workdir, "phash.sqlite3"),
+    )
+
+    processes = []
+    try:
+        processes.append(start(
+            [sys.executable, os.path.join(here, "mock_openrouter.py"), "--port", str(MOCK_PORT), "--latency", str(args.latency)],
+            env, MOCK_PORT,
+        ))
+        # One blocking worker, like a single gunicorn sync worker
+        processes.append(start(
+            [sys.executable, "-c", f"import final; final.app.run(port={SYNC_PORT}, threaded=False)"],
+            env, SYNC_PORT,
+        ))
+        processes.append(start(
+            [sys.executable, "-m", "hypercorn", "async_app:app", "--bind", f"127.0.0.1:{ASYNC_PORT}", "--backlog", "2048"],
+            env, ASYNC_PORT,
+        ))
+
+        print(f"Mock model latency: {args.latency:.2f} s, concurrency: {args.concurrency}")
+        print(f"{'server':<22} {'reqs':>6} {'wall s':>8} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'fail':>6}")
+        print("-" * 72)
+        report("flask (1 sync worker)", *asyncio.run(drive(SYNC_PORT, unique_images(args.sync_requests, 1), args.concurrency)))
+        report("quart (1 process)", *asyncio.run(drive(ASYNC_PORT, unique_images(args.requests, 2), args.concurrency)))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
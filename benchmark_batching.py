@@ -0,0 +1,133 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+# ---------------------- Settings ------------------------
+MOCK_PORT = 8093
+
+
+def unique_jpegs(count, seed):
+    """
+    Random-noise JPEGs so the analysis cache never answers
+    Returns: list of JPEG bytes
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        output = BytesIO()
+        Image.fromarray(rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)).save(output, format="JPEG")
+        images.append(output.getvalue())
+    return images
+
+
+def run(final, images, concurrency):
+    """
+    Analyze every image with `concurrency` callers, like concurrent uploads
+    Returns: (wall seconds, sorted per-image latencies, failures)
+    """
+    def one(image):
+        start = time.perf_counter()
+        text = final.analyze_encoded_with_qwen(image)
+        return time.perf_counter() - start, "Mock Dish" not in text
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(one, images))
+    return time.perf_counter() - start, sorted(o[0] for o in outcomes), sum(o[1] for o in outcomes)
+
+
+def report(name, wall, latencies, failures, usage):
+    count = len(latencies)
+    print(
+        f"{name:<10} {count:>6} {usage['calls']:>6} {wall:>8.2f} {count / wall:>8.1f} {latencies[count // 2]:>8.2f}"
+        f" {latencies[int(count * 0.95) - 1]:>8.2f} {usage['total_tokens_per_image']:>12.0f}"
+        f" {usage['model_seconds_per_image']:>12.3f} {failures:>6}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="One-by-one vs micro-batched model calls against a mock OpenRouter")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous uploads")
+    parser.add_argument("--max-size", type=int, default=4, help="images per batched request")
+    parser.add_argument("--max-wait-ms", type=float, default=50)
+    parser.add_argument("--latency", type=float, default=1.0, help="mock seconds for a one-image answer")
+    parser.add_argument("--per-image", type=float, default=0.25, help="mock seconds per extra image in a batch")
+    parser.add_argument("--bad-batch-rate", type=float, default=0.0, help="fraction of broken batch answers")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="bench_batching_")
+    os.environ.update(
+        QWEN_API_URL=f"http://127.0.0.1:{MOCK_PORT}/api/v1/chat/completions",
+        QWEN_API_KEY="mock",
+        ANALYSIS_CACHE_PATH=os.path.join(workdir, "analysis.sqlite3"),
+        PHASH_INDEX_PATH=os.path.join(workdir, "phash.sqlite3"),
+        JOB_QUEUE_PATH=os.path.join(workdir, "jobs.sqlite3"),
+        MICRO_BATCH_MAX_SIZE=str(args.max_size),
+        MICRO_BATCH_MAX_WAIT_MS=str(args.max_wait_ms),
+    )
+    sys.path.insert(0, here)
+    import final
+
+    mock = subprocess.Popen(
+        [
+            sys.executable, os.path.join(here, "mock_openrouter.py"), "--port", str(MOCK_PORT),
+            "--latency", str(args.latency), "--per-image", str(args.per_image),
+            "--bad-batch-rate", str(args.bad_batch_rate),
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", MOCK_PORT), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise RuntimeError("mock OpenRouter did not start")
+                time.sleep(0.2)
+
+        print(
+            f"Mock: {args.latency:.2f} s + {args.per_image:.2f} s per extra image;"
+            f" {args.concurrency} concurrent uploads; batches of up to {args.max_size}, {args.max_wait_ms:.0f} ms window"
+        )
+        print(
+            f"{'path':<10} {'images':>6} {'calls':>6} {'wall s':>8} {'img/s':>8} {'p50 s':>8} {'p95 s':>8}"
+            f" {'tokens/img':>12} {'model s/img':>12} {'fail':>6}"
+        )
+        print("-" * 93)
+
+        final.MICRO_BATCH_ENABLED = False
+        single = run(final, unique_jpegs(args.images, 1), args.concurrency)
+        final.MICRO_BATCH_ENABLED = True
+        batched = run(final, unique_jpegs(args.images, 2), args.concurrency)
+
+        usage = final.usage_meter.summary()
+        report("single", *single, usage["single"])
+        report("batched", *batched, usage["batch"])
+
+        stats = final.micro_batcher.stats()
+        savings = usage["savings_percent"]
+        print(
+            f"\nBatches: {stats['batches']}, {stats['avg_items_per_request']:.2f} images per request,"
+            f" {stats['fallback_batches']} fell back to single calls, wait p50 {stats['wait_ms_p50']:.0f} ms"
+        )
+        print(
+            f"Per image: {savings['total_tokens_per_image']:.0f}% fewer tokens,"
+            f" {savings['model_seconds_per_image']:.0f}% less model time"
+        )
+    finally:
+        mock.terminate()
+        mock.wait()
@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmark_async import start, unique_images
+from benchmark_e2e import percentile
+
+
+# ---------------------- Settings ------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+MOCK_PORT = 8104
+APP_PORT = 8105
+
+SCENARIOS = {
+    # Fixed 60 s read timeout, never fails fast
+    "off": {"BREAKER_ENABLED": "0"},
+    "on": {"BREAKER_ENABLED": "1"},
+}
+
+
+def thread_count(pid):
+    # The dev server runs one thread per request: its thread count is the worker occupancy
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+# ---------------------- Load ------------------------
+async def run_load(args, server_pid):
+    """
+    Open-loop page uploads at args.rate per second through three phases: healthy, outage
+    (the mock hangs or fails every call), recovered
+    Returns: (list of (phase, status, seconds, answered), list of (phase, model calls in flight, threads),
+    seconds from the end of the outage to the first answered upload)
+    """
+    phases = [("healthy", args.healthy), ("outage", args.outage), ("recovered", args.recovered)]
+    images = iter(unique_images(int(args.rate * sum(seconds for _, seconds in phases)) + 10, seed=4))
+    results = []
+    samples = []
+    recovered_at = None
+    first_answer = None
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.client_timeout),
+                                     connector=aiohttp.TCPConnector(limit=0)) as client:
+        async def upload(phase, image_bytes):
+            nonlocal first_answer
+            form = aiohttp.FormData()
+            form.add_field("file", image_bytes, filename="meal.png", content_type="image/png")
+            start_time = time.perf_counter()
+            try:
+                async with client.post(f"http://127.0.0.1:{APP_PORT}/", data=form) as response:
+                    body = await response.text()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                body, status = "", "timeout"
+            answered = status == 200 and "Mock Dish" in body
+            if answered and recovered_at is not None and first_answer is None:
+                first_answer = time.perf_counter()
+            results.append((phase, status, time.perf_counter() - start_time, answered))
+
+        async def sample(phase_name):
+            async with client.get(f"http://127.0.0.1:{APP_PORT}/admission/stats") as response:
+                in_flight = (await response.json())["admission"]["in_flight"]
+            samples.append((phase_name(), in_flight, thread_count(server_pid)))
+
+        tasks = []
+        current = {"phase": None}
+        for phase, seconds in phases:
+            current["phase"] = phase
+            mode = args.fault if phase == "outage" else "ok"
+            async with client.post(f"http://127.0.0.1:{MOCK_PORT}/mock/fault", json={"mode": mode}) as response:
+                await response.read()
+            if phase == "recovered":
+                recovered_at = time.perf_counter()
+            phase_end = time.perf_counter() + seconds
+            next_sample = 0.0
+            while time.perf_counter() < phase_end:
+                tasks.append(asyncio.create_task(upload(phase, next(images))))
+                if time.perf_counter() >= next_sample:
+                    tasks.append(asyncio.create_task(sample(lambda: current["phase"])))
+                    next_sample = time.perf_counter() + 0.5
+                await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+
+    recovery = round(first_answer - recovered_at, 2) if first_answer is not None else None
+    return results, samples, recovery
+
+
+def summarize(name, results, samples, recovery):
+    rows = []
+    for phase in ("healthy", "outage", "recovered"):
+        phase_results = [row for row in results if row[0] == phase]
+        latencies = [seconds for _, _, seconds, _ in phase_results]
+        phase_samples = [row for row in samples if row[0] == phase]
+        rows.append({
+            "scenario": name,
+            "phase": phase,
+            "sent": len(phase_results),
+            "answered": sum(1 for row in phase_results if row[3]),
+            "failed": sum(1 for row in phase_results if row[1] == 200 and not row[3]),
+            "fast_503": sum(1 for row in phase_results if row[1] == 503),
+            "timed_out": sum(1 for row in phase_results if row[1] == "timeout"),
+            "p50_s": round(percentile(latencies, 0.50), 2) if latencies else None,
+            "p95_s": round(percentile(latencies, 0.95), 2) if latencies else None,
+            "mean_in_flight": round(sum(row[1] for row in phase_samples) / len(phase_samples), 1) if phase_samples else None,
+            "max_threads": max((row[2] for row in phase_samples), default=None),
+        })
+    rows[-1]["recovery_s"] = recovery
+    return rows
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Page uploads through a model outage: circuit breaker off vs on")
+    parser.add_argument("--rate", type=float, default=8.0, help="uploads per second")
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds per answer")
+    parser.add_argument("--fault", choices=["hang", "error"], default="hang", help="how the outage looks")
+    parser.add_argument("--healthy", type=float, default=10.0, help="seconds before the outage")
+    parser.add_argument("--outage", type=float, default=15.0, help="seconds of outage")
+    parser.add_argument("--recovered", type=float, default=15.0, help="seconds after the outage")
+    parser.add_argument("--client-timeout", type=float, default=30.0, help="seconds a client waits for the page")
+    parser.add_argument("--scenarios", default="off,on")
+    args = parser.parse_args()
+
+    env = dict(
+        os.environ,
+        QWEN_API_URL=f"http://127.0.0.1:{MOCK_PORT}/api/v1/chat/completions",
+        QWEN_API_KEY="mock",
+        PYTHONPATH=HERE,
+        # Noise images are smaller than the quality gate allows
+        QUALITY_GATE_ENABLED="0",
+        TRACE_SAMPLE_RATE="0",
+        TRACE_SLOW_SECONDS="inf",
+    )
+
+    rows = []
+    for name in args.scenarios.split(","):
+        workdir = tempfile.mkdtemp(prefix="bench_breaker_")
+        scenario_env = dict(env, BENCH_WORKDIR=workdir, **SCENARIOS[name])
+        mock = start([sys.executable, os.path.join(HERE, "mock_openrouter.py"), "--port", str(MOCK_PORT),
+                      "--latency", str(args.latency), "--jitter", str(args.latency / 5), "--seed", "0"],
+                     scenario_env, MOCK_PORT)
+        server = start([sys.executable, "-c", f"import final; final.app.run(port={APP_PORT}, threaded=True)"],
+                       scenario_env, APP_PORT)
+        try:
+            rows.extend(summarize(name, *asyncio.run(run_load(args, server.pid))))
+        finally:
+            for process in (server, mock):
+                process.kill()
+                process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.rate:g} uploads/s; mock answers in {args.latency} s, then {args.fault}s for {args.outage:g} s; "
+          f"clients give up after {args.client_timeout:g} s")
+    columns = ["scenario", "phase", "sent", "answered", "failed", "fast_503", "timed_out", "p50_s", "p95_s",
+               "mean_in_flight", "max_threads", "recovery_s"]
+    print(" ".join(f"{column:>14}" for column in columns))
+    for row in rows:
+        print(" ".join(f"{str(row.get(column, '')):>14}" for column in columns))
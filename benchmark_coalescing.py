@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmark_async import start, unique_images
+from benchmark_e2e import percentile
+
+
+# ---------------------- Settings ------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+MOCK_PORT = 8106
+APP_PORT = 8107
+
+
+# ---------------------- Load ------------------------
+async def drive(uploads, concurrency):
+    """
+    Returns: (wall seconds, latencies of answered uploads, failed uploads, mock stats, coalescing stats)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300),
+                                     connector=aiohttp.TCPConnector(limit=0)) as client:
+        async def upload(image_bytes):
+            nonlocal failures
+            async with semaphore:
+                form = aiohttp.FormData()
+                form.add_field("file", image_bytes, filename="meal.png", content_type="image/png")
+                start_time = time.perf_counter()
+                async with client.post(f"http://127.0.0.1:{APP_PORT}/", data=form) as response:
+                    body = await response.text()
+                if response.status == 200 and "Mock Dish" in body:
+                    latencies.append(time.perf_counter() - start_time)
+                else:
+                    failures += 1
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(upload(data) for data in uploads))
+        wall = time.perf_counter() - start_time
+        async with client.get(f"http://127.0.0.1:{MOCK_PORT}/mock/stats") as response:
+            mock_stats = await response.json()
+        async with client.get(f"http://127.0.0.1:{APP_PORT}/coalescing/stats") as response:
+            coalescing = await response.json()
+    return wall, latencies, failures, mock_stats, coalescing
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Duplicate-heavy upload burst: request coalescing off vs on")
+    parser.add_argument("--distinct", type=int, default=10, help="distinct photos")
+    parser.add_argument("--copies", type=int, default=20, help="uploads of each photo")
+    parser.add_argument("--concurrency", type=int, default=50, help="uploads in flight")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock seconds per answer")
+    parser.add_argument("--server", choices=["flask", "quart"], default="flask")
+    args = parser.parse_args()
+
+    uploads = unique_images(args.distinct, seed=5) * args.copies
+    random.Random(0).shuffle(uploads)
+    env = dict(
+        os.environ,
+        QWEN_API_URL=f"http://127.0.0.1:{MOCK_PORT}/api/v1/chat/completions",
+        QWEN_API_KEY="mock",
+        PYTHONPATH=HERE,
+        # Noise images are smaller than the quality gate allows
+        QUALITY_GATE_ENABLED="0",
+        TRACE_SAMPLE_RATE="0",
+        TRACE_SLOW_SECONDS="inf",
+    )
+    if args.server == "flask":
+        command = [sys.executable, "-c", f"import final; final.app.run(port={APP_PORT}, threaded=True)"]
+    else:
+        command = [sys.executable, "-m", "hypercorn", "async_app:app", "--bind", f"127.0.0.1:{APP_PORT}"]
+
+    print(f"{args.server}: {len(uploads)} uploads of {args.distinct} photos, {args.concurrency} in flight, "
+          f"mock answers in {args.latency} s")
+    print(f"{'coalescing':>10} {'model calls':>12} {'answered':>9} {'failed':>7} {'wall s':>7} {'p50 ms':>7} "
+          f"{'p95 ms':>7} {'shared':>7}")
+    for enabled in ("0", "1"):
+        workdir = tempfile.mkdtemp(prefix="bench_coalescing_")
+        run_env = dict(env, BENCH_WORKDIR=workdir, COALESCING_ENABLED=enabled)
+        mock = start([sys.executable, os.path.join(HERE, "mock_openrouter.py"), "--port", str(MOCK_PORT),
+                      "--latency", str(args.latency), "--jitter", str(args.latency / 5)], run_env, MOCK_PORT)
+        server = start(command, run_env, APP_PORT)
+        try:
+            wall, latencies, failures, mock_stats, coalescing = asyncio.run(drive(uploads, args.concurrency))
+        finally:
+            for process in (server, mock):
+                process.terminate()
+                process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(f"{'on' if enabled == '1' else 'off':>10} {mock_stats['served']:>12} {len(latencies):>9} {failures:>7} "
+              f"{wall:>7.1f} {1000 * percentile(latencies, 0.5):>7.0f} {1000 * percentile(latencies, 0.95):>7.0f} "
+              f"{coalescing['shared']:>7}")
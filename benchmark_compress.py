@@ -0,0 +1,85 @@
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from final import compress_image
+from image_encoder import encode_for_model
+
+
+# ---------------------- Settings ------------------------
+IMAGE_FOLDER = "images"
+MAX_SIZE_MB = 4.5
+ROUNDS = 3
+
+
+def time_encoder(encoder, image_bytes):
+    """
+    Run encoder ROUNDS times
+    Returns: (best wall time in ms, output size in bytes)
+    """
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        output = encoder(image_bytes, max_size_mb=MAX_SIZE_MB)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(output)
+
+
+def synthetic_phone_photo(width=4032, height=3024, seed=0):
+    """
+    12 MP high-detail JPEG, like a modern phone camera produces
+    The sample images mostly fit under the limit at quality 95 on the first try;
+    this one makes the old loop go through several re-encodes
+    Returns: JPEG bytes
+    """
+    rng = np.random.default_rng(seed)
+    base = Image.open(os.path.join(IMAGE_FOLDER, "32535.jpg")).convert("RGB").resize((width, height))
+    noisy = np.asarray(base, dtype=np.int16) + rng.integers(-40, 40, (height, width, 3), dtype=np.int16)
+    output = BytesIO()
+    Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8)).save(output, format="JPEG", quality=98)
+    return output.getvalue()
+
+
+def load_images(folder):
+    images = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        try:
+            with Image.open(path) as img:
+                size = img.size
+        except Exception:
+            continue
+        with open(path, "rb") as f:
+            images.append((name, size, f.read()))
+    return images
+
+
+if __name__ == "__main__":
+    images = load_images(IMAGE_FOLDER)
+    images.append(("synthetic 12 MP phone photo", (4032, 3024), synthetic_phone_photo()))
+    print(f"{'image':<45} {'size':>11} {'loop ms':>9} {'loop KB':>9} {'new ms':>8} {'new KB':>8}")
+    print("-" * 95)
+
+    totals = [0.0, 0, 0.0, 0]
+    for name, size, image_bytes in images:
+        loop_ms, loop_bytes = time_encoder(compress_image, image_bytes)
+        new_ms, new_bytes = time_encoder(encode_for_model, image_bytes)
+        totals[0] += loop_ms
+        totals[1] += loop_bytes
+        totals[2] += new_ms
+        totals[3] += new_bytes
+        print(
+            f"{name[:45]:<45} {size[0]:>5}x{size[1]:<5} {loop_ms:>9.1f} {loop_bytes / 1024:>9.1f}"
+            f" {new_ms:>8.1f} {new_bytes / 1024:>8.1f}"
+        )
+
+    print("-" * 95)
+    print(
+        f"{'TOTAL (' + str(len(images)) + ' images)':<57} {totals[0]:>9.1f} {totals[1] / 1024:>9.1f}"
+        f" {totals[2]:>8.1f} {totals[3] / 1024:>8.1f}"
+    )
+    print(f"Speedup: {totals[0] / totals[2]:.1f}x, output bytes: {totals[3] / totals[1]:.0%} of the loop")
@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+
+from benchmark_async import start, unique_images
+
+
+# ---------------------- Settings ------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGES_DIR = os.path.join(HERE, "images")
+MOCK_PORT = 8097
+APP_PORT = 8098
+
+# Mock model behaviour (arguments to mock_openrouter.py)
+PROFILES = {
+    # Every answer in about half a second, all plain JSON
+    "steady": ["--latency", "0.5", "--jitter", "0.1"],
+    # Long-tailed latency, a few 503s and the answer formats real models drift into
+    "realistic": ["--latency", "0.8", "--distribution", "lognormal", "--sigma", "0.6", "--error-rate", "0.02",
+                  "--formats", "json=0.7,fenced=0.1,prose=0.1,lines=0.1"],
+    # An overloaded provider: slow, erratic, one call in ten failing and some hanging for 10 s
+    "degraded": ["--latency", "1.5", "--distribution", "lognormal", "--sigma", "0.9", "--error-rate", "0.1",
+                 "--slow-rate", "0.05", "--slow-seconds", "10", "--formats", "json=0.5,fenced=0.25,lines=0.25"],
+}
+
+# Where each router backend finds the mock (see model_router.build_backend)
+BACKEND_URLS = {
+    "qwen": "/api/v1/chat/completions",
+    "llama": "/api/v1/chat/completions",
+    "grok": "/api/v1/chat/completions",
+    "claude": "/v1/messages",
+    "gemini": "/v1beta",
+}
+
+# Mirrored and rotated copies: each is a new photo to the caches and the perceptual index
+VARIANTS = [None, Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.FLIP_TOP_BOTTOM, Image.Transpose.ROTATE_90,
+            Image.Transpose.ROTATE_180, Image.Transpose.ROTATE_270, Image.Transpose.TRANSPOSE,
+            Image.Transpose.TRANSVERSE]
+
+_SAMPLE = re.compile(r'^(meal_[a-z_]+)(?:\{(.*)\})? (\S+)$')
+
+
+# ---------------------- Uploads ------------------------
+def load_uploads(count, seed=0):
+    """
+    The photos in images/ and their mirrored/rotated copies, shuffled; with more requests
+    than distinct photos the sequence repeats, so the repeats are cache hits
+    Returns: (list of (filename, JPEG bytes), number of distinct photos)
+    """
+    distinct = []
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        try:
+            with Image.open(os.path.join(IMAGES_DIR, name)) as image:
+                image = image.convert("RGB")
+        except OSError:
+            continue
+        for index, transpose in enumerate(VARIANTS):
+            buffer = BytesIO()
+            (image.transpose(transpose) if transpose is not None else image).save(buffer, format="JPEG", quality=90)
+            distinct.append((f"{index}_{os.path.splitext(name)[0]}.jpg", buffer.getvalue()))
+    random.Random(seed).shuffle(distinct)
+    return [distinct[i % len(distinct)] for i in range(count)], len(distinct)
+
+
+# ---------------------- Server process ------------------------
+def process_tree(pid):
+    """
+    Returns: pid and the pids of all its descendants (hypercorn serves from a child process)
+    """
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children = f.read().split()
+        except OSError:
+            continue
+        for child in children:
+            pids.extend(process_tree(int(child)))
+    return pids
+
+
+def process_usage(pid):
+    """
+    Returns: (CPU seconds, resident MB, peak resident MB) of a process and its children, from /proc
+    """
+    cpu = rss = peak = 0.0
+    for member in process_tree(pid):
+        with open(f"/proc/{member}/stat") as f:
+            # Fields after the parenthesised command name; utime and stime are the 12th and 13th
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{member}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss += int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak += int(line.split()[1]) / 1024
+    return cpu, rss, peak
+
+
+def scrape_metrics(body, since=None):
+    """
+    Stage timings, analyses and model calls from the app's /metrics text
+    since: /metrics text from before the run, subtracted (the warmup uploads)
+    Returns: dict with stages_ms (mean per stage), stage_counts, analyses and model_calls
+    """
+    sums, counts, analyses, model_calls = {}, {}, {}, {}
+    if since is not None:
+        before = scrape_metrics(since)
+        for stage, count in before["stage_counts"].items():
+            counts[stage] = -count
+            sums[stage] = -before["stages_ms"][stage] * count / 1000
+        analyses = {key: -value for key, value in before["analyses"].items()}
+        model_calls = {key: -value for key, value in before["model_calls"].items()}
+    for line in body.splitlines():
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.group(1), dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or "")), float(match.group(3))
+        if name == "meal_stage_seconds_sum":
+            sums[labels["stage"]] = sums.get(labels["stage"], 0.0) + value
+        elif name == "meal_stage_seconds_count":
+            counts[labels["stage"]] = counts.get(labels["stage"], 0) + int(value)
+        elif name == "meal_analyses_total":
+            key = f"{labels['source']}/{labels['outcome']}"
+            analyses[key] = analyses.get(key, 0) + int(value)
+        elif name == "meal_model_calls_total":
+            key = f"{labels['backend']}/{labels['status']}"
+            model_calls[key] = model_calls.get(key, 0) + int(value)
+    counts = {stage: count for stage, count in sorted(counts.items()) if count}
+    return {
+        "stages_ms": {stage: 1000 * sums[stage] / count for stage, count in counts.items()},
+        "stage_counts": counts,
+        "analyses": {key: value for key, value in analyses.items() if value},
+        "model_calls": {key: value for key, value in model_calls.items() if value},
+    }
+
+
+# ---------------------- Load ------------------------
+async def drive(port, uploads, concurrency):
+    """
+    Upload every image to the page endpoint with at most concurrency requests in flight
+    Returns: (wall seconds, per-request latencies, HTTP failures, /metrics text)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=600), connector=aiohttp.TCPConnector(limit=concurrency)
+    ) as client:
+        async def upload(filename, image_bytes):
+            nonlocal failures
+            async with semaphore:
+                form = aiohttp.FormData()
+                form.add_field("file", image_bytes, filename=filename, content_type="image/jpeg")
+                start_time = time.perf_counter()
+                try:
+                    async with client.post(f"http://127.0.0.1:{port}/", data=form) as response:
+                        await response.read()
+                        ok = response.status == 200
+                except aiohttp.ClientError:
+                    ok = False
+                latencies.append(time.perf_counter() - start_time)
+                failures += not ok
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(upload(filename, data) for filename, data in uploads))
+        wall = time.perf_counter() - start_time
+
+        async with client.get(f"http://127.0.0.1:{port}/metrics") as response:
+            metrics_text = await response.text()
+    return wall, latencies, failures, metrics_text
+
+
+def percentile(values, fraction):
+    # Nearest rank
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))]
+
+
+def run_level(args, env, uploads, concurrency):
+    """
+    One fresh app server (empty caches) under one concurrency level
+    Returns: result dict
+    """
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    level_env = dict(env, BENCH_WORKDIR=workdir)
+    if args.server == "flask":
+        command = [sys.executable, "-c", f"import final; final.app.run(port={APP_PORT}, threaded=True)"]
+    else:
+        command = [sys.executable, "-m", "hypercorn", "async_app:app", "--bind", f"127.0.0.1:{APP_PORT}",
+                   "--backlog", "2048"]
+    server = start(command, level_env, APP_PORT)
+    try:
+        # Imports, pools and connections warmed up on throwaway images
+        warmup = [(f"warmup_{i}.png", data) for i, data in enumerate(unique_images(args.warmup, seed=99))]
+        *_, warm_metrics = asyncio.run(drive(APP_PORT, warmup, max(1, min(concurrency, args.warmup))))
+
+        cpu_before, rss_before, _ = process_usage(server.pid)
+        wall, latencies, failures, metrics_text = asyncio.run(drive(APP_PORT, uploads, concurrency))
+        cpu_after, rss_after, rss_peak = process_usage(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    count = len(latencies)
+    stages = scrape_metrics(metrics_text, since=warm_metrics)
+    stages["stages_ms"] = {stage: round(ms, 3) for stage, ms in stages["stages_ms"].items()}
+    return {
+        "concurrency": concurrency,
+        "requests": count,
+        "failures": failures,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(count / wall, 2),
+        "latency_ms": {
+            "p50": round(1000 * percentile(latencies, 0.50), 1),
+            "p95": round(1000 * percentile(latencies, 0.95), 1),
+            "p99": round(1000 * percentile(latencies, 0.99), 1),
+            "max": round(1000 * max(latencies), 1),
+        },
+        "cpu_ms_per_request": round(1000 * (cpu_after - cpu_before) / count, 2),
+        "rss_mb": round(rss_after, 1),
+        "peak_rss_mb": round(rss_peak, 1),
+        "rss_kb_per_request": round(1024 * (rss_after - rss_before) / count, 1),
+        **stages,
+    }
+
+
+# ---------------------- Report ------------------------
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                               capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+    return commit + ("-dirty" if dirty else "") if commit else None
+
+
+def print_table(runs, baseline=None):
+    previous = {run["concurrency"]: run for run in (baseline or {}).get("runs", [])}
+    print(f"{'conc':>5} {'reqs':>6} {'fail':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f" {'cpu ms/req':>11} {'peak MB':>8}")
+    print("-" * 76)
+    for run in runs:
+        latency = run["latency_ms"]
+        print(f"{run['concurrency']:>5} {run['requests']:>6} {run['failures']:>5} {run['requests_per_second']:>8.1f}"
+              f" {latency['p50']:>8.1f} {latency['p95']:>8.1f} {latency['p99']:>8.1f}"
+              f" {run['cpu_ms_per_request']:>11.2f} {run['peak_rss_mb']:>8.1f}")
+        old = previous.get(run["concurrency"])
+        if old is not None:
+            def change(new_value, old_value):
+                return f"{100 * (new_value - old_value) / old_value:+.0f}%" if old_value else "n/a"
+            print(f"{'vs':>5} {baseline.get('commit') or 'baseline':>12} {'':>5}"
+                  f" {change(run['requests_per_second'], old['requests_per_second']):>8}"
+                  f" {change(latency['p50'], old['latency_ms']['p50']):>8}"
+                  f" {change(latency['p95'], old['latency_ms']['p95']):>8}"
+                  f" {change(latency['p99'], old['latency_ms']['p99']):>8}"
+                  f" {change(run['cpu_ms_per_request'], old['cpu_ms_per_request']):>11}"
+                  f" {change(run['peak_rss_mb'], old['peak_rss_mb']):>8}")
+
+    last = runs[-1]
+    print()
+    print(f"stage means at concurrency {last['concurrency']} (ms):")
+    for stage, ms in sorted(last["stages_ms"].items(), key=lambda item: -item[1]):
+        print(f"  {stage:<24} {ms:>9.2f}  x{last['stage_counts'][stage]}")
+    print(f"analyses: {last['analyses']}")
+    print(f"model calls: {last['model_calls']}")
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="End-to-end benchmark: the app under load against a local mock model server"
+    )
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic", help="mock model behaviour")
+    parser.add_argument("--backends", default="", help="route across mock providers, e.g. qwen,claude,gemini")
+    parser.add_argument("--server", choices=["flask", "quart"], default="flask", help="final.py or async_app.py")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated levels, each on a fresh server")
+    parser.add_argument("--requests", type=int, default=200, help="uploads per level")
+    parser.add_argument("--warmup", type=int, default=4, help="throwaway uploads before each level")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    uploads, distinct = load_uploads(args.requests, seed=args.seed)
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    env = dict(
+        os.environ,
+        QWEN_API_URL=mock_url + BACKEND_URLS["qwen"],
+        QWEN_API_KEY="mock",
+        MODEL_BACKENDS=",".join(backends),
+        PYTHONPATH=HERE,
+        TRACE_SAMPLE_RATE="0",
+        TRACE_SLOW_SECONDS="inf",
+    )
+    for name in backends:
+        env[f"{name.upper()}_API_URL"] = mock_url + BACKEND_URLS[name]
+        env[f"{name.upper()}_API_KEY"] = "mock"
+
+    mock = start(
+        [sys.executable, os.path.join(HERE, "mock_openrouter.py"), "--port", str(MOCK_PORT), "--seed", str(args.seed)]
+        + PROFILES[args.profile],
+        dict(env, BENCH_WORKDIR=HERE), MOCK_PORT,
+    )
+    try:
+        print(f"{args.server}, mock profile {args.profile}, backends {','.join(backends) or 'qwen (direct)'}, "
+              f"{args.requests} uploads per level ({min(args.requests, distinct)} distinct photos)")
+        runs = [run_level(args, env, uploads, int(level)) for level in args.concurrency.split(",")]
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    results = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "mock": PROFILES[args.profile],
+        "runs": runs,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print()
+    print_table(runs, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.output}")
@@ -0,0 +1,77 @@
+import argparse
+import random
+import re
+import time
+
+from nutrition_facts import NUTRIENTS, NutritionFacts, to_array, totals
+
+
+# ---------------------- Settings ------------------------
+LABELS = [(key, key.capitalize()) for key in NUTRIENTS]
+UNITS = {"calories": "kcal"}
+
+
+def make_meals(count, seed=0):
+    """
+    Returns: list of (display strings, NutritionFacts) per meal, like parse_nutrition_response produces
+    """
+    rng = random.Random(seed)
+    meals = []
+    for _ in range(count):
+        strings = {}
+        for key in NUTRIENTS:
+            low = rng.randint(50, 700) if key == "calories" else rng.randint(1, 60)
+            strings[key] = f"{low}-{low + rng.randint(0, low // 4 + 1)} {UNITS.get(key, 'g')}"
+        facts = NutritionFacts.from_strings(strings)
+        meals.append((facts.display(LABELS), facts))
+    return meals
+
+
+# ---------------------- Aggregations ------------------------
+RANGE = re.compile(r"(\d+(?:\.\d+)?)(?:\s*-\s*(\d+(?:\.\d+)?))?")
+
+
+def sum_strings(display_lists):
+    """What totals over nutrition_info strings take: split and regex every line on every read"""
+    low = dict.fromkeys(NUTRIENTS, 0.0)
+    high = dict.fromkeys(NUTRIENTS, 0.0)
+    for lines in display_lists:
+        for line in lines:
+            label, _, value = line.partition(": ")
+            match = RANGE.search(value)
+            if match:
+                key = label.lower()
+                low[key] += float(match.group(1))
+                high[key] += float(match.group(2) or match.group(1))
+    return low, high
+
+
+def best_of(runs, func, *args):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summing a user's meals: display strings vs typed arrays")
+    parser.add_argument("--meals", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    meals = make_meals(args.meals)
+    display_lists = [display for display, _ in meals]
+    stored = [facts.to_dict() for _, facts in meals]
+
+    string_seconds, (low, _) = best_of(args.runs, sum_strings, display_lists)
+    build_seconds, array = best_of(args.runs, to_array, stored)
+    sum_seconds, summed = best_of(args.runs, totals, array)
+
+    print(f"{args.meals} meals, best of {args.runs}")
+    print(f"  regex over display strings    {string_seconds * 1000:>9.2f} ms per total")
+    print(f"  build float32 array (once)    {build_seconds * 1000:>9.2f} ms, {array.nbytes / 1024:.0f} KB")
+    print(f"  vectorised totals             {sum_seconds * 1000:>9.3f} ms per total")
+    print(f"  calories: strings {low['calories']:.0f} kcal, array {summed['calories'].min:.0f} kcal")
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+# Keep final's caches out of the working tree
+workdir = tempfile.mkdtemp(prefix="bench_parser_")
+for name, filename in (("ANALYSIS_CACHE_PATH", "analysis.sqlite3"), ("PHASH_INDEX_PATH", "phash.sqlite3"),
+                       ("JOB_QUEUE_PATH", "jobs.sqlite3"), ("UPLOAD_STORE_PATH", "uploads")):
+    os.environ.setdefault(name, os.path.join(workdir, filename))
+
+from final import NUTRITION_FIELDS, parse_nutrition_response  # noqa: E402
+
+
+# ---------------------- Corpus ------------------------
+DISHES = [
+    ("Grilled Chicken Salad", "Mixed greens topped with sliced grilled chicken, cherry tomatoes and cucumber.",
+     ["320-380 kcal", "10-14 g", "4-6 g", "3-5 g", "32-38 g", "14-18 g"], "One large bowl, about 350 g"),
+    ("Pad Thai", "Stir-fried rice noodles with shrimp, egg, bean sprouts and crushed peanuts.",
+     ["520-600 kcal", "65-75 g", "10-14 g", "3-4 g", "20-25 g", "18-22 g"], "One restaurant plate, about 400 g"),
+    ("Margherita Pizza", "Two slices of thin-crust pizza with tomato sauce, mozzarella and basil.",
+     ["480-540 kcal", "55-62 g", "5-7 g", "2-3 g", "20-24 g", "18-22 g"], "Two slices, about 220 g"),
+    ("Greek Yogurt with Berries", "A bowl of plain yogurt topped with blueberries, strawberries and honey.",
+     ["210-250 kcal", "28-34 g", "22-26 g", "2-4 g", "14-17 g", "4-6 g"], "One bowl, about 250 g"),
+    ("Beef Burrito", "A large flour tortilla filled with seasoned beef, rice, beans and cheese.",
+     ["780-880 kcal", "85-95 g", "4-6 g", "9-12 g", "38-44 g", "30-36 g"], "One burrito, about 450 g"),
+]
+
+
+def answer(dish):
+    name, description, values, portion = dish
+    return {
+        "dish_name": name,
+        "description": description,
+        "nutrition": {key: value for (key, _), value in zip(NUTRITION_FIELDS, values)},
+        "portion_estimate": portion,
+    }
+
+
+def line_format(dish):
+    # What the Gemini/Claude prompts ask for
+    name, description, values, portion = dish
+    lines = [f"**{name}**", description, "---"]
+    lines += [f"{label}: {value}" for (_, label), value in zip(NUTRITION_FIELDS, values)]
+    lines += ["---", f"Looks like {values[0]}, {portion.lower()}."]
+    return "\n".join(lines)
+
+
+def make_corpus():
+    """
+    Returns: list of (variant, text, expected outcome: "answer", "error" or "unparseable")
+    """
+    corpus = []
+    for dish in DISHES:
+        data = answer(dish)
+        text = json.dumps(data)
+        corpus += [
+            ("clean", text, "answer"),
+            ("pretty", json.dumps(data, indent=2), "answer"),
+            ("fenced", f"```json\n{json.dumps(data, indent=2)}\n```", "answer"),
+            ("prose", f"Here is the nutrition analysis:\n{text}\nLet me know if you need more detail.", "answer"),
+            ("trailing comma", text.replace('"}', '",}'), "answer"),
+            ("single quotes", repr(data), "answer"),
+            ("truncated", text[: int(len(text) * 0.8)], "answer"),
+            ("line format", line_format(dish), "answer"),
+        ]
+    corpus += [
+        ("error", json.dumps({"error": "Please retake picture with better lighting and clear view of food"}), "error"),
+        ("error", "Please Retake Picture", "error"),
+        ("refusal", "I'm sorry, but I can't identify any food in this image.", "unparseable"),
+    ]
+    return corpus
+
+
+# ---------------------- Parsers ------------------------
+def legacy_parse(result_text):
+    """parse_nutrition_response before the tolerant parser: json.loads or nothing"""
+    try:
+        data = json.loads(result_text)
+        if "error" in data:
+            return {'dish_name': 'Error', 'description': data['error'], 'nutrition_info': [], 'portion_estimate': None}
+        nutrition_info = []
+        if "nutrition" in data:
+            nutrition_info = [f"{label}: {data['nutrition'].get(key, 'N/A')}" for key, label in NUTRITION_FIELDS]
+        return {
+            'dish_name': data.get('dish_name', 'Unknown Dish'),
+            'description': data.get('description', 'No description available'),
+            'nutrition_info': nutrition_info,
+            'portion_estimate': data.get('portion_estimate', None),
+        }
+    except json.JSONDecodeError:
+        if "API Error" in result_text or "Error:" in result_text:
+            return {'dish_name': 'Error', 'description': result_text, 'nutrition_info': [], 'portion_estimate': None}
+        return {'dish_name': 'Parsing Error', 'description': '', 'nutrition_info': [], 'portion_estimate': None}
+
+
+def outcome(parsed):
+    if parsed["dish_name"] == "Parsing Error":
+        return "unparseable"
+    if parsed["dish_name"] == "Error":
+        return "error"
+    return "answer" if parsed["nutrition_info"] else "unparseable"
+
+
+def measure(parse, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            parse(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Parse success rate and speed over a corpus of model answers")
+    argparser.add_argument("--repeat", type=int, default=200)
+    args = argparser.parse_args()
+
+    corpus = make_corpus()
+    random.Random(0).shuffle(corpus)
+    variants = sorted({variant for variant, _, _ in corpus}, key=[v for v, _, _ in make_corpus()].index)
+
+    print(f"{len(corpus)} answers, {args.repeat} passes")
+    print(f"{'variant':<16} {'legacy ok':>10} {'new ok':>8} {'legacy us':>10} {'new us':>8}")
+    print("-" * 56)
+    totals = {"legacy": 0, "new": 0}
+    for variant in variants:
+        cases = [(text, expected) for v, text, expected in corpus if v == variant]
+        texts = [text for text, _ in cases]
+        ok = {
+            name: sum(outcome(parse(text)) == expected for text, expected in cases)
+            for name, parse in (("legacy", legacy_parse), ("new", parse_nutrition_response))
+        }
+        for name in totals:
+            totals[name] += ok[name]
+        print(
+            f"{variant:<16} {ok['legacy']:>6}/{len(cases):<3} {ok['new']:>4}/{len(cases):<3}"
+            f" {measure(legacy_parse, texts, args.repeat):>10.1f} {measure(parse_nutrition_response, texts, args.repeat):>8.1f}"
+        )
+
+    texts = [text for _, text, _ in corpus]
+    print("-" * 56)
+    print(
+        f"{'all':<16} {100 * totals['legacy'] / len(corpus):>9.0f}% {100 * totals['new'] / len(corpus):>7.0f}%"
+        f" {measure(legacy_parse, texts, args.repeat):>10.1f} {measure(parse_nutrition_response, texts, args.repeat):>8.1f}"
+    )
@@ -0,0 +1,47 @@
+import random
+import time
+
+from phash_index import PerceptualIndex
+
+
+# ---------------------- Settings ------------------------
+STORED_HASHES = 1_000_000
+QUERIES = 10_000
+MAX_DISTANCE = 4
+
+
+def flip_bits(value, count):
+    for bit in random.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    index = PerceptualIndex(max_distance=MAX_DISTANCE)
+
+    start = time.perf_counter()
+    stored = [random.getrandbits(64) for _ in range(STORED_HASHES)]
+    for i, value in enumerate(stored):
+        index.add(value, i)
+    print(f"Indexed {len(index):,} hashes in {time.perf_counter() - start:.1f} s")
+
+    # Half the queries are near-duplicates of stored hashes, half are random misses
+    queries = []
+    for _ in range(QUERIES // 2):
+        queries.append(flip_bits(random.choice(stored), random.randint(0, MAX_DISTANCE)))
+        queries.append(random.getrandbits(64))
+
+    timings = []
+    found = 0
+    for query in queries:
+        start = time.perf_counter()
+        match = index.lookup(query)
+        timings.append(time.perf_counter() - start)
+        found += match is not None
+
+    timings.sort()
+    print(f"Queries: {len(queries):,}, matches: {found:,}")
+    print(f"Lookup p50: {timings[len(timings) // 2] * 1e6:.1f} us")
+    print(f"Lookup p99: {timings[int(len(timings) * 0.99)] * 1e6:.1f} us")
+    print(f"Lookup max: {timings[-1] * 1e6:.1f} us")
@@ -0,0 +1,135 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from model_router import AnthropicBackend, GeminiBackend, ModelRouter, OpenAIChatBackend, RouterError
+
+
+# ---------------------- Settings ------------------------
+# Three local stub providers with different personalities
+STUBS = {
+    # Fast, but one answer in 25 hangs for 5 s
+    "qwen": {"port": 8094, "args": ["--latency", "0.3", "--jitter", "0.05", "--slow-rate", "0.04", "--slow-seconds", "5"]},
+    # Slower and steady
+    "claude": {"port": 8095, "args": ["--latency", "0.6", "--jitter", "0.05"]},
+    # Quick, but 20% of calls come back 503
+    "gemini": {"port": 8096, "args": ["--latency", "0.4", "--jitter", "0.05", "--error-rate", "0.2"]},
+}
+PROMPT = "Return the nutrition JSON."
+
+
+def start_stub(name, port, extra_args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(here, "mock_openrouter.py"), "--port", str(port)] + extra_args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"stub {name} did not start on port {port}")
+
+
+def make_backends():
+    return {
+        "qwen": OpenAIChatBackend(
+            "qwen", f"http://127.0.0.1:{STUBS['qwen']['port']}/api/v1/chat/completions", "stub", "qwen-stub"
+        ),
+        "claude": AnthropicBackend(
+            "claude", f"http://127.0.0.1:{STUBS['claude']['port']}/v1/messages", "stub", "claude-stub", session="anthropic"
+        ),
+        "gemini": GeminiBackend(
+            "gemini", f"http://127.0.0.1:{STUBS['gemini']['port']}/v1beta", "stub", "gemini-stub", session="gemini"
+        ),
+    }
+
+
+def run(router, image, requests, concurrency):
+    """
+    Returns: (sorted latencies of successful requests, failures, answers per backend)
+    """
+    def one(_):
+        start = time.perf_counter()
+        try:
+            _, backend = router.analyze(image, PROMPT)
+        except RouterError:
+            return None, None
+        return time.perf_counter() - start, backend
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(one, range(requests)))
+    latencies = sorted(seconds for seconds, _ in outcomes if seconds is not None)
+    served = {}
+    for _, backend in outcomes:
+        if backend:
+            served[backend] = served.get(backend, 0) + 1
+    return latencies, sum(1 for seconds, _ in outcomes if seconds is None), served
+
+
+def report(name, latencies, failures, served, counters=None):
+    def pct(fraction):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] if latencies else float("nan")
+
+    mix = ", ".join(f"{backend} {count}" for backend, count in sorted(served.items()))
+    extra = ""
+    if counters:
+        extra = f"  hedges {counters['hedges']} (won {counters['hedge_wins']}), failovers {counters['failovers']}"
+    print(f"{name:<28} {pct(0.5):>7.2f} {pct(0.95):>7.2f} {pct(0.99):>7.2f} {failures:>6}  {mix}{extra}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model router against three local stub providers")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    output = BytesIO()
+    Image.new("RGB", (64, 64), (200, 120, 40)).save(output, format="JPEG")
+    image = output.getvalue()
+
+    stubs = {name: start_stub(name, stub["port"], stub["args"]) for name, stub in STUBS.items()}
+    try:
+        backends = make_backends()
+        print(f"{args.requests} requests, {args.concurrency} concurrent")
+        print(f"{'setup':<28} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'fail':>6}  answered by")
+        print("-" * 100)
+
+        for name, backend in backends.items():
+            latencies, failures, served = run(ModelRouter([backend], hedge_after=0), image, args.requests, args.concurrency)
+            report(f"{name} only", latencies, failures, served)
+
+        router = ModelRouter(backends.values(), hedge_after=0)
+        report("router, no hedging", *run(router, image, args.requests, args.concurrency), router.counters)
+
+        router = ModelRouter(backends.values())
+        report("router, hedge at p95", *run(router, image, args.requests, args.concurrency), router.counters)
+
+        # Outage: the fastest provider goes away mid-run
+        stubs["qwen"].terminate()
+        stubs["qwen"].wait()
+        report("router, qwen down", *run(router, image, args.requests, args.concurrency), router.counters)
+
+        print("\nRolling stats after the outage:")
+        for name, snapshot in router.summary()["backends"].items():
+            p50 = f"{snapshot['p50_s']:.2f}" if snapshot["p50_s"] is not None else "-"
+            print(
+                f"  {name:<8} calls {snapshot['calls']:>4}  error rate {snapshot['error_rate']:.2f}"
+                f"  p50 {p50} s  healthy {snapshot['healthy']}"
+            )
+    finally:
+        for process in stubs.values():
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
@@ -0,0 +1,158 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+from food_screen import SCREEN_SIDE, screen_image
+from image_derivatives import DISPLAY_SIDES
+from image_encoder import load_for_model
+
+
+# ---------------------- Settings ------------------------
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SAMPLES_CSV = os.path.join(ROOT, "data", "screen_samples.csv")
+IMAGES_DIR = os.path.join(ROOT, "images")
+
+# Each food photo is also degraded the ways real retakes look; the model answers all of them "retake picture"
+DEGRADATIONS = {
+    "blurry": lambda image: image.filter(ImageFilter.GaussianBlur(max(image.size) / 100)),
+    "dark": lambda image: ImageEnhance.Brightness(image).enhance(0.1),
+    "washed out": lambda image: ImageEnhance.Contrast(image).enhance(0.1),
+    "too small": lambda image: image.resize((96, max(1, round(96 * image.height / image.width)))),
+}
+
+
+# ---------------------- Sample set ------------------------
+def load_samples():
+    """
+    The labelled photos in images/ (see data/screen_samples.csv) plus degraded copies of the food ones
+    Returns: list of (name, category, expected "call" or "reject", labelled simple, JPEG/PNG bytes)
+    """
+    samples = []
+    with open(SAMPLES_CSV, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            with open(os.path.join(IMAGES_DIR, row["file"]), "rb") as image_file:
+                data = image_file.read()
+            food = row["label"] == "food"
+            samples.append((row["file"], row["label"], "call" if food else "reject", row["simple"] == "1", data))
+            if not food:
+                continue
+            image = load_for_model(data)
+            for category, degrade in DEGRADATIONS.items():
+                buffer = BytesIO()
+                degrade(image).save(buffer, format="JPEG", quality=90)
+                samples.append((f"{row['file']} ({category})", category, "reject", False, buffer.getvalue()))
+    return samples
+
+
+def screen_bytes(data):
+    """What the job and batch paths do: a draft decode at screening size, then the screen"""
+    start = time.perf_counter()
+    screening = screen_image(load_for_model(data, max_side=SCREEN_SIDE))
+    return screening.verdict, screening.simple, time.perf_counter() - start
+
+
+def camera_photo(data, size=(4000, 3000), seed=0):
+    """
+    Returns: JPEG bytes of a 12 MP "phone photo" made from a sample (upscaled, with sensor-like noise)
+    """
+    image = load_for_model(data).resize(size, Image.BICUBIC)
+    noise = np.random.default_rng(seed).integers(-6, 7, size=(size[1], size[0], 3), dtype=np.int16)
+    pixels = np.clip(np.asarray(image, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def best_ms(func, *args, runs=10):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency of the local pre-model screen and model calls it saves")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes for the throughput run")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the set for the latency figures")
+    args = parser.parse_args()
+
+    samples = load_samples()
+    print(f"{len(samples)} images: {sum(expected == 'call' for _, _, expected, _, _ in samples)} the model "
+          f"should see, {sum(expected == 'reject' for _, _, expected, _, _ in samples)} it would ask to retake")
+
+    # Latency, in this process
+    from_bytes = []
+    decoded = []
+    outcomes = []
+    for name, category, expected, labelled_simple, data in samples:
+        model_input = load_for_model(data)
+        for _ in range(args.repeat):
+            verdict, simple, seconds = screen_bytes(data)
+            from_bytes.append(seconds)
+            start = time.perf_counter()
+            screen_image(model_input)
+            decoded.append(time.perf_counter() - start)
+        outcomes.append((category, expected, labelled_simple, verdict, simple))
+
+    print()
+    print(f"{'latency per image':<40} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'draft decode + screen (jobs, batch)':<40} {1000 * percentile(from_bytes, 0.5):>8.2f}"
+          f" {1000 * percentile(from_bytes, 0.95):>8.2f}")
+    print(f"{'screen of the model-size decode':<40} {1000 * percentile(decoded, 0.5):>8.2f}"
+          f" {1000 * percentile(decoded, 0.95):>8.2f}")
+
+    # A full-size phone photo: the gate's cost on top of the decode every upload already pays
+    photo = camera_photo(samples[0][-1])
+    decoded_photo = load_for_model(photo)
+    thumb = decoded_photo.copy()
+    thumb.thumbnail((DISPLAY_SIDES["thumb"],) * 2, Image.BILINEAR, reducing_gap=2.0)
+    print()
+    print(f"12 MP JPEG ({len(photo) / 1e6:.1f} MB), best of 10")
+    print(f"  {'decode to model size (paid anyway)':<48} {best_ms(load_for_model, photo, runs=3):>8.2f} ms")
+    for label, image in (("thumbnail rendition (pages)", thumb), ("model-size decode (jobs, batch)", decoded_photo)):
+        print(f"  {'quality gate on ' + label:<48} {best_ms(lambda: screen_image(image, food=False)):>8.2f} ms")
+        print(f"  {'  with food checks':<48} {best_ms(lambda: screen_image(image)):>8.2f} ms")
+
+    # Throughput across a process pool, like batch.py's decode stage
+    with ProcessPoolExecutor(args.workers) as pool:
+        list(pool.map(screen_bytes, [data for *_, data in samples[: args.workers]]))
+        start = time.perf_counter()
+        list(pool.map(screen_bytes, [data for *_, data in samples] * args.repeat, chunksize=8))
+        elapsed = time.perf_counter() - start
+    print(f"{args.workers} worker process(es): {len(samples) * args.repeat / elapsed:.0f} images/s")
+
+    # Decisions
+    print()
+    print(f"{'category':<12} {'images':>7} {'called':>7} {'rejected':>9}")
+    print("-" * 38)
+    for category in ["food", "not_food"] + list(DEGRADATIONS):
+        rows = [verdict for cat, _, _, verdict, _ in outcomes if cat == category]
+        rejected = sum(verdict != "ok" for verdict in rows)
+        print(f"{category:<12} {len(rows):>7} {len(rows) - rejected:>7} {rejected:>9}")
+
+    should_reject = [verdict for _, expected, _, verdict, _ in outcomes if expected == "reject"]
+    saved = sum(verdict != "ok" for verdict in should_reject)
+    false_rejects = sum(verdict != "ok" for _, expected, _, verdict, _ in outcomes if expected == "call")
+    calls = sum(verdict == "ok" for *_, verdict, _ in outcomes)
+    print("-" * 38)
+    print(f"remote calls: {len(outcomes)} without the screen, {calls} with it "
+          f"({saved} of {len(should_reject)} retake answers saved, {false_rejects} food photos wrongly rejected)")
+
+    tagged = [(labelled, simple) for _, expected, labelled, verdict, simple in outcomes if expected == "call"]
+    hits = sum(labelled and simple for labelled, simple in tagged)
+    print(f"single-food tag (quick prompt): {sum(simple for _, simple in tagged)} tagged, {hits} of "
+          f"{sum(labelled for labelled, _ in tagged)} labelled single foods")
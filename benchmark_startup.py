@@ -0,0 +1,127 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmark_e2e import process_tree
+
+
+# ---------------------- Settings ------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORT = 8101
+
+
+def memory_kb(pid):
+    """
+    Returns: {"rss", "pss", "uss"} in kB. PSS splits pages shared with other processes
+    (the preloaded app in forked workers) between them; USS counts only private pages.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                values[name] = int(rest.split()[0])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def time_to_ready(command, env, workdir, timeout=60):
+    """
+    Start a server and poll the page until it answers
+    Returns: (Popen handle, seconds from spawn to the first 200, seconds for a second request)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{PORT}/", timeout=5) as response:
+                if response.status == 200:
+                    ready = time.perf_counter() - start
+                    break
+        except OSError:
+            time.sleep(0.02)
+    else:
+        process.kill()
+        raise RuntimeError(f"server did not start: {command}")
+
+    second = time.perf_counter()
+    urllib.request.urlopen(f"http://127.0.0.1:{PORT}/", timeout=5).read()
+    return process, ready, time.perf_counter() - second
+
+
+def import_seconds(env, workdir, module):
+    # A fresh interpreter each time: nothing cached in sys.modules
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=workdir, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def report_memory(label, pids):
+    rows = [(pid, memory_kb(pid)) for pid in pids]
+    for pid, memory in rows:
+        print(f"  {label + ' ' + str(pid):<28} {memory['rss'] / 1024:>8.1f} {memory['pss'] / 1024:>8.1f}"
+              f" {memory['uss'] / 1024:>8.1f}")
+        label = "worker"
+    total_pss = sum(memory["pss"] for _, memory in rows) / 1024
+    print(f"  {'total':<28} {sum(memory['rss'] for _, memory in rows) / 1024:>8.1f} {total_pss:>8.1f}")
+    return total_pss
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold start and per-worker memory: dev server vs gunicorn")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3, help="repeats of each start; the best is shown")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ, PYTHONPATH=HERE, QWEN_API_KEY="mock")
+    try:
+        imports = [import_seconds(env, workdir, "final") for _ in range(args.runs)]
+        print(f"import final (fresh interpreter): {1000 * min(imports):.0f} ms")
+
+        servers = {
+            "dev server (1 process)": [sys.executable, "-c",
+                                       f"import final; final.app.run(port={PORT}, threaded=True)"],
+            f"gunicorn ({args.workers} workers)": ["gunicorn", "-c", os.path.join(HERE, "gunicorn.conf.py"),
+                                                   "--bind", f"127.0.0.1:{PORT}", "--workers", str(args.workers)],
+        }
+        print()
+        print(f"{'server':<28} {'ready s':>8} {'2nd req ms':>11}")
+        total_pss = {}
+        for name, command in servers.items():
+            timings = []
+            for run in range(args.runs):
+                process, ready, second = time_to_ready(command, env, workdir)
+                timings.append((ready, second))
+                if run < args.runs - 1:
+                    process.terminate()
+                    process.wait()
+            ready, second = min(timings)
+            print(f"{name:<28} {ready:>8.2f} {1000 * second:>11.1f}")
+
+            # Memory of the last start, once every worker is up
+            expected = args.workers + 1 if "gunicorn" in name else 1
+            deadline = time.time() + 30
+            while len(process_tree(process.pid)) < expected and time.time() < deadline:
+                time.sleep(0.1)
+            print(f"  {'process':<28} {'RSS MB':>8} {'PSS MB':>8} {'USS MB':>8}")
+            total_pss[name] = report_memory("master" if "gunicorn" in name else "server", process_tree(process.pid))
+            process.terminate()
+            process.wait()
+
+        single, forked = total_pss.values()
+        print()
+        print(f"{args.workers} separate dev-server processes: ~{args.workers * single:.0f} MB;"
+              f" gunicorn with {args.workers} preloaded workers: {forked:.0f} MB (PSS)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
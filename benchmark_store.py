@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+
+import shared_store
+from benchmark_async import start, unique_images
+from benchmark_e2e import percentile
+from shared_store import open_store, pack
+
+
+# ---------------------- Settings ------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+MOCK_PORT = 8108
+NODE_PORTS = [8109, 8110]
+
+# A parsed analysis, as the perceptual index stores it (parse_nutrition_response of the mock's answer)
+SAMPLE_ANALYSIS = {
+    "dish_name": "Mock Dish",
+    "description": "Canned response from the local mock OpenRouter server.",
+    "nutrition_info": ["Calories: 150-180 kcal", "Carbohydrates: 20-25 g", "Sugars: 3-5 g", "Fiber: 2-4 g",
+                       "Protein: 15-20 g", "Fat: 5-8 g"],
+    "nutrition": {
+        "calories": {"min": 150.0, "max": 180.0, "unit": "kcal"},
+        "carbohydrates": {"min": 20.0, "max": 25.0, "unit": "g"},
+        "sugars": {"min": 3.0, "max": 5.0, "unit": "g"},
+        "fiber": {"min": 2.0, "max": 4.0, "unit": "g"},
+        "protein": {"min": 15.0, "max": 20.0, "unit": "g"},
+        "fat": {"min": 5.0, "max": 8.0, "unit": "g"},
+    },
+    "reference": None,
+    "portion_estimate": "Single serving, approximately 200g, total estimated 300-350 kcal",
+}
+
+
+# ---------------------- Store operations ------------------------
+def time_ops(store, count):
+    """
+    Returns: {operation: (p50 µs, p99 µs)} for set, get (hit), get (miss), take and append
+    """
+    value = pack([time.time(), json.dumps(SAMPLE_ANALYSIS)])
+    operations = {
+        "set": lambda i: store.set(f"bench:{i}", value, ttl=3600),
+        "get": lambda i: store.get(f"bench:{i}"),
+        "get_miss": lambda i: store.get(f"bench:missing:{i}"),
+        "take": lambda i: store.take(f"bench:client:{i % 50}", 1000.0, 1000),
+        "append": lambda i: store.append("bench:log", value, max_entries=1000, ttl=3600),
+    }
+    timings = {}
+    for name, operation in operations.items():
+        seconds = []
+        for i in range(count):
+            start_time = time.perf_counter()
+            operation(i)
+            seconds.append(time.perf_counter() - start_time)
+        timings[name] = (round(1e6 * percentile(seconds, 0.50)), round(1e6 * percentile(seconds, 0.99)))
+    return timings
+
+
+def sizes():
+    """
+    Returns: bytes of one parsed analysis as JSON and as stored (msgpack when installed, compressed)
+    """
+    as_json = len(json.dumps(SAMPLE_ANALYSIS, separators=(",", ":")).encode("utf-8"))
+    return as_json, len(pack(SAMPLE_ANALYSIS))
+
+
+# ---------------------- Two nodes ------------------------
+def variant(png_bytes):
+    # The same photo re-encoded: a different cache key, a near-identical perceptual hash
+    output = BytesIO()
+    Image.open(BytesIO(png_bytes)).convert("RGB").save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+
+async def run_nodes(args):
+    """
+    Every photo is uploaded to node A, then to node B, then a re-encoded copy to node A again;
+    then one client posts args.greedy uploads alternately to both nodes
+    Returns: {round: (model calls it caused, p50 ms, uploads answered)}, greedy uploads turned away
+    """
+    # New photos and client id each run: a Redis keeps what earlier runs stored
+    seed = int(time.time())
+    photos = unique_images(args.photos, seed=seed)
+    nodes = [f"http://127.0.0.1:{port}/" for port in NODE_PORTS]
+    rounds = [("first", photos, 0), ("other_node", photos, 1), ("reencoded", [variant(p) for p in photos], 0)]
+    results = {}
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300),
+                                     connector=aiohttp.TCPConnector(limit=0)) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def served():
+            async with client.get(f"http://127.0.0.1:{MOCK_PORT}/mock/stats") as response:
+                return (await response.json())["served"]
+
+        async def upload(url, image_bytes, client_id):
+            async with semaphore:
+                form = aiohttp.FormData()
+                form.add_field("file", image_bytes, filename="meal.png", content_type="image/png")
+                start_time = time.perf_counter()
+                async with client.post(url, data=form, headers={"X-Client-Id": client_id}) as response:
+                    body = await response.text()
+                return response.status, time.perf_counter() - start_time, "Mock Dish" in body
+
+        for name, images, node in rounds:
+            before = await served()
+            outcomes = await asyncio.gather(*(upload(nodes[node], data, f"user-{i}") for i, data in enumerate(images)))
+            answered = [seconds for status, seconds, ok in outcomes if status == 200 and ok]
+            results[name] = (await served() - before, round(1000 * percentile(answered, 0.50)) if answered else None,
+                             len(answered))
+
+        greedy = []
+        for i in range(args.greedy):
+            status, _, _ = await upload(nodes[i % 2], photos[0], f"greedy-{seed}")
+            greedy.append(status)
+    return results, greedy.count(429)
+
+
+def node_command(port, workers):
+    return ["gunicorn", "-c", os.path.join(HERE, "gunicorn.conf.py"), "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers)]
+
+
+# ---------------------- Main ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared store: operation latency, and two server nodes with vs without it")
+    parser.add_argument("--redis", help="URL of a Redis to test as well, e.g. redis://127.0.0.1:6379/15 (its keys are left in place)")
+    parser.add_argument("--ops", type=int, default=2000, help="store operations timed per kind")
+    parser.add_argument("--photos", type=int, default=24)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers per node")
+    parser.add_argument("--concurrency", type=int, default=12, help="uploads in flight")
+    parser.add_argument("--greedy", type=int, default=40, help="back-to-back uploads from one client (limit: 60/min, burst 10)")
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds per answer")
+    parser.add_argument("--scenarios", default="none,sqlite", help="none, sqlite and (with --redis) redis")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_store_")
+    stores = {"sqlite": f"sqlite:///{os.path.join(workdir, 'shared.sqlite3')}"}
+    if args.redis:
+        stores["redis"] = args.redis
+    scenarios = args.scenarios.split(",")
+    if args.redis and "redis" not in scenarios:
+        scenarios.append("redis")
+
+    as_json, as_stored = sizes()
+    print(f"parsed analysis: {as_json} bytes as JSON, {as_stored} bytes stored "
+          f"({'msgpack' if shared_store.msgpack is not None else 'JSON, msgpack not installed'}, zlib)")
+    print()
+    print(f"{'store':<8} " + " ".join(f"{name + ' p50/p99 µs':>22}" for name in ("set", "get", "get_miss", "take", "append")))
+    for name, url in stores.items():
+        store = open_store(url)
+        timings = time_ops(store, args.ops)
+        store.close()
+        print(f"{name:<8} " + " ".join(f"{f'{p50}/{p99}':>22}" for p50, p99 in timings.values()))
+
+    env = dict(
+        os.environ,
+        QWEN_API_URL=f"http://127.0.0.1:{MOCK_PORT}/api/v1/chat/completions",
+        QWEN_API_KEY="mock",
+        PYTHONPATH=HERE,
+        # Noise images are smaller than the quality gate allows
+        QUALITY_GATE_ENABLED="0",
+        CLIENT_RATE_PER_MINUTE="60",
+        CLIENT_BURST="10",
+        CLIENT_ID_HEADER="X-Client-Id",
+        WEB_THREADS="8",
+        TRACE_SAMPLE_RATE="0",
+        TRACE_SLOW_SECONDS="inf",
+    )
+    rows = []
+    try:
+        for scenario in scenarios:
+            scenario_dir = os.path.join(workdir, scenario)
+            os.makedirs(scenario_dir)
+            mock = start([sys.executable, os.path.join(HERE, "mock_openrouter.py"), "--port", str(MOCK_PORT),
+                          "--latency", str(args.latency), "--seed", "0"], dict(env, BENCH_WORKDIR=scenario_dir), MOCK_PORT)
+            servers = []
+            try:
+                for index, port in enumerate(NODE_PORTS):
+                    # Each node has its own working directory, so its own local cache files, as on its own host
+                    node_dir = os.path.join(scenario_dir, f"node{index}")
+                    os.makedirs(node_dir)
+                    node_env = dict(env, BENCH_WORKDIR=node_dir)
+                    if scenario != "none":
+                        node_env["SHARED_STORE_URL"] = stores[scenario]
+                    servers.append(start(node_command(port, args.workers), node_env, port))
+                results, limited = asyncio.run(run_nodes(args))
+                rows.append((scenario, results, limited))
+            finally:
+                for process in servers + [mock]:
+                    process.terminate()
+                    process.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print(f"2 nodes x {args.workers} gunicorn workers; {args.photos} photos to node A, again to node B, "
+          f"re-encoded to node A; then {args.greedy} uploads from one client (60/min, burst 10)")
+    columns = ["store", "first calls", "first p50 ms", "other_node calls", "other_node p50 ms",
+               "reencoded calls", "reencoded p50 ms", "greedy 429"]
+    print(" ".join(f"{column:>17}" for column in columns))
+    for scenario, results, limited in rows:
+        cells = [scenario]
+        for name in ("first", "other_node", "reencoded"):
+            calls, p50, _ = results[name]
+            cells.extend([calls, p50])
+        cells.append(limited)
+        print(" ".join(f"{str(cell):>17}" for cell in cells))
@@ -0,0 +1,142 @@
+import base64
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+# ---------------------- Settings ------------------------
+# A phone-camera sized upload
+PHOTO_SIZE = (4032, 3024)
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images", "32535.jpg")
+
+
+def make_photo(path):
+    # A real food photo blown up to phone-camera size, with sensor-like noise
+    rng = np.random.default_rng(0)
+    width, height = PHOTO_SIZE
+    base = Image.open(SAMPLE_IMAGE).convert("RGB").resize((width, height))
+    noisy = np.asarray(base, dtype=np.int16) + rng.integers(-20, 20, (height, width, 3), dtype=np.int16)
+    Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8)).save(path, format="JPEG", quality=92)
+
+
+def peak_rss_kb():
+    # VmHWM starts afresh at exec; ru_maxrss would carry over the parent's peak
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def request_body(compressed_image):
+    # What requests serialises for json=payload (see build_qwen_request)
+    encoded_image = base64.b64encode(compressed_image).decode("utf-8")
+    payload = {"messages": [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}},
+        {"type": "text", "text": "prompt"},
+    ]}]}
+    return json.dumps(payload).encode("utf-8")
+
+
+def before(upload_path, workdir):
+    """
+    The old index(): read the upload into memory, open it, save it again, inline it
+    as base64 in the page, hash it (decode 1) and encode it for the model (decode 2)
+    """
+    from image_encoder import encode_for_model
+    from phash_index import dhash
+
+    with open(upload_path, "rb") as file:
+        image_bytes = file.read()
+    image = Image.open(BytesIO(image_bytes))
+    shutil.copyfile(upload_path, os.path.join(workdir, "saved.jpg"))
+    page_img_src = f"data:image/jpeg;base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+    image_hash = dhash(image)
+    compressed_image = encode_for_model(image_bytes, max_size_mb=4.5)
+    body = request_body(compressed_image)
+    return image_hash, len(body), len(page_img_src)
+
+
+def after(upload_path, workdir):
+    """
+    The new index(): stream the upload to disk, decode once at model resolution
+    for both the hash and the model JPEG, link to the saved file from the page
+    """
+    from image_encoder import encode_image_for_model, load_for_model
+    from phash_index import dhash
+
+    saved_path = os.path.join(workdir, "saved.jpg")
+    with open(upload_path, "rb") as source, open(saved_path, "wb") as target:
+        shutil.copyfileobj(source, target)
+    page_img_src = "/static/uploads/saved.jpg"
+
+    image = load_for_model(saved_path)
+    image_hash = dhash(image)
+    compressed_image = encode_image_for_model(image, max_size_mb=4.5)
+    body = request_body(compressed_image)
+    return image_hash, len(body), len(page_img_src)
+
+
+def measure(variant, upload_path, workdir):
+    """
+    Runs in a fresh interpreter so each variant starts from the same baseline
+    Prints: JSON with peak RSS growth (MB), seconds and sizes
+    """
+    # Import everything up front so the baseline includes the libraries
+    import image_encoder  # noqa: F401
+    import phash_index  # noqa: F401
+
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    image_hash, body_bytes, page_bytes = {"before": before, "after": after}[variant](upload_path, workdir)
+    seconds = time.perf_counter() - start
+    peak = peak_rss_kb()
+    print(json.dumps({
+        "peak_rss_growth_mb": (peak - baseline) / 1024,
+        "seconds": seconds,
+        "dhash": f"{image_hash:016x}",
+        "request_body_kb": body_bytes / 1024,
+        "page_img_src_kb": page_bytes / 1024,
+    }))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4:
+        measure(*sys.argv[1:])
+        sys.exit(0)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="bench_upload_")
+    upload_path = os.path.join(workdir, "upload.jpg")
+    make_photo(upload_path)
+    print(f"Upload: {PHOTO_SIZE[0]}x{PHOTO_SIZE[1]} JPEG, {os.path.getsize(upload_path) / 1024 / 1024:.1f} MB")
+    print(f"{'pipeline':<10} {'peak RSS +MB':>13} {'seconds':>8} {'page img KB':>12} {'API body KB':>12}  dhash")
+    print("-" * 80)
+
+    try:
+        for variant in ("before", "after"):
+            runs = []
+            for _ in range(3):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), variant, upload_path, workdir],
+                    cwd=here, capture_output=True, text=True, check=True,
+                ).stdout
+                runs.append(json.loads(output))
+            best = min(runs, key=lambda r: r["seconds"])
+            peak = max(r["peak_rss_growth_mb"] for r in runs)
+            print(
+                f"{variant:<10} {peak:>13.1f} {best['seconds']:>8.2f} {best['page_img_src_kb']:>12.1f}"
+                f" {best['request_body_kb']:>12.1f}  {best['dhash']}"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
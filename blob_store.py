@@ -0,0 +1,311 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# ---------------------- Blob store ------------------------
+class BlobStore:
+    """
+    Content-addressed file store for uploads.
+
+    Each blob is stored once, under the sha256 of its bytes, at
+    root/ab/cd/abcd... (two levels of fan-out keep directories small).
+    Writes go to root/tmp first and are renamed into place, so readers never
+    see a partial file. An SQLite index tracks size, type, last access and a
+    reference count; gc() removes unreferenced blobs older than max_age_seconds
+    and then the least recently used ones until the store fits max_bytes.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    # Last-access times are only rewritten when they are at least this stale
+    TOUCH_INTERVAL = 60
+    # Age sweeps run at most this often; size-based eviction runs whenever the store is over budget
+    SWEEP_INTERVAL = 3600
+    # Temp files this old were left by a crash mid-write; younger ones may be another process's live write
+    STALE_TMP_SECONDS = 3600
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        # Absolute, so paths handed to send_file() do not depend on the app root
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.tmp_dir = os.path.join(self.root, "tmp")
+
+        self._local = threading.local()
+        # Serialises renames into place against gc() unlinking the same path
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        # Bytes in the store as this process knows it: its own puts and collections are added as they
+        # happen, and each gc() re-reads the table, which picks up what other processes stored
+        self._total = None
+        self.counters = {"puts": 0, "dedup_hits": 0, "gc_runs": 0, "gc_removed": 0, "gc_bytes": 0}
+
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " key TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mime TEXT,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL,"
+            " refs INTEGER NOT NULL DEFAULT 0)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS blobs_refs_accessed ON blobs (refs, accessed)")
+        # Blobs made from other blobs (resized renditions): (source key, variant name) -> blob key
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS derivatives ("
+            " source TEXT NOT NULL,"
+            " variant TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " PRIMARY KEY (source, variant))"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS derivatives_key ON derivatives (key)")
+        db.commit()
+
+        # Temp files left by a crash mid-write; every process opens the store, so only stale ones go
+        cutoff = time.time() - self.STALE_TMP_SECONDS
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30)
+            db.row_factory = sqlite3.Row
+        return db
+
+    def close(self):
+        """
+        Close this thread's index connection; the next call opens a fresh one.
+        Call before fork: an SQLite connection must not be used on both sides of one.
+        """
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    # ---------------------- Writing ------------------------
+    def put_stream(self, stream, mime=None, pin=False):
+        """
+        Copy a binary stream into the store, hashing it on the way
+        pin=True also takes a reference (see incref) before gc() can see the blob
+        Returns: key (sha256 hex digest of the content)
+        """
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, "wb") as f:
+                while True:
+                    chunk = stream.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            return self._commit(tmp_path, digest.hexdigest(), size, mime, pin)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put(self, data, mime=None, pin=False):
+        """
+        Returns: key of data (stored once, however often it is put)
+        """
+        key = hashlib.sha256(data).hexdigest()
+        if self._exists(key):
+            self._register(key, len(data), mime, pin)
+            self.counters["puts"] += 1
+            self.counters["dedup_hits"] += 1
+            return key
+
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            return self._commit(tmp_path, key, len(data), mime, pin)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _exists(self, key):
+        row = self._db().execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone()
+        return row is not None and os.path.exists(self.path(key))
+
+    def _commit(self, tmp_path, key, size, mime, pin):
+        final_path = self.path(key)
+        with self._lock:
+            # Register first: gc() only deletes rows it finds unchanged, so a blob
+            # being re-uploaded is never unlinked underneath the rename below
+            existed = self._register(key, size, mime, pin)
+            if existed and os.path.exists(final_path):
+                self.counters["dedup_hits"] += 1
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+                if not existed and self._total is not None:
+                    self._total += size
+            self.counters["puts"] += 1
+        self.maybe_gc()
+        return key
+
+    def _register(self, key, size, mime, pin):
+        now = time.time()
+        db = self._db()
+        existed = db.execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone() is not None
+        db.execute(
+            "INSERT INTO blobs (key, size, mime, created, accessed, refs) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET accessed = excluded.accessed, refs = blobs.refs + excluded.refs,"
+            " mime = COALESCE(blobs.mime, excluded.mime)",
+            (key, size, mime, now, now, int(pin)),
+        )
+        db.commit()
+        return existed
+
+    # ---------------------- Reading ------------------------
+    def get(self, key):
+        """
+        Returns: dict with path, size, mime, created (and marks the blob used) or None
+        """
+        row = self._db().execute("SELECT * FROM blobs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        path = self.path(key)
+        if not os.path.exists(path):
+            # Removed by another process's gc() between its row delete and ours
+            self._forget(key)
+            return None
+        if time.time() - row["accessed"] > self.TOUCH_INTERVAL:
+            db = self._db()
+            db.execute("UPDATE blobs SET accessed = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+        return {"key": key, "path": path, "size": row["size"], "mime": row["mime"], "created": row["created"]}
+
+    def read(self, key):
+        """
+        Returns: blob bytes or None
+        """
+        blob = self.get(key)
+        if blob is None:
+            return None
+        with open(blob["path"], "rb") as f:
+            return f.read()
+
+    # ---------------------- Derivatives ------------------------
+    def link(self, source, variant, key):
+        """Record blob key as the variant rendition of blob source"""
+        db = self._db()
+        db.execute(
+            "INSERT OR REPLACE INTO derivatives (source, variant, key) VALUES (?, ?, ?)", (source, variant, key)
+        )
+        db.commit()
+
+    def derivative(self, source, variant):
+        """
+        Returns: key of the variant rendition of source, or None
+        """
+        row = self._db().execute(
+            "SELECT key FROM derivatives WHERE source = ? AND variant = ?", (source, variant)
+        ).fetchone()
+        return row["key"] if row else None
+
+    # ---------------------- References ------------------------
+    def incref(self, key):
+        """Pin a blob (e.g. while a job still needs it); pinned blobs are never collected"""
+        db = self._db()
+        db.execute("UPDATE blobs SET refs = refs + 1 WHERE key = ?", (key,))
+        db.commit()
+
+    def decref(self, key):
+        db = self._db()
+        db.execute("UPDATE blobs SET refs = MAX(refs - 1, 0), accessed = ? WHERE key = ?", (time.time(), key))
+        db.commit()
+
+    # ---------------------- Garbage collection ------------------------
+    def total_bytes(self):
+        """
+        Returns: bytes of every blob in the index (sums the table; see _total for the running count)
+        """
+        return self._db().execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def maybe_gc(self):
+        if self._total is None:
+            self._total = self.total_bytes()
+        if time.time() - self._last_sweep > self.SWEEP_INTERVAL or self._total > self.max_bytes:
+            self.gc()
+
+    def gc(self):
+        """
+        Remove unreferenced blobs past max_age_seconds, then least recently used
+        unreferenced blobs until the store is back under 90% of max_bytes
+        Returns: (blobs removed, bytes freed)
+        """
+        self._last_sweep = time.time()
+        db = self._db()
+        cutoff = time.time() - self.max_age_seconds
+        victims = db.execute(
+            "SELECT key, size, accessed FROM blobs WHERE refs = 0 AND accessed < ?", (cutoff,)
+        ).fetchall()
+
+        total = self.total_bytes()
+        excess = total - sum(row["size"] for row in victims) - int(self.max_bytes * 0.9)
+        if excess > 0:
+            expired = {row["key"] for row in victims}
+            for row in db.execute("SELECT key, size, accessed FROM blobs WHERE refs = 0 ORDER BY accessed"):
+                if excess <= 0:
+                    break
+                if row["key"] in expired:
+                    continue
+                victims.append(row)
+                excess -= row["size"]
+
+        removed = freed = 0
+        for row in victims:
+            with self._lock:
+                # Skip blobs touched, re-uploaded or pinned since the scan
+                deleted = db.execute(
+                    "DELETE FROM blobs WHERE key = ? AND refs = 0 AND accessed = ?", (row["key"], row["accessed"])
+                ).rowcount
+                db.commit()
+                if deleted:
+                    # Renditions stay collectable blobs of their own; only the links go
+                    db.execute("DELETE FROM derivatives WHERE source = ? OR key = ?", (row["key"], row["key"]))
+                    db.commit()
+                    try:
+                        os.remove(self.path(row["key"]))
+                    except FileNotFoundError:
+                        pass
+                    removed += 1
+                    freed += row["size"]
+
+        self._total = total - freed
+        self.counters["gc_runs"] += 1
+        self.counters["gc_removed"] += removed
+        self.counters["gc_bytes"] += freed
+        return removed, freed
+
+    def _forget(self, key):
+        db = self._db()
+        db.execute("DELETE FROM blobs WHERE key = ?", (key,))
+        db.execute("DELETE FROM derivatives WHERE source = ? OR key = ?", (key, key))
+        db.commit()
+
+    def stats(self):
+        db = self._db()
+        count, total, pinned = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refs > 0), 0) FROM blobs"
+        ).fetchone()
+        return dict(self.counters, blobs=count, bytes=total, pinned=pinned, max_bytes=self.max_bytes)
@@ -0,0 +1,270 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# ---------------------- Settings ------------------------
+# One breaker per model backend ("qwen", "claude", ...), shared by the direct calls in
+# final.py and the router. BREAKER_ENABLED=0 keeps the fixed BREAKER_TIMEOUT_MAX and never opens.
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "1") == "1"
+
+# Open after this many failures in a row, or when at least BREAKER_ERROR_RATE of the calls in
+# the last BREAKER_WINDOW_SECONDS failed (with BREAKER_MIN_CALLS calls or more)
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "30"))
+
+# Stay open this long before letting a probe through; each failed probe doubles it, up to the max
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "10"))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "120"))
+# Calls let through at once while half-open
+BREAKER_PROBES = int(os.getenv("BREAKER_PROBES", "1"))
+
+# Read timeout: BREAKER_TIMEOUT_MULTIPLIER x the p99 of recent successful calls, kept between
+# the min and max; the max until BREAKER_TIMEOUT_SAMPLES calls have succeeded
+BREAKER_TIMEOUT_MIN = float(os.getenv("BREAKER_TIMEOUT_MIN", "10"))
+BREAKER_TIMEOUT_MAX = float(os.getenv("BREAKER_TIMEOUT_MAX", "60"))
+BREAKER_TIMEOUT_MULTIPLIER = float(os.getenv("BREAKER_TIMEOUT_MULTIPLIER", "2"))
+BREAKER_TIMEOUT_SAMPLES = 20
+LATENCY_HISTORY = 500
+
+CONNECT_TIMEOUT = 5.0
+
+# Exported as a gauge: meal_breaker_<backend>_state
+STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpen(Exception):
+    """The backend's breaker is open: the call was not made; retry_after is whole seconds"""
+
+    def __init__(self, backend, retry_after):
+        super().__init__(f"{backend} is unavailable, retry in {retry_after} s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+# ---------------------- Breaker ------------------------
+class Attempt:
+    """
+    One call through a breaker (see CircuitBreaker.attempt)
+    timeout: (connect, read) seconds for requests; probe: True while half-open
+    """
+
+    __slots__ = ("timeout", "probe", "started", "outcome")
+
+    def __init__(self, timeout, probe):
+        self.timeout = timeout
+        self.probe = probe
+        self.started = None
+        self.outcome = None
+
+    def start(self):
+        """Mark the moment the request goes out (after any queueing), for the latency sample"""
+        self.started = time.monotonic()
+
+    def success(self):
+        self.outcome = True
+
+    def failure(self):
+        self.outcome = False
+
+    def skip(self):
+        """The backend answered, but not in a way that says anything about its health (a 4xx)"""
+        self.started = None
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and their outcomes are counted. Too many failures open it.
+    Open: calls fail at once with CircuitOpen, for open_seconds.
+    Half-open: up to `probes` calls go through; a success closes the breaker, a failure opens
+    it again for twice as long (up to max_open_seconds).
+
+        with breaker.attempt() as attempt:
+            attempt.start()
+            response = session.post(url, timeout=attempt.timeout)
+            if response.status_code >= 500:
+                attempt.failure()
+
+    An exception after start() counts as a failure, a block left without one as a success
+    (unless success()/failure() said otherwise); a block left before start(), e.g. shed by
+    admission control, or after skip() counts as nothing.
+    """
+
+    def __init__(self, name, enabled=BREAKER_ENABLED, failures=BREAKER_FAILURES, error_rate=BREAKER_ERROR_RATE,
+                 min_calls=BREAKER_MIN_CALLS, window_seconds=BREAKER_WINDOW_SECONDS,
+                 open_seconds=BREAKER_OPEN_SECONDS, max_open_seconds=BREAKER_MAX_OPEN_SECONDS,
+                 probes=BREAKER_PROBES):
+        self.name = name
+        self.enabled = enabled
+        self.failures = failures
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probes = probes
+
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._closed_at = 0.0
+        self._open_for = open_seconds
+        self._probes_out = 0
+        self._consecutive = 0
+        # (time, ok) of recent calls, and the seconds of recent successful ones
+        self._outcomes = deque()
+        self._latencies = deque(maxlen=LATENCY_HISTORY)
+        self._timeout = BREAKER_TIMEOUT_MAX
+        self.counters = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0, "probes": 0}
+
+    # ---------------------- Caller side ------------------------
+    @contextmanager
+    def attempt(self):
+        """
+        Raises CircuitOpen while the breaker is open (or its probes are all out)
+        Yields: Attempt
+        """
+        attempt = self._enter()
+        try:
+            yield attempt
+        except Exception:
+            if attempt.started is not None and attempt.outcome is None:
+                attempt.outcome = False
+            raise
+        finally:
+            self._exit(attempt)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            calls = len(self._outcomes)
+            latencies = sorted(self._latencies)
+            return dict(
+                self.counters,
+                state=STATES[self.state],
+                state_name=self.state,
+                open_remaining_s=round(max(0.0, self._opened_at + self._open_for - now), 1)
+                if self.state == "open" else 0.0,
+                consecutive_failures=self._consecutive,
+                window_calls=calls,
+                window_error_rate=round(sum(1 for _, ok in self._outcomes if not ok) / calls, 3) if calls else 0.0,
+                p50_s=round(_percentile(latencies, 0.50), 3) if latencies else None,
+                p99_s=round(_percentile(latencies, 0.99), 3) if latencies else None,
+                timeout_s=round(self._timeout, 2),
+            )
+
+    # ---------------------- Internals ------------------------
+    def _enter(self):
+        if not self.enabled:
+            return Attempt((CONNECT_TIMEOUT, BREAKER_TIMEOUT_MAX), False)
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open" and now >= self._opened_at + self._open_for:
+                self.state = "half_open"
+            if self.state == "closed":
+                return Attempt((CONNECT_TIMEOUT, self._timeout), False)
+            if self.state == "half_open" and self._probes_out < self.probes:
+                self._probes_out += 1
+                self.counters["probes"] += 1
+                return Attempt((CONNECT_TIMEOUT, self._timeout), True)
+            self.counters["rejected"] += 1
+            if self.state == "open":
+                retry_after = self._opened_at + self._open_for - now
+            else:
+                # A probe is out; it will answer within the timeout
+                retry_after = self._timeout
+            raise CircuitOpen(self.name, max(1, int(retry_after + 0.999)))
+
+    def _exit(self, attempt):
+        if not self.enabled and attempt.started is None:
+            return
+        with self._lock:
+            if attempt.probe:
+                self._probes_out -= 1
+            if attempt.started is None:
+                # Never sent: no verdict on the backend
+                return
+            ok = attempt.outcome is not False
+            now = time.monotonic()
+            self.counters["calls"] += 1
+            self._outcomes.append((now, ok))
+            self._trim(now)
+            if ok:
+                self._consecutive = 0
+                self._latencies.append(now - attempt.started)
+                self._update_timeout()
+                if self.state != "closed" and attempt.probe:
+                    self.state = "closed"
+                    self._closed_at = now
+                    self._open_for = self.open_seconds
+                    self._outcomes.clear()
+                return
+
+            self.counters["failures"] += 1
+            if attempt.started < self._closed_at:
+                # Sent during the outage a probe has since seen end: nothing new about the backend
+                return
+            self._consecutive += 1
+            if not self.enabled:
+                return
+            if attempt.probe:
+                self._open(now, self._open_for * 2)
+            elif self.state == "closed" and self._should_open():
+                self._open(now, self.open_seconds)
+
+    def _should_open(self):
+        if self._consecutive >= self.failures:
+            return True
+        calls = len(self._outcomes)
+        failed = sum(1 for _, ok in self._outcomes if not ok)
+        return calls >= self.min_calls and failed / calls >= self.error_rate
+
+    def _open(self, now, seconds):
+        self.state = "open"
+        self._opened_at = now
+        self._open_for = min(seconds, self.max_open_seconds)
+        self.counters["opened"] += 1
+
+    def _trim(self, now):
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def _update_timeout(self):
+        if len(self._latencies) < BREAKER_TIMEOUT_SAMPLES:
+            return
+        p99 = _percentile(sorted(self._latencies), 0.99)
+        self._timeout = min(BREAKER_TIMEOUT_MAX, max(BREAKER_TIMEOUT_MIN, BREAKER_TIMEOUT_MULTIPLIER * p99))
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# ---------------------- Registry ------------------------
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(backend):
+    """
+    Shared breaker for a model backend ("qwen", "claude", ...), created on first use
+    Returns: CircuitBreaker
+    """
+    breaker = _breakers.get(backend)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(backend, CircuitBreaker(backend))
+    return breaker
+
+
+def breaker_summary():
+    """
+    Returns: {backend: stats} for every breaker in use
+    """
+    return {name: breaker.stats() for name, breaker in sorted(_breakers.items())}
@@ -175,13 +175,17 @@
 
 
 import os
+import sys
 import base64
-import requests
 from io import BytesIO
 from flask import Flask, request, render_template
 from PIL import Image
 from dotenv import load_dotenv
 
+# Shared helpers (http_sessions.py) live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_sessions import get_session
+
 # Load environment variables
 load_dotenv()
 
@@ -303,7 +307,7 @@ Based on the visible amount: Provide **one single line** estimating the portion
     
     try:
         # Send request to Claude
-        response = requests.post(CLAUDE_API_URL, json=payload, headers=headers, timeout=60)
+        response = get_session("anthropic").post(CLAUDE_API_URL, json=payload, headers=headers, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
@@ -1,7 +1,11 @@
 import os
-import requests
+import sys
 from dotenv import load_dotenv
 
+# Shared helpers (http_sessions.py) live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_sessions import get_session
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -47,7 +51,7 @@ def test_claude_api():
         print(f"Model: {payload['model']}")
         print("-" * 50)
         
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = get_session("anthropic").post(url, json=payload, headers=headers, timeout=30)
         
         # Check response status
         if response.status_code == 200:
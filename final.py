@@ -1,12 +1,35 @@
 import os
+import random
+import threading
+import time
 import base64
-import requests
 import json
 from io import BytesIO
-from flask import Flask, request, render_template
+from flask import Flask, Response, abort, g, request, render_template, jsonify, send_file, url_for
 from PIL import Image
 from dotenv import load_dotenv
 
+from analysis_cache import AnalysisCache, make_cache_key, make_content_cache_key
+from blob_store import BlobStore
+from phash_index import PerceptualIndex, dhash
+from image_encoder import UPLOAD_MIME_TYPES, encode_for_model, encode_image_for_model, load_for_model, sniff_image
+from image_derivatives import DERIVATIVE_VERSION, DISPLAY_SIDES, ImageDerivatives
+from http_sessions import get_session, timing_summary
+from jobs import JobQueue
+from singleflight import SingleFlight
+from shared_store import open_store
+from streaming_json import IncrementalJsonParser
+from batch import iter_zip, run_batch, shutdown_cpu_pool
+from circuit_breaker import CircuitOpen, breaker_summary, get_breaker
+from micro_batch import MicroBatcher, UsageMeter
+from nutrition_parser import extract_json, parse_nutrition
+from nutrition_facts import NutritionFacts
+from nutrient_db import NutrientDB
+from food_screen import FoodScreen
+from model_router import RouterError, build_router
+from admission import AdmissionController, ClientLimiter, Overloaded, current_traffic, traffic
+from tracing import analyses, begin_trace, end_trace, metrics, model_calls, span, trace, traced
+
 
 # Load environment variables
 load_dotenv()
@@ -18,7 +41,182 @@ app = Flask(__name__)
 
 # ---------------------- OpenRouter API setup ------------------------
 QWEN_API_KEY = os.getenv("QWEN_API_KEY")
-QWEN_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+QWEN_API_URL = os.getenv("QWEN_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+QWEN_MODEL = "qwen/qwen3-vl-235b-a22b-instruct"
+
+# Stream tokens for background jobs so fields reach the page as soon as they are complete
+QWEN_STREAMING = os.getenv("QWEN_STREAMING", "1") == "1"
+
+# Bump whenever NUTRITION_PROMPT changes so cached answers for the old prompt are not reused
+PROMPT_VERSION = "1"
+
+# Gather concurrent non-streaming analyses into multi-image requests so the prompt is paid once per batch
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH_ENABLED", "0") == "1"
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "4"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "50"))
+
+# Route single-image analyses across several providers, e.g. MODEL_BACKENDS=qwen,claude,gemini
+# (empty: call Qwen directly). ROUTER_HEDGE_AFTER_SECONDS: fixed hedge delay, 0 = no hedging,
+# unset = the primary backend's rolling p95
+MODEL_BACKENDS = [name.strip() for name in os.getenv("MODEL_BACKENDS", "").split(",") if name.strip()]
+ROUTER_HEDGE_AFTER_SECONDS = os.getenv("ROUTER_HEDGE_AFTER_SECONDS")
+
+# Fill in and sanity-check nutrition from the bundled food table (data/foods.csv).
+# NUTRIENT_DB_QUICK_PROMPT=1: single uploads use NUTRITION_QUICK_PROMPT, which lets the
+# model skip the nutrition block for plain single foods the table covers
+NUTRIENT_DB_ENABLED = os.getenv("NUTRIENT_DB_ENABLED", "1") == "1"
+NUTRIENT_DB_QUICK_PROMPT = NUTRIENT_DB_ENABLED and os.getenv("NUTRIENT_DB_QUICK_PROMPT", "0") == "1"
+
+# Quality gate before the model call (see food_screen.py): too small, dark, overexposed,
+# flat and blurry photos get a retake answer with the reason at once, instead of a model
+# call that would only say the same. SCREEN_ENABLED adds the food checks: colourless frames
+# (screenshots, documents) are rejected too, and with the nutrient table on,
+# SCREEN_QUICK_PROMPT asks about a single food on a plain background with
+# NUTRITION_QUICK_PROMPT even when NUTRIENT_DB_QUICK_PROMPT is off
+QUALITY_GATE_ENABLED = os.getenv("QUALITY_GATE_ENABLED", "1") == "1"
+SCREEN_ENABLED = os.getenv("SCREEN_ENABLED", "0") == "1"
+SCREEN_QUICK_PROMPT = SCREEN_ENABLED and NUTRIENT_DB_ENABLED and os.getenv("SCREEN_QUICK_PROMPT", "1") == "1"
+if NUTRIENT_DB_QUICK_PROMPT or SCREEN_QUICK_PROMPT:
+    # Quick-prompt answers may rely on the table, so they are cached apart from full ones
+    PROMPT_VERSION += "q"
+
+# Admission control in front of the model API (see admission.py), per server process:
+# at most ADMISSION_MAX_CONCURRENCY calls in flight (the provider's concurrency quota divided
+# by WEB_WORKERS), up to ADMISSION_MAX_QUEUE waiting, page uploads ahead of /batch items.
+# A caller that would wait longer than its class's max wait gets a 503 with Retry-After at once.
+# UPSTREAM_TOKENS_PER_MINUTE: the provider's token quota per process (0 = none)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_INTERACTIVE_MAX_WAIT = float(os.getenv("ADMISSION_INTERACTIVE_MAX_WAIT", "15"))
+ADMISSION_BULK_MAX_WAIT = float(os.getenv("ADMISSION_BULK_MAX_WAIT", "300"))
+UPSTREAM_TOKENS_PER_MINUTE = float(os.getenv("UPSTREAM_TOKENS_PER_MINUTE", "0")) or None
+
+# Analysis requests (POST /, /jobs, /batch) per client per minute, with bursts of CLIENT_BURST
+# (0 = no limit). Clients are told apart by CLIENT_ID_HEADER (e.g. X-API-Key) when set and sent,
+# else by address; behind a proxy, pass the real address with X-Forwarded-For and ProxyFix
+CLIENT_RATE_PER_MINUTE = float(os.getenv("CLIENT_RATE_PER_MINUTE", "0"))
+CLIENT_BURST = int(os.getenv("CLIENT_BURST", "10"))
+CLIENT_ID_HEADER = os.getenv("CLIENT_ID_HEADER")
+
+# Identical uploads (same content hash) arriving while one is being analyzed wait for that
+# analysis instead of starting their own (see singleflight.py)
+COALESCING_ENABLED = os.getenv("COALESCING_ENABLED", "1") == "1"
+
+# Analyses, perceptual hashes and client rate limits kept where every worker process (and host)
+# sees them: "sqlite:///cache/shared.sqlite3" for one host, "redis://host:6379/0" for several
+# (see shared_store.py). Unset: per-host SQLite files, and rate limits per process
+SHARED_STORE_URL = os.getenv("SHARED_STORE_URL")
+
+
+# ---------------------- Analysis cache ------------------------
+shared_store = open_store(SHARED_STORE_URL) if SHARED_STORE_URL else None
+
+# With a shared store, the memory tier is its near-cache
+analysis_cache = AnalysisCache(
+    path=os.getenv("ANALYSIS_CACHE_PATH", os.path.join("cache", "analysis.sqlite3")),
+    max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "512")),
+    max_disk_mb=float(os.getenv("ANALYSIS_CACHE_MAX_DISK_MB", "256")),
+    ttl_seconds=int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+    store=shared_store,
+)
+
+nutrient_db = NutrientDB(
+    path=os.getenv("NUTRIENT_DB_PATH", os.path.join("cache", "nutrients.sqlite3")),
+) if NUTRIENT_DB_ENABLED else None
+
+food_screen = FoodScreen(food=SCREEN_ENABLED) if QUALITY_GATE_ENABLED or SCREEN_ENABLED else None
+
+# Near-duplicate uploads (re-encoded, resized, lightly cropped) reuse a stored parsed result;
+# results are kept as long as cached analyses, and only for the current model and prompt
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+phash_index = PerceptualIndex(
+    path=os.getenv("PHASH_INDEX_PATH", os.path.join("cache", "phash.sqlite3")),
+    max_distance=PHASH_MAX_DISTANCE,
+    store=shared_store,
+    version=f"{QWEN_MODEL}:{PROMPT_VERSION}",
+    ttl_seconds=analysis_cache.ttl_seconds,
+    max_entries=int(os.getenv("PHASH_INDEX_MAX_ENTRIES", "100000")),
+)
+
+
+# ===== UPDATED JSON PROMPT =====
+NUTRITION_PROMPT = """You are a professional nutrition analyst AI. Analyze the food in the image and return your response in STRICT JSON format.
+
+OUTPUT FORMAT (Must be valid JSON):
+{
+  "dish_name": "Name of the dish or food item",
+  "description": "2-3 sentences describing the dish, visible ingredients, and presentation style",
+  "nutrition": {
+    "calories": "150-180 kcal",
+    "carbohydrates": "20-25 g",
+    "sugars": "3-5 g",
+    "fiber": "2-4 g",
+    "protein": "15-20 g",
+    "fat": "5-8 g"
+  },
+  "portion_estimate": "Single serving, approximately 200g, total estimated 300-350 kcal"
+}
+
+CRITICAL RULES:
+1. ALWAYS return valid JSON - no markdown, no code blocks, no extra text
+2. If food is unclear or image quality is poor, return: {"error": "Please retake picture with better lighting and clear view of food"}
+3. Use ranges for all nutritional values (e.g., "150-180" not just "150")
+4. Base ALL estimates on VISIBLE food only - do not assume hidden ingredients
+5. Be specific about ingredients you can identify in the image
+6. Include portion size and total calorie estimate in "portion_estimate"
+7. For mixed dishes, provide combined nutritional values
+8. If multiple items visible, analyze as one complete meal
+
+Remember: Output MUST be parseable JSON with no additional formatting or explanation."""
+
+
+# Shorter prompt for NUTRIENT_DB_QUICK_PROMPT: plain single foods are answered with a weight
+# only, and their nutrition comes from nutrient_db
+NUTRITION_QUICK_PROMPT = """You are a professional nutrition analyst AI. Identify the food in the image and return STRICT JSON only:
+{
+  "dish_name": "Name of the dish or food item",
+  "description": "1-2 sentences on the visible food and portion",
+  "portion_grams": 150,
+  "portion_estimate": "About 20 cherries, roughly 150 g",
+  "nutrition": {"calories": "150-180 kcal", "carbohydrates": "20-25 g", "sugars": "3-5 g", "fiber": "2-4 g", "protein": "15-20 g", "fat": "5-8 g"}
+}
+
+Leave out "nutrition" when the image shows one plain food (a single kind of fruit or vegetable, plain ice cream, bread, eggs); it is looked up from "portion_grams". Include it for prepared or mixed dishes, using ranges.
+If food is unclear, return: {"error": "Please retake picture with better lighting and clear view of food"}
+No markdown, no extra text."""
+
+
+# Same schema for several images in one request, answered as an array in image order
+NUTRITION_BATCH_PROMPT = """You are a professional nutrition analyst AI. Each image above is a separate meal, labelled "Image 1", "Image 2", ... Analyze every image on its own and return your response in STRICT JSON format.
+
+OUTPUT FORMAT (Must be a valid JSON array with exactly one object per image, in image order):
+[
+  {
+    "dish_name": "Name of the dish or food item",
+    "description": "2-3 sentences describing the dish, visible ingredients, and presentation style",
+    "nutrition": {
+      "calories": "150-180 kcal",
+      "carbohydrates": "20-25 g",
+      "sugars": "3-5 g",
+      "fiber": "2-4 g",
+      "protein": "15-20 g",
+      "fat": "5-8 g"
+    },
+    "portion_estimate": "Single serving, approximately 200g, total estimated 300-350 kcal"
+  }
+]
+
+CRITICAL RULES:
+1. ALWAYS return a valid JSON array - no markdown, no code blocks, no extra text
+2. If the food in one image is unclear or its quality is poor, use {"error": "Please retake picture with better lighting and clear view of food"} as that image's object
+3. Use ranges for all nutritional values (e.g., "150-180" not just "150")
+4. Base ALL estimates on VISIBLE food only - do not assume hidden ingredients
+5. Be specific about ingredients you can identify in each image
+6. Include portion size and total calorie estimate in "portion_estimate"
+7. For mixed dishes, provide combined nutritional values
+8. If multiple items are visible in one image, analyze them as one complete meal
+
+Remember: Output MUST be a parseable JSON array with no additional formatting or explanation."""
 
 
 def compress_image(image_bytes, max_size_mb=5):
@@ -53,14 +251,12 @@ def compress_image(image_bytes, max_size_mb=5):
     return output.getvalue()
 
 
-def analyze_food_with_qwen(image_bytes):
+@traced("request.build")
+def build_qwen_request(compressed_image, prompt=NUTRITION_PROMPT):
     """
-    Send image to Qwen API via OpenRouter for nutrition analysis
-    Returns: response text or error message
+    Build the OpenRouter headers and payload for one model-ready JPEG
+    Returns: (headers, payload)
     """
-    # Compress image if needed
-    compressed_image = compress_image(image_bytes, max_size_mb=4.5)
-    
     # Encode image to base64
     encoded_image = base64.b64encode(compressed_image).decode("utf-8")
     
@@ -70,39 +266,9 @@ def analyze_food_with_qwen(image_bytes):
         "Content-Type": "application/json"
     }
     
-    # ===== UPDATED JSON PROMPT =====
-    prompt = """You are a professional nutrition analyst AI. Analyze the food in the image and return your response in STRICT JSON format.
-
-OUTPUT FORMAT (Must be valid JSON):
-{
-  "dish_name": "Name of the dish or food item",
-  "description": "2-3 sentences describing the dish, visible ingredients, and presentation style",
-  "nutrition": {
-    "calories": "150-180 kcal",
-    "carbohydrates": "20-25 g",
-    "sugars": "3-5 g",
-    "fiber": "2-4 g",
-    "protein": "15-20 g",
-    "fat": "5-8 g"
-  },
-  "portion_estimate": "Single serving, approximately 200g, total estimated 300-350 kcal"
-}
-
-CRITICAL RULES:
-1. ALWAYS return valid JSON - no markdown, no code blocks, no extra text
-2. If food is unclear or image quality is poor, return: {"error": "Please retake picture with better lighting and clear view of food"}
-3. Use ranges for all nutritional values (e.g., "150-180" not just "150")
-4. Base ALL estimates on VISIBLE food only - do not assume hidden ingredients
-5. Be specific about ingredients you can identify in the image
-6. Include portion size and total calorie estimate in "portion_estimate"
-7. For mixed dishes, provide combined nutritional values
-8. If multiple items visible, analyze as one complete meal
-
-Remember: Output MUST be parseable JSON with no additional formatting or explanation."""
-    
     # OpenRouter API payload (OpenAI format)
     payload = {
-        "model": "qwen/qwen3-vl-235b-a22b-instruct",
+        "model": QWEN_MODEL,
         "messages": [
             {
                 "role": "user",
@@ -123,78 +289,782 @@ Remember: Output MUST be parseable JSON with no additional formatting or explana
         "max_tokens": 1024,
         "temperature": 0.3
     }
+
+    return headers, payload
+
+
+def build_qwen_batch_request(compressed_images):
+    """
+    Build one OpenRouter request carrying several model-ready JPEGs
+    Returns: (headers, payload)
+    """
+    headers = {
+        "Authorization": f"Bearer {QWEN_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+    content = []
+    for i, compressed_image in enumerate(compressed_images, start=1):
+        encoded_image = base64.b64encode(compressed_image).decode("utf-8")
+        content.append({"type": "text", "text": f"Image {i}:"})
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}})
+    content.append({"type": "text", "text": NUTRITION_BATCH_PROMPT})
+
+    payload = {
+        "model": QWEN_MODEL,
+        "messages": [{"role": "user", "content": content}],
+        # Room for one full answer per image
+        "max_tokens": 1024 * len(compressed_images),
+        "temperature": 0.3
+    }
+
+    return headers, payload
+
+
+def analyze_food_with_qwen(image_bytes):
+    """
+    Send image to Qwen API via OpenRouter for nutrition analysis
+    Returns: response text or error message
+    """
+    # Downscale to model resolution and encode once (compress_image's loop is kept for comparison)
+    compressed_image = encode_for_model(image_bytes, max_size_mb=4.5)
+    return analyze_encoded_with_qwen(compressed_image)
+
+
+def analyze_encoded_with_qwen(compressed_image, cache_key=None, prompt=None, looked_up=False):
+    """
+    analyze_food_with_qwen for an image already encoded by encode_for_model
+    cache_key: key the answer is cached under (default: derived from compressed_image);
+    callers holding the original upload pass the key of its content instead
+    prompt: see request_qwen_analysis (micro-batched and routed calls always use the full prompt)
+    looked_up: the caller already missed cache_key in the cache; the check here then only catches
+    an answer cached since (e.g. by the analysis it coalesced behind) and is not counted again
+    Returns: response text or error message
+    """
+    # Repeat uploads of the same image are answered from the cache
+    cache_key = cache_key or make_cache_key(compressed_image, QWEN_MODEL, PROMPT_VERSION)
+    with span("cache.lookup"):
+        cached = analysis_cache.get(cache_key, count=not looked_up)
+    if cached is not None:
+        return cached
+    return request_analysis(compressed_image, cache_key, prompt)
+
+
+def request_analysis(compressed_image, cache_key, prompt=None):
+    """
+    One uncached analysis: micro-batched when MICRO_BATCH_ENABLED, else one call (see request_single_analysis)
+    Returns: response text or error message
+    """
+    if MICRO_BATCH_ENABLED:
+        # Waits briefly for other uploads and shares one request with them
+        with span("model.micro_batch"):
+            return micro_batcher.analyze((compressed_image, cache_key))
+    return request_single_analysis(compressed_image, cache_key, prompt)
+
+
+def request_single_analysis(compressed_image, cache_key, prompt=None):
+    """
+    One uncached model call for one encoded image, through the router when MODEL_BACKENDS is set
+    Returns: response text or error message
+    """
+    if model_router is not None:
+        return request_routed_analysis(compressed_image, cache_key)
+    return request_qwen_analysis(compressed_image, cache_key, prompt)
+
+
+def request_qwen_analysis(compressed_image, cache_key, prompt=None):
+    """
+    One uncached OpenRouter call for one encoded image; successful answers are cached under cache_key
+    prompt: default NUTRITION_QUICK_PROMPT with NUTRIENT_DB_QUICK_PROMPT, else NUTRITION_PROMPT.
+    A quick answer that leaves nutrition to a food the table does not know is asked again in full.
+    Returns: response text or error message
+    """
+    if prompt is None:
+        prompt = NUTRITION_QUICK_PROMPT if NUTRIENT_DB_QUICK_PROMPT else NUTRITION_PROMPT
+    headers, payload = build_qwen_request(compressed_image, prompt)
     
     try:
         # Send request to OpenRouter
-        response = requests.post(QWEN_API_URL, json=payload, headers=headers, timeout=60)
+        start = time.perf_counter()
+        with qwen_breaker.attempt() as attempt, admission.slot() as ticket, span("model.call"):
+            attempt.start()
+            response = openrouter_session().post(
+                QWEN_API_URL, json=payload, headers=headers, timeout=attempt.timeout
+            )
+            result = response.json() if response.status_code == 200 else None
+            ticket.tokens = usage_tokens(result)
+            upstream_verdict(attempt, response.status_code)
+        model_calls.inc(backend="qwen", status=response.status_code)
+        upstream_throttled(response.status_code, response.headers)
         
-        if response.status_code == 200:
-            result = response.json()
+        if result is not None:
+            usage_meter.record("single", 1, time.perf_counter() - start, result.get("usage"))
             # Extract text from OpenAI-style response structure
-            return result['choices'][0]['message']['content']
+            content = answer_text(result)
+            if prompt is NUTRITION_QUICK_PROMPT and not quick_answer_complete(content):
+                return request_qwen_analysis(compressed_image, cache_key, prompt=NUTRITION_PROMPT)
+            cache_answer(cache_key, content)
+            return content
         else:
             return f"API Error: {response.status_code} - {response.text}"
             
+    except (Overloaded, CircuitOpen):
+        raise
     except Exception as e:
+        model_calls.inc(backend="qwen", status="exception")
         return f"Error: {str(e)}"
 
 
-def parse_nutrition_response(result_text):
+def answer_text(result):
+    """
+    Returns: the answer text of an OpenAI-style completion, or an error message when the
+    model stopped at its token limit (a cut-off answer is neither cached nor shown as complete)
+    """
+    choice = result['choices'][0]
+    if choice.get('finish_reason') == "length":
+        return "Error: the model's answer was cut off. Please try again."
+    return choice['message']['content']
+
+
+def complete_answer(content):
+    """
+    Returns: True when a model answer is worth keeping (analysis cache, perceptual index): it
+    parses and names a dish. Refusals, error answers and prose are not kept, so that asking
+    again can get a real answer instead of the same one for the cache's whole TTL
+    """
+    answer, _ = parse_nutrition(content)
+    return answer is not None and "error" not in answer and answer["dish_name"] is not None
+
+
+def cache_answer(cache_key, content):
+    """Cache a model answer under cache_key when it is a complete one (see complete_answer)"""
+    if complete_answer(content):
+        analysis_cache.put(cache_key, content)
+
+
+def quick_answer_complete(content):
+    """
+    Returns: False when a NUTRITION_QUICK_PROMPT answer left out nutrition for a food nutrient_db does not know
+    """
+    answer, _ = parse_nutrition(content)
+    if answer is None or "error" in answer or answer["nutrition"]:
+        return True
+    return nutrient_db.lookup(answer["dish_name"]) is not None
+
+
+def request_routed_analysis(compressed_image, cache_key):
     """
-    Parse the JSON nutrition analysis response
-    Returns: dict with dish_name, description, nutrition_info, portion_estimate
+    One uncached call through model_router: fastest healthy backend, hedged, with failover
+    Every backend gets NUTRITION_PROMPT, so answers share one schema and one cache entry
+    Returns: response text or error message
+    Raises: Overloaded or CircuitOpen (every breaker open), answered with a 503 like the direct path
     """
     try:
-        # Try to parse as JSON first
-        data = json.loads(result_text)
-        
-        # Check for error response
-        if "error" in data:
-            return {
-                'dish_name': 'Error',
-                'description': data['error'],
-                'nutrition_info': [],
-                'portion_estimate': None
-            }
-        
-        # Extract nutrition info as list of strings for display
-        nutrition_info = []
-        if "nutrition" in data:
-            nutrition = data["nutrition"]
-            nutrition_info = [
-                f"Calories: {nutrition.get('calories', 'N/A')}",
-                f"Carbohydrates: {nutrition.get('carbohydrates', 'N/A')}",
-                f"Sugars: {nutrition.get('sugars', 'N/A')}",
-                f"Fiber: {nutrition.get('fiber', 'N/A')}",
-                f"Protein: {nutrition.get('protein', 'N/A')}",
-                f"Fat: {nutrition.get('fat', 'N/A')}"
-            ]
-        
-        return {
-            'dish_name': data.get('dish_name', 'Unknown Dish'),
-            'description': data.get('description', 'No description available'),
-            'nutrition_info': nutrition_info,
-            'portion_estimate': data.get('portion_estimate', None)
-        }
-        
-    except json.JSONDecodeError:
-        # Fallback: If response is not JSON, handle as error
+        with span("model.routed"):
+            content, backend = model_router.analyze(compressed_image, NUTRITION_PROMPT)
+    except RouterError as e:
+        model_calls.inc(backend="router", status="failed")
+        return f"Error: {str(e)}"
+    model_calls.inc(backend=backend, status=200)
+    cache_answer(cache_key, content)
+    return content
+
+
+def request_qwen_batch_analysis(batch):
+    """
+    One OpenRouter call for several encoded images; each answer is cached under its own key
+    batch: list of (compressed_image, cache_key)
+    Raises ValueError when the reply is not a JSON array with one object per image,
+    so MicroBatcher falls back to one call per image
+    Returns: list of response texts, in image order
+    """
+    compressed_images = [compressed_image for compressed_image, _ in batch]
+    headers, payload = build_qwen_batch_request(compressed_images)
+
+    start = time.perf_counter()
+    with qwen_breaker.attempt() as attempt, admission.slot() as ticket, span("model.batch"):
+        attempt.start()
+        response = openrouter_session().post(QWEN_API_URL, json=payload, headers=headers, timeout=attempt.timeout)
+        result = response.json() if response.status_code == 200 else None
+        ticket.tokens = usage_tokens(result)
+        upstream_verdict(attempt, response.status_code)
+    model_calls.inc(backend="qwen_batch", status=response.status_code)
+    upstream_throttled(response.status_code, response.headers)
+    if result is None:
+        raise ValueError(f"API Error: {response.status_code} - {response.text}")
+
+    usage_meter.record("batch", len(compressed_images), time.perf_counter() - start, result.get("usage"))
+    if result['choices'][0].get('finish_reason') == "length":
+        raise ValueError("batch answer was cut off")
+    answers, _ = extract_json(result['choices'][0]['message']['content'], container=list)
+    if answers is None or len(answers) != len(compressed_images):
+        raise ValueError("batch answer does not have one object per image")
+
+    contents = []
+    for (_, cache_key), answer in zip(batch, answers):
+        content = json.dumps(answer)
+        cache_answer(cache_key, content)
+        contents.append(content)
+    return contents
+
+
+def usage_tokens(result):
+    """
+    Returns: total tokens a model response reports using, or None when it reports none
+    """
+    usage = (result or {}).get("usage") or {}
+    return usage.get("total_tokens")
+
+
+# Calls behind a breaker retry only a refusal (429/502/503/504 with its Retry-After), at most
+# this often. Failed connects and read timeouts are not retried: retries of a hung backend
+# would hold the worker for several timeouts, and the breaker already bounds it
+BREAKER_STATUS_RETRIES = int(os.getenv("BREAKER_STATUS_RETRIES", "2"))
+
+
+def openrouter_session():
+    return get_session("openrouter", retry_total=BREAKER_STATUS_RETRIES, retry_connect=0)
+
+
+def upstream_verdict(attempt, status):
+    """Tell the breaker how a model call went: 5xx (after retries) fails, 4xx says nothing about the backend"""
+    if status >= 500:
+        attempt.failure()
+    elif status != 200:
+        attempt.skip()
+
+
+def upstream_throttled(status, headers):
+    """Hold every model call for the provider's Retry-After when it still answers 429 after our retries"""
+    if status == 429:
+        try:
+            seconds = float(headers.get("Retry-After", ""))
+        except ValueError:
+            seconds = 1.0
+        admission.backoff(min(seconds, 60.0))
+
+
+# Tokens and model time per image, one-by-one vs batched (served at /batching/stats)
+usage_meter = UsageMeter()
+
+# Analyses in progress by analysis key, so identical concurrent uploads share one (served at /coalescing/stats)
+in_flight = SingleFlight()
+
+# Upstream slots, wait queue and token budget (served at /admission/stats)
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENCY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_wait={"interactive": ADMISSION_INTERACTIVE_MAX_WAIT, "bulk": ADMISSION_BULK_MAX_WAIT},
+    tokens_per_minute=UPSTREAM_TOKENS_PER_MINUTE,
+)
+client_limiter = ClientLimiter(CLIENT_RATE_PER_MINUTE, CLIENT_BURST, store=shared_store) if CLIENT_RATE_PER_MINUTE else None
+
+# Fails direct OpenRouter calls fast while Qwen is down, and sizes their timeout (served at /breakers/stats);
+# the router uses the same breaker for its "qwen" backend
+qwen_breaker = get_breaker("qwen")
+
+# Per-backend rolling latency and error rate (served at /router/stats)
+model_router = None
+if MODEL_BACKENDS:
+    model_router = build_router(
+        MODEL_BACKENDS,
+        hedge_after=float(ROUTER_HEDGE_AFTER_SECONDS) if ROUTER_HEDGE_AFTER_SECONDS else None,
+        # Each backend call, hedges included, takes its own upstream slot
+        slot=admission.slot,
+    )
+
+# Batched items are (compressed_image, cache_key) pairs
+micro_batcher = MicroBatcher(
+    request_qwen_batch_analysis,
+    lambda item: request_single_analysis(*item),
+    max_size=MICRO_BATCH_MAX_SIZE,
+    max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+    # Bulk and interactive items are batched apart, each under its own admission class
+    partition=current_traffic,
+)
+
+
+def stream_food_analysis_with_qwen(compressed_image, on_field, cache_key=None, looked_up=False):
+    """
+    Streaming variant of analyze_encoded_with_qwen: reads OpenRouter's SSE token stream
+    and calls on_field(path, value) as soon as each JSON value in the answer is complete
+    Returns: full response text or error message
+    """
+    cache_key = cache_key or make_cache_key(compressed_image, QWEN_MODEL, PROMPT_VERSION)
+    with span("cache.lookup"):
+        cached = analysis_cache.get(cache_key, count=not looked_up)
+    if cached is not None:
+        return cached
+
+    headers, payload = build_qwen_request(compressed_image)
+    payload["stream"] = True
+
+    parser = IncrementalJsonParser()
+    chunks = []
+    response = None
+    # An answer is complete once the stream says so: [DONE] or a finish_reason other than "length"
+    finish_reason = None
+    done = False
+    try:
+        # From the request to the last token; the upstream slot is held as long.
+        # The read timeout applies between chunks.
+        with qwen_breaker.attempt() as attempt, admission.slot(), span("model.stream"):
+            attempt.start()
+            response = openrouter_session().post(
+                QWEN_API_URL, json=payload, headers=headers, timeout=attempt.timeout, stream=True
+            )
+            model_calls.inc(backend="qwen_stream", status=response.status_code)
+            upstream_throttled(response.status_code, response.headers)
+            upstream_verdict(attempt, response.status_code)
+            if response.status_code != 200:
+                return f"API Error: {response.status_code} - {response.text}"
+
+            for line in response.iter_lines():
+                if isinstance(line, bytes):
+                    line = line.decode("utf-8")
+                # Blank lines separate events; ':' lines are keep-alive comments
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    done = True
+                    break
+                choice = json.loads(data)['choices'][0]
+                finish_reason = choice.get('finish_reason') or finish_reason
+                delta = choice.get('delta', {}).get('content')
+                if not delta:
+                    continue
+                chunks.append(delta)
+                for path, value in parser.feed(delta):
+                    on_field(path, value)
+
+        if finish_reason == "length":
+            return "Error: the model's answer was cut off. Please try again."
+        if not done and finish_reason is None:
+            return "Error: the model's answer stream ended early. Please try again."
+        content = "".join(chunks)
+        cache_answer(cache_key, content)
+        return content
+
+    except (Overloaded, CircuitOpen):
+        raise
+    except Exception as e:
+        if response is None:
+            model_calls.inc(backend="qwen_stream", status="exception")
+        return f"Error: {str(e)}"
+
+
+# Nutrition keys in display order, with their labels
+NUTRITION_FIELDS = [
+    ("calories", "Calories"),
+    ("carbohydrates", "Carbohydrates"),
+    ("sugars", "Sugars"),
+    ("fiber", "Fiber"),
+    ("protein", "Protein"),
+    ("fat", "Fat"),
+]
+
+
+@traced("parse")
+def parse_nutrition_response(result_text):
+    """
+    Parse the nutrition analysis response: JSON, JSON wrapped in fences or prose,
+    slightly malformed or truncated JSON, or the line-oriented "Calories: xx-xx kcal"
+    format (see nutrition_parser.parse_nutrition)
+    Returns: dict with dish_name, description, nutrition_info (display strings),
+    nutrition (typed ranges, see NutritionFacts.to_dict), reference (local table check,
+    see NutrientDB.reference), portion_estimate
+    """
+    answer, _ = parse_nutrition(result_text)
+
+    if answer is None:
+        # Fallback: If response is not parseable, handle as error
         if "API Error" in result_text or "Error:" in result_text:
             return {
                 'dish_name': 'Error',
                 'description': result_text,
                 'nutrition_info': [],
+                'nutrition': None,
+                'reference': None,
                 'portion_estimate': None
             }
-        
-        # Try to extract any useful info from non-JSON response
+
         return {
             'dish_name': 'Parsing Error',
             'description': 'AI returned non-JSON response. Please try again.',
             'nutrition_info': [],
+            'nutrition': None,
+            'reference': None,
+            'portion_estimate': None
+        }
+
+    # Check for error response
+    if "error" in answer:
+        return {
+            'dish_name': 'Error',
+            'description': answer['error'],
+            'nutrition_info': [],
+            'nutrition': None,
+            'reference': None,
             'portion_estimate': None
         }
 
+    # Parse the value strings into typed ranges once; the display strings and the stored
+    # 'nutrition' dict (see NutritionFacts.to_dict) both come from them
+    facts = NutritionFacts.from_strings(answer['nutrition']) if answer['nutrition'] else None
+
+    # Fill gaps from the local food table and flag values far from it (see NutrientDB.reference)
+    reference = None
+    portion_estimate = answer['portion_estimate']
+    if nutrient_db is not None:
+        with span("nutrient_db.reference"):
+            facts, reference = nutrient_db.reference(
+                answer['dish_name'], facts, portion_text=portion_estimate, grams=answer['portion_grams']
+            )
+        if reference is not None and not portion_estimate:
+            portion_estimate = f"About {reference['portion_g']:g} g"
+
+    nutrition_info = []
+    nutrition = None
+    if facts is not None:
+        nutrition_info = facts.display(NUTRITION_FIELDS)
+        nutrition = facts.to_dict()
+
+    return {
+        'dish_name': answer['dish_name'] or 'Unknown Dish',
+        'description': answer['description'] or 'No description available',
+        'nutrition_info': nutrition_info,
+        'nutrition': nutrition,
+        'reference': reference,
+        'portion_estimate': portion_estimate
+    }
+
+
+def analyze_prepared(compressed_image, image_hash, on_field=None, cache_key=None, prompt=None, looked_up=False):
+    """
+    Analysis of an image that is already hashed (dhash) and encoded (encode_for_model):
+    near-duplicate lookup, model call, parsing
+    With on_field, each field of the answer is reported as it completes: streamed from Qwen, or,
+    when the call goes through the router (MODEL_BACKENDS) or the micro-batcher, once the answer is in
+    cache_key, prompt, looked_up: see analyze_encoded_with_qwen
+    Returns: parsed result dict (see parse_nutrition_response)
+    """
+    # Reuse the analysis of a near-identical photo when we have one
+    with span("phash.lookup"):
+        match = phash_index.lookup(image_hash)
+    if match is not None:
+        return count_analysis("near_duplicate", match[0])
+
+    # Analyze with Qwen; streaming talks to OpenRouter directly, so routing, failover, hedging
+    # and micro-batching keep the whole-answer call
+    if on_field is not None and QWEN_STREAMING and model_router is None and not MICRO_BATCH_ENABLED:
+        result_text = stream_food_analysis_with_qwen(compressed_image, on_field, cache_key=cache_key,
+                                                     looked_up=looked_up)
+    else:
+        result_text = analyze_encoded_with_qwen(compressed_image, cache_key=cache_key, prompt=prompt,
+                                                looked_up=looked_up)
+        if on_field is not None:
+            for path, value in IncrementalJsonParser().feed(result_text):
+                on_field(path, value)
+
+    # Parse response using JSON parser
+    parsed_result = parse_nutrition_response(result_text)
+    if complete_answer(result_text):
+        phash_index.add(image_hash, parsed_result)
+    return count_analysis("model", parsed_result)
+
+
+def analyze_bulk(compressed_image, image_hash, sha256=None):
+    """
+    analyze_prepared for /batch and batch.py items: their model calls queue behind page uploads
+    sha256: of the source bytes; the answer is keyed by it as for a page upload (see
+    make_content_cache_key), so both share cache entries and concurrent analyses
+    Returns: parsed result dict (see parse_nutrition_response)
+    """
+    with traffic("bulk"):
+        if sha256 is None:
+            return analyze_prepared(compressed_image, image_hash)
+        cache_key = make_content_cache_key(sha256, QWEN_MODEL, PROMPT_VERSION)
+        return coalesced(cache_key, lambda emit: analyze_prepared(compressed_image, image_hash, cache_key=cache_key))
+
+
+def count_analysis(source, parsed_result):
+    """
+    Count one finished analysis in meal_analyses_total
+    source: "model", "cache", "near_duplicate", "screened" or "coalesced"
+    Returns: parsed_result
+    """
+    outcome = {"Error": "error", "Parsing Error": "parse_error"}.get(parsed_result['dish_name'], "ok")
+    analyses.inc(source=source, outcome=outcome)
+    return parsed_result
+
+
+def analyze_upload(image_bytes, image=None, on_field=None, cache_key=None):
+    """
+    Full analysis of one upload: hash, near-duplicate lookup, screening, encode, model call, parsing
+    cache_key: make_cache_key of image_bytes, when the caller already has it
+    Returns: parsed result dict (see parse_nutrition_response)
+    """
+    if image is None:
+        image = Image.open(BytesIO(image_bytes))
+
+    # Check the index before paying for the encode
+    with span("image.dhash"):
+        image_hash = dhash(image)
+    with span("phash.lookup"):
+        match = phash_index.lookup(image_hash)
+    if match is not None:
+        return count_analysis("near_duplicate", match[0])
+
+    # One decode at model resolution for the screen and the encode; rejected images skip the encode
+    with span("image.decode"):
+        model_image = load_for_model(image_bytes)
+    screening = None
+    if food_screen is not None:
+        with span("image.screen"):
+            screening = food_screen.screen(model_image)
+        if not screening.ok:
+            return count_analysis("screened", screening.result())
+
+    with span("image.encode"):
+        compressed_image = encode_image_for_model(model_image, max_size_mb=4.5)
+    # Keyed by the upload's own content, like the copy in upload_store
+    cache_key = cache_key or make_cache_key(image_bytes, QWEN_MODEL, PROMPT_VERSION)
+    return analyze_prepared(
+        compressed_image, image_hash, on_field=on_field, cache_key=cache_key, prompt=screened_prompt(screening)
+    )
+
+
+def screened_prompt(screening):
+    """
+    Returns: NUTRITION_QUICK_PROMPT for an image food_screen tagged as a single plain food
+    (with SCREEN_QUICK_PROMPT), else None for the default prompt
+    """
+    if SCREEN_QUICK_PROMPT and screening is not None and screening.simple:
+        return NUTRITION_QUICK_PROMPT
+    return None
+
+
+def prepare_saved_upload(upload_key):
+    """
+    One decode of an upload in upload_store feeds the perceptual hash and every
+    derivative: the page renditions always, the model input only when there is no
+    near-duplicate result to reuse and the screen, which looks at the thumbnail
+    rendition, lets the image through
+    Returns: (dhash, parsed result to show instead of a model call or None,
+    model input JPEG or None, prompt for the model call (see screened_prompt))
+    """
+    with span("image.decode"):
+        image = image_derivatives.decode(upload_key)
+    with span("image.dhash"):
+        image_hash = dhash(image)
+    with span("image.renditions"):
+        _, renditions = image_derivatives.generate(
+            upload_key, image, variants=list(DISPLAY_SIDES), return_images=True
+        )
+    with span("phash.lookup"):
+        match = phash_index.lookup(image_hash)
+    if match is not None:
+        return image_hash, count_analysis("near_duplicate", match[0]), None, None
+
+    # The thumbnail is already small: screening it costs 1-2 ms even for a 12 MP photo
+    screening = None
+    if food_screen is not None:
+        with span("image.screen"):
+            screening = food_screen.screen(renditions["thumb"], source_size=image.info.get("source_size"))
+        if not screening.ok:
+            return image_hash, count_analysis("screened", screening.result()), None, None
+
+    with span("image.encode"):
+        rendered = image_derivatives.generate(upload_key, image, variants=["model"])
+    return image_hash, None, rendered["model"], screened_prompt(screening)
+
+
+def analyze_saved_upload(upload_key, cache_key=None):
+    """
+    Analysis of an upload already streamed into upload_store (see prepare_saved_upload)
+    cache_key: analysis key of the upload (see make_content_cache_key); a cached
+    answer is returned without decoding the image at all
+    Returns: parsed result dict (see parse_nutrition_response)
+    """
+    if cache_key is not None:
+        with span("cache.lookup"):
+            cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            return count_analysis("cache", parse_nutrition_response(cached))
+
+        # Concurrent uploads of the same photo wait for one analysis
+        return coalesced(cache_key, lambda emit: analyze_new_upload(upload_key, cache_key))
+    return analyze_new_upload(upload_key)
+
+
+def analyze_new_upload(upload_key, cache_key=None):
+    """
+    analyze_saved_upload once the analysis cache has missed
+    Returns: parsed result dict (see parse_nutrition_response)
+    """
+    image_hash, result, compressed_image, prompt = prepare_saved_upload(upload_key)
+    if result is not None:
+        return result
+
+    # analyze_saved_upload has looked cache_key up already
+    return analyze_prepared(compressed_image, image_hash, cache_key=cache_key, prompt=prompt,
+                            looked_up=cache_key is not None)
+
+
+def coalesced(cache_key, analyze, on_field=None):
+    """
+    Run analyze(emit) once for all concurrent callers with the same analysis key (see
+    singleflight.py). The others share its result or exception and are counted in
+    meal_analyses_total as source "coalesced"; with on_field, each caller gets every
+    field the running analysis reports through emit(path, value).
+    Returns: parsed result dict
+    """
+    if not COALESCING_ENABLED:
+        return analyze(on_field or (lambda *event: None))
+    parsed_result, shared = in_flight.do(cache_key, analyze, on_event=on_field)
+    if shared:
+        count_analysis("coalesced", parsed_result)
+    return parsed_result
+
+
+# ---------------------- Background jobs ------------------------
+NUTRITION_LABELS = dict(NUTRITION_FIELDS)
+
+
+def run_job(image_bytes, filename, progress):
+    """
+    Job handler: analyze the upload and report each answer field as it streams in
+    nutrition.* fields are reported in their display form ("Calories: 150-180 kcal")
+    """
+    def on_field(path, value):
+        key = ".".join(str(part) for part in path)
+        if len(path) == 2 and path[0] == "nutrition" and path[1] in NUTRITION_LABELS:
+            value = f"{NUTRITION_LABELS[path[1]]}: {value}"
+        progress(key, value)
+
+    with trace("job"):
+        # Same key as a page upload of the same photo: the two share one analysis too
+        cache_key = make_cache_key(image_bytes, QWEN_MODEL, PROMPT_VERSION)
+        return coalesced(
+            cache_key, lambda emit: analyze_upload(image_bytes, on_field=emit, cache_key=cache_key), on_field=on_field
+        )
+
+
+# ---------------------- Upload store ------------------------
+# Uploads are stored once per content hash; that hash is also the analysis cache key
+upload_store = BlobStore(
+    root=os.getenv("UPLOAD_STORE_PATH", os.path.join("cache", "uploads")),
+    max_bytes=int(float(os.getenv("UPLOAD_STORE_MAX_MB", "1024")) * 1024 * 1024),
+    max_age_seconds=int(float(os.getenv("UPLOAD_STORE_MAX_AGE_DAYS", "30")) * 24 * 3600),
+)
+
+# Thumbnail, display and model-input renditions, each made once per upload from a single decode.
+# The model input is sized for the backend that answers first.
+image_derivatives = ImageDerivatives(upload_store, model_backend=MODEL_BACKENDS[0] if MODEL_BACKENDS else "qwen")
+
+# Uploads and their derivatives never change under a given URL
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Uploads posted to /jobs return a job id at once; worker threads run the analysis.
+# Queued uploads stay pinned in upload_store until their job finishes, and finished
+# jobs are deleted JOB_TTL_SECONDS later.
+job_queue = JobQueue(
+    path=os.getenv("JOB_QUEUE_PATH", os.path.join("cache", "jobs.sqlite3")),
+    handler=run_job,
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    store=upload_store,
+    ttl_seconds=int(os.getenv("JOB_TTL_SECONDS", str(24 * 3600))) or None,
+    # A job whose process stops renewing its lease (crashed, recycled) is re-queued this long after
+    lease_seconds=int(os.getenv("JOB_LEASE_SECONDS", "60")),
+)
+
+# Each /jobs/<id>/events stream holds a server thread until its job finishes; past this
+# many at once, clients get a 503 and follow the job at /jobs/<id> instead
+JOB_EVENT_STREAMS = int(os.getenv("JOB_EVENT_STREAMS", "64"))
+job_event_streams = threading.BoundedSemaphore(JOB_EVENT_STREAMS)
+
+
+# ---------------------- Tracing ------------------------
+# Every request is one trace named after its endpoint (see tracing.py); spans inside
+# it time the stages into meal_stage_seconds, served with the component stats at /metrics
+UNTRACED_ENDPOINTS = {"metrics_export", "static", None}
+
+
+@app.before_request
+def start_request_trace():
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        g.trace = begin_trace(request.endpoint, method=request.method)
+
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    handle = g.pop("trace", None)
+    if handle is not None:
+        end_trace(handle)
+
+
+metrics.collect("meal_analysis_cache", analysis_cache.stats)
+metrics.collect("meal_upload_store", upload_store.stats)
+metrics.collect("meal_image_derivatives", image_derivatives.stats)
+metrics.collect("meal_job_queue", job_queue.stats)
+metrics.collect("meal_model_usage", usage_meter.summary)
+metrics.collect("meal_micro_batch", micro_batcher.stats)
+metrics.collect("meal_http", timing_summary)
+metrics.collect("meal_admission", admission.stats)
+metrics.collect("meal_breaker", breaker_summary)
+metrics.collect("meal_coalescing", in_flight.stats)
+if shared_store is not None:
+    metrics.collect("meal_shared_store", shared_store.stats)
+if client_limiter is not None:
+    metrics.collect("meal_client_limit", client_limiter.stats)
+if nutrient_db is not None:
+    metrics.collect("meal_nutrient_db", nutrient_db.stats)
+if food_screen is not None:
+    metrics.collect("meal_food_screen", food_screen.stats)
+if model_router is not None:
+    metrics.collect("meal_router", model_router.summary)
+
+
+# ---------------------- Admission ------------------------
+# Endpoints that start analyses, and so count against the per-client limit
+LIMITED_ENDPOINTS = {"index", "submit_job", "batch_analyze"}
+
+
+def client_id():
+    if CLIENT_ID_HEADER and request.headers.get(CLIENT_ID_HEADER):
+        return "key:" + request.headers[CLIENT_ID_HEADER]
+    return "addr:" + (request.remote_addr or "")
+
+
+@app.before_request
+def admit_request():
+    if request.method != "POST" or request.endpoint not in LIMITED_ENDPOINTS:
+        return None
+    if client_limiter is not None:
+        retry_after = client_limiter.check(client_id())
+        if retry_after:
+            response = jsonify({"error": "Too many requests", "retry_after": retry_after})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(retry_after)
+            return response
+    # Admission is checked at the model call (admission.slot), after the cache and
+    # near-duplicate lookups, so a repeat upload is still answered under load
+    return None
+
+
+@app.errorhandler(Overloaded)
+@app.errorhandler(CircuitOpen)
+def overloaded(error):
+    """
+    Shed by admission control, or the model backend's breaker is open:
+    a quick 503 the client may retry after Retry-After seconds
+    """
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
 
 # ---------------------- Routes ------------------------
 @app.route("/", methods=["GET", "POST"])
@@ -213,42 +1083,351 @@ def index():
         if file.filename == "":
             return "No file selected", 400
 
-        # Read image in memory
-        image_bytes = file.read()
-        image = Image.open(BytesIO(image_bytes))
+        # Only images are stored, under the type Pillow finds, never the one the client claims:
+        # the store serves uploads back from this site
+        mime = sniff_image(file.stream)
+        if mime is None:
+            return "Not a supported image", 400
 
-        # Save uploaded image
-        upload_folder = os.path.join("static", "uploads")
-        os.makedirs(upload_folder, exist_ok=True)
-        file_path = os.path.join(upload_folder, file.filename)
-        file.seek(0)
-        file.save(file_path)
+        # Stream the upload into the store; it is never held in memory as a whole
+        with span("upload.store"):
+            upload_key = upload_store.put_stream(file.stream, mime=mime)
 
-        # Convert image to base64 for display
-        encoded_img = base64.b64encode(image_bytes).decode("utf-8")
-        img_src = f"data:image/jpeg;base64,{encoded_img}"
+        # The page shows a resized rendition instead of the original inlined as base64
+        img_src = url_for("upload_derivative", key=upload_key, variant="display", v=DERIVATIVE_VERSION)
 
-        # Analyze with Qwen
-        result_text = analyze_food_with_qwen(image_bytes)
-        
-    
-        
-        # Parse response using JSON parser
-        parsed_result = parse_nutrition_response(result_text)
+        parsed_result = analyze_saved_upload(
+            upload_key,
+            cache_key=make_content_cache_key(upload_key, QWEN_MODEL, PROMPT_VERSION),
+        )
         
         dish_name = parsed_result['dish_name']
         description = parsed_result['description']
         nutrition_info = parsed_result['nutrition_info']
         portion_estimate = parsed_result['portion_estimate']
 
-    return render_template(
-        "claude.html",
-        img_src=img_src,
-        description=description,
-        nutrition_info=nutrition_info,
-        portion_estimate=portion_estimate,
-        dish_name=dish_name
+    with span("render"):
+        return render_template(
+            "claude.html",
+            img_src=img_src,
+            description=description,
+            nutrition_info=nutrition_info,
+            portion_estimate=portion_estimate,
+            dish_name=dish_name
+        )
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "No file selected"}), 400
+
+    mime = sniff_image(file.stream)
+    if mime is None:
+        return jsonify({"error": "Not a supported image"}), 400
+
+    job_id = job_queue.submit_stream(file.stream, file.filename, mime=mime)
+    return jsonify({
+        "job_id": job_id,
+        "status_url": url_for("job_status", job_id=job_id),
+        "events_url": url_for("job_events", job_id=job_id),
+    }), 202
+
+
+def send_blob(blob):
+    """
+    Content-addressed responses: the blob key is a strong ETag and the URL never
+    changes meaning, so browsers may keep the response for good. Only image types
+    are served (see SERVED_MIME_TYPES), and browsers must not sniff another one.
+    """
+    response = send_file(
+        blob["path"],
+        mimetype=blob["mime"],
+        etag=blob["key"],
+        max_age=IMMUTABLE_MAX_AGE,
+        conditional=True,
+    )
+    response.cache_control.immutable = True
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
+
+
+# Uploads (checked by sniff_image) and their renditions (JPEG or WebP); blobs stored under any
+# other type, e.g. by a version that trusted the client's Content-Type, are not served
+SERVED_MIME_TYPES = set(UPLOAD_MIME_TYPES.values())
+
+
+def servable(blob):
+    return blob is not None and blob["mime"] in SERVED_MIME_TYPES
+
+
+@app.route("/uploads/<key>")
+def upload_blob(key):
+    blob = upload_store.get(key) if len(key) == 64 else None
+    if not servable(blob):
+        abort(404)
+    return send_blob(blob)
+
+
+@app.route("/uploads/<key>/<variant>")
+def upload_derivative(key, variant):
+    """Page renditions (thumb, display) of an upload; ?v= is DERIVATIVE_VERSION"""
+    blob = image_derivatives.get(key, variant) if len(key) == 64 else None
+    if not servable(blob):
+        abort(404)
+    return send_blob(blob)
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """
+    Server-Sent Events: one event per state change (queued/running/done/failed) plus a
+    'field' event for every answer field as it streams in
+    """
+    if job_queue.get(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not job_event_streams.acquire(blocking=False):
+        raise Overloaded("event streams", 5)
+
+    def stream():
+        last = None
+        last_sent = time.time()
+        sent_fields = set()
+        while True:
+            job = job_queue.get(job_id)
+            for key, value in (job["partial"] or {}).items():
+                if key not in sent_fields:
+                    sent_fields.add(key)
+                    last_sent = time.time()
+                    yield f"event: field\ndata: {json.dumps({'path': key, 'value': value})}\n\n"
+            state = (job["status"], job.get("position"))
+            if state != last:
+                last = state
+                last_sent = time.time()
+                yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+            elif time.time() - last_sent > 15:
+                # Comment line keeps proxies from closing an idle stream
+                last_sent = time.time()
+                yield ": waiting\n\n"
+            if job["status"] in ("done", "failed"):
+                return
+            job_queue.wait_for_change(timeout=1.0)
+
+    response = Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    # Called when the stream ends or the client goes away, even if it never started
+    response.call_on_close(job_event_streams.release)
+    return response
+
+
+# Bulk uploads: model calls in flight and per-minute budget for one /batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_RATE_PER_MINUTE = float(os.getenv("BATCH_RATE_PER_MINUTE", "0")) or None
+
+
+def store_batch_item(name, stream):
+    """
+    Stream one /batch image into the upload store (see index), pinned until release_batch_items
+    Returns: (name, path of the stored image), or (name, None) when it is not an image we accept
+    """
+    mime = sniff_image(stream)
+    if mime is None:
+        return name, None
+    return name, upload_store.path(upload_store.put_stream(stream, mime=mime, pin=True))
+
+
+def release_batch_items(records, keys):
+    """
+    Pass the records of a /batch run through, unpinning each item's blob once its record is out
+    keys: upload store keys pinned by store_batch_item (one per stored item); any left when the
+    stream ends early (client gone) are unpinned then
+    Yields: the records
+    """
+    keys = list(keys)
+    try:
+        for record in records:
+            if record["sha256"] in keys:
+                keys.remove(record["sha256"])
+                upload_store.decref(record["sha256"])
+            yield record
+    finally:
+        for key in keys:
+            upload_store.decref(key)
+
+
+@app.route("/batch", methods=["POST"])
+def batch_analyze():
+    """
+    Analyze several uploaded images (field "files", zip archives are expanded)
+    Streams one JSON line per image as results complete
+    """
+    files = request.files.getlist("files")
+    if not files:
+        return jsonify({"error": "No files uploaded"}), 400
+
+    # Every image goes to the upload store before any is analyzed: the decode processes read
+    # them from there, and nothing is held in memory while the response streams. Each stays
+    # pinned until its record is sent, so a GC meanwhile cannot remove it
+    items = []
+    try:
+        for file in files:
+            if file.filename.lower().endswith(".zip"):
+                # Every member is sniffed, so the ones that are not images get an error record
+                for name, member in iter_zip(file.stream, prefix=file.filename, read=False, images_only=False):
+                    items.append(store_batch_item(name, member))
+            else:
+                items.append(store_batch_item(file.filename, file.stream))
+    except BaseException:
+        for _, path in items:
+            if path is not None:
+                upload_store.decref(os.path.basename(path))
+        raise
+    pinned = [os.path.basename(path) for _, path in items if path is not None]
+
+    records = run_batch(
+        items,
+        analyze_bulk,
+        concurrency=BATCH_CONCURRENCY,
+        rate_per_minute=BATCH_RATE_PER_MINUTE,
+        screen=food_screen is not None,
+        screen_food=SCREEN_ENABLED,
     )
+    records = release_batch_items(records, pinned)
+    return Response((json.dumps(record) + "\n" for record in records), mimetype="application/x-ndjson")
+
+
+@app.route("/metrics")
+def metrics_export():
+    """Prometheus scrape target: stage and request latency histograms, counters, component stats"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/jobs/stats")
+def job_stats():
+    return jsonify(job_queue.stats())
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(analysis_cache.stats())
+
+
+@app.route("/store/stats")
+def store_stats():
+    if shared_store is None:
+        abort(404)
+    return jsonify(dict(shared_store.stats(), kind=shared_store.kind, phashes=len(phash_index)))
+
+
+@app.route("/uploads/stats")
+def upload_stats():
+    return jsonify(dict(upload_store.stats(), derivatives=image_derivatives.stats()))
+
+
+@app.route("/screen/stats")
+def screen_stats():
+    if food_screen is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(food_screen.stats(), enabled=True))
+
+
+@app.route("/admission/stats")
+def admission_stats():
+    stats = {"admission": admission.stats()}
+    if client_limiter is not None:
+        stats["clients"] = client_limiter.stats()
+    return jsonify(stats)
+
+
+@app.route("/coalescing/stats")
+def coalescing_stats():
+    return jsonify(in_flight.stats())
+
+
+@app.route("/breakers/stats")
+def breaker_stats():
+    return jsonify(breaker_summary())
+
+
+@app.route("/http/stats")
+def http_stats():
+    return jsonify(timing_summary())
+
+
+@app.route("/router/stats")
+def router_stats():
+    if model_router is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(model_router.summary(), enabled=True))
+
+
+@app.route("/batching/stats")
+def batching_stats():
+    return jsonify({
+        "enabled": MICRO_BATCH_ENABLED,
+        "batcher": micro_batcher.stats(),
+        "usage": usage_meter.summary(),
+    })
+
+
+# ---------------------- Serving ------------------------
+# Production serving is gunicorn with pre-forked workers (gunicorn.conf.py): the master
+# imports this module once, so the code, the nutrient table, the perceptual index and
+# Pillow's plugins are shared copy-on-write by every worker. SQLite connections and
+# threads cannot cross a fork, so the master closes its connections (before_fork) and
+# each worker opens its own and starts its job threads (after_fork).
+def create_app():
+    """
+    App factory for servers: loads the read-only state worth sharing between workers
+    Returns: the Flask app
+    """
+    # Every image plugin now, not on each worker's first upload
+    Image.init()
+    app.jinja_env.get_template("claude.html")
+    return app
+
+
+def before_fork():
+    """In the server's master process, before workers are forked"""
+    analysis_cache.close()
+    phash_index.close()
+    if shared_store is not None:
+        shared_store.close()
+    upload_store.close()
+    job_queue.close()
+    shutdown_cpu_pool()
+
+
+def after_fork():
+    """In each worker process, once the app is loaded"""
+    # Workers would otherwise share one random state, and so make the same trace sampling choices
+    random.seed()
+    if shared_store is not None:
+        shared_store.reopen()
+    analysis_cache.reopen()
+    phash_index.reopen()
+    # Queued jobs are picked up without waiting for this worker's first submit
+    job_queue.start()
+
+
+def drain(timeout=None):
+    """
+    On worker shutdown: job threads take no new jobs and finish the running ones within timeout.
+    Jobs cut off are left 'running' and re-queued once their lease runs out.
+    """
+    job_queue.stop(timeout)
+    shutdown_cpu_pool()
 
 
 # ---------------------- Run ------------------------
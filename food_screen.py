@@ -0,0 +1,208 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from image_encoder import flatten_to_rgb
+
+
+# ---------------------- Screen settings ------------------------
+# Every measure below is taken on a copy whose longest edge is this many pixels,
+# so thresholds do not depend on the upload's resolution
+SCREEN_SIDE = 256
+
+# Resolution: shortest side of the upload as taken, before any downscaling (web-sized
+# photos of 137 px still get good answers). Upscaled small photos have the pixels but
+# not the detail; the blur check catches those.
+MIN_SOURCE_SIDE = 128
+
+# Blur: the strongest edges (99.9th percentile of |Laplacian|) of a sharp photo are
+# 100+; a defocused or shaken one stays under 20. Shallow depth of field is fine
+# as long as something in the frame is in focus.
+MIN_EDGE_STRENGTH = 30
+
+# Exposure, on 0-255 luma: the brightest 1% must reach MIN_HIGHLIGHT, the darkest 1%
+# must stay under MAX_SHADOW, and the two must be MIN_CONTRAST apart
+MIN_HIGHLIGHT = 40
+MAX_SHADOW = 215
+MIN_CONTRAST = 30
+
+# Hasler-Suesstrunk colourfulness; screenshots, documents and greyscale frames score
+# under 2, the plainest food photo (black coffee on white) about 13
+MIN_COLORFULNESS = 6
+
+# Single food on a plain background: most of the border matches the background
+# colour, the foreground covers at most part of the frame, and its saturated
+# pixels share one hue (mean resultant length of the hue angles)
+SIMPLE_MIN_PLAIN_BORDER = 0.65
+SIMPLE_MAX_FOREGROUND = 0.55
+SIMPLE_MIN_HUE_CONCENTRATION = 0.88
+
+# Answer shown instead of a model call, worded like the prompt's own error
+RETAKE_MESSAGES = {
+    "low_resolution": "Please retake picture at a higher resolution: the photo is too small to make out the food.",
+    "blurry": "Please retake picture: the photo is blurry. Hold the camera still and tap to focus on the food.",
+    "dark": "Please retake picture with better lighting: the photo is too dark.",
+    "overexposed": "Please retake picture: the photo is overexposed.",
+    "flat": "Please retake picture: the photo has almost no contrast.",
+    "no_food": "Please retake picture with a clear view of the food: no food is visible.",
+}
+
+
+# ---------------------- Screening ------------------------
+@dataclass(frozen=True, slots=True)
+class Screening:
+    """Outcome of screen_image; verdict is "ok" or a key of RETAKE_MESSAGES"""
+
+    verdict: str
+    simple: bool
+    measures: dict
+
+    @property
+    def ok(self):
+        return self.verdict == "ok"
+
+    def result(self):
+        """
+        Returns: parsed result dict for a rejected image, shaped like parse_nutrition_response's errors
+        """
+        return {
+            'dish_name': 'Error',
+            'description': RETAKE_MESSAGES[self.verdict],
+            'nutrition_info': [],
+            'nutrition': None,
+            'reference': None,
+            'portion_estimate': None,
+        }
+
+
+def screen_image(image, source_size=None, food=True):
+    """
+    Cheap CPU-only checks that run before the model is paid for.
+    Quality gate: resolution, exposure (luma histogram), contrast and blur (Laplacian).
+    food=True adds a colourfulness check and the tag for a single food on a plain background.
+    Costs 1-2 ms on a thumbnail-sized image.
+    image: PIL image of any size and mode; the thumbnail rendition or a draft decode is cheapest
+    source_size: (width, height) of the upload as taken (default: info["source_size"] set by
+    load_for_model, else the image's own size)
+    Returns: Screening
+    """
+    source_size = source_size or image.info.get("source_size") or image.size
+    measures = {"source_side": min(source_size)}
+    if measures["source_side"] < MIN_SOURCE_SIDE:
+        return Screening("low_resolution", False, measures)
+
+    small = image.copy()
+    # Box-reduce most of the way, then one bilinear pass
+    small.thumbnail((SCREEN_SIDE, SCREEN_SIDE), Image.BILINEAR, reducing_gap=1.0)
+    small = flatten_to_rgb(small)
+    luma = np.asarray(small.convert("L"), dtype=np.float32)
+
+    # Luma percentiles from a histogram; only the Laplacian needs a real partition
+    cumulative = np.cumsum(np.bincount(luma.astype(np.uint8).ravel(), minlength=256)) / luma.size
+    laplacian = np.abs(4 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1] - luma[1:-1, :-2] - luma[1:-1, 2:])
+    strongest = int(laplacian.size * 0.999)
+    measures["edges"] = float(np.partition(laplacian.ravel(), strongest)[strongest]) if laplacian.size else 0.0
+    measures["shadow"] = float(np.searchsorted(cumulative, 0.01))
+    measures["highlight"] = float(np.searchsorted(cumulative, 0.99))
+
+    if measures["highlight"] < MIN_HIGHLIGHT:
+        return Screening("dark", False, measures)
+    if measures["shadow"] > MAX_SHADOW:
+        return Screening("overexposed", False, measures)
+    if measures["highlight"] - measures["shadow"] < MIN_CONTRAST:
+        return Screening("flat", False, measures)
+    if measures["edges"] < MIN_EDGE_STRENGTH:
+        return Screening("blurry", False, measures)
+    if not food:
+        return Screening("ok", False, measures)
+
+    rgb = np.asarray(small, dtype=np.float32)
+    red, green, blue = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    red_green = red - green
+    yellow_blue = 0.5 * (red + green) - blue
+    measures["colorfulness"] = float(
+        np.hypot(red_green.std(), yellow_blue.std()) + 0.3 * np.hypot(red_green.mean(), yellow_blue.mean())
+    )
+    if measures["colorfulness"] < MIN_COLORFULNESS:
+        return Screening("no_food", False, measures)
+
+    # Composition needs far less detail than blur does
+    simple = _single_food(small.reduce(2) if min(small.size) >= 64 else small, measures)
+    return Screening("ok", simple, measures)
+
+
+def _single_food(small, measures):
+    rgb = np.asarray(small, dtype=np.float32)
+    # Background colour: median of a band around the edge of the frame
+    band = max(2, min(rgb.shape[:2]) // 20)
+    border = np.concatenate([
+        rgb[:band].reshape(-1, 3), rgb[-band:].reshape(-1, 3),
+        rgb[:, :band].reshape(-1, 3), rgb[:, -band:].reshape(-1, 3),
+    ])
+    background = np.median(border, axis=0)
+    # Largest per-channel distance from the background (channel by channel: a
+    # reduction over a length-3 axis is many times slower)
+    border_distance = np.maximum.reduce([np.abs(border[:, channel] - background[channel]) for channel in range(3)])
+    distance = np.maximum.reduce([np.abs(rgb[..., channel] - background[channel]) for channel in range(3)])
+    measures["plain_border"] = float(np.mean(border_distance < 24))
+    foreground = distance >= 40
+    measures["foreground"] = float(foreground.mean())
+
+    # Hue concentration from a 256-bin histogram of the saturated foreground pixels
+    hsv = np.asarray(small.convert("HSV"))
+    counts = np.bincount(hsv[..., 0][foreground & (hsv[..., 1] > 60)], minlength=256)
+    total = counts.sum()
+    if total:
+        angles = np.arange(256) * (2 * np.pi / 256)
+        measures["hue_concentration"] = float(np.hypot(counts @ np.cos(angles), counts @ np.sin(angles)) / total)
+    else:
+        measures["hue_concentration"] = 0.0
+
+    return (
+        measures["plain_border"] >= SIMPLE_MIN_PLAIN_BORDER
+        and measures["foreground"] <= SIMPLE_MAX_FOREGROUND
+        and measures["hue_concentration"] >= SIMPLE_MIN_HUE_CONCENTRATION
+    )
+
+
+# ---------------------- Counters ------------------------
+class FoodScreen:
+    """
+    screen_image with counters, shared by the request threads / image workers that call it.
+    It runs wherever the upload is already decoded (Flask request threads, the async
+    app's image_pool, batch.py's decode processes), so it never adds a decode of its own.
+    food: also run the food checks (see screen_image); False is the quality gate alone
+    """
+
+    def __init__(self, food=True):
+        self.food = food
+        self._lock = threading.Lock()
+        self.counters = {"screened": 0, "simple": 0, "seconds": 0.0}
+        self.verdicts = {}
+
+    def screen(self, image, source_size=None):
+        start = time.perf_counter()
+        screening = screen_image(image, source_size, food=self.food)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counters["screened"] += 1
+            self.counters["simple"] += screening.simple
+            self.counters["seconds"] += elapsed
+            self.verdicts[screening.verdict] = self.verdicts.get(screening.verdict, 0) + 1
+        return screening
+
+    def stats(self):
+        with self._lock:
+            screened = self.counters["screened"]
+            rejected = screened - self.verdicts.get("ok", 0)
+            return {
+                "food_checks": self.food,
+                "screened": screened,
+                "rejected": rejected,
+                "simple": self.counters["simple"],
+                "verdicts": dict(self.verdicts),
+                "mean_ms": round(1000 * self.counters["seconds"] / screened, 3) if screened else None,
+            }
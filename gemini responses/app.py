@@ -1,17 +1,22 @@
 #Import Libraries
 import os
 import base64
+from functools import lru_cache
 from io import BytesIO
 from flask import Flask, request, render_template
 from PIL import Image
-import google.generativeai as genai
 
 # ---------------------- Flask setup ------------------------
 app = Flask(__name__)
 
 # ---------------------- Gemini setup ------------------------
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("gemini-2.0-flash-001")
+@lru_cache(maxsize=1)
+def get_model():
+    # The SDK is imported and configured on the first analysis, not at startup
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel("gemini-2.0-flash-001")
 
 # ---------------------- Routes ------------------------
 @app.route("/", methods=["GET", "POST"])
@@ -47,7 +52,7 @@ def index():
         img_src = f"data:image/jpeg;base64,{encoded_img}"
 
         # Send image to Gemini with structured prompt
-        response = model.generate_content(
+        response = get_model().generate_content(
             [
                 """
 You are a skilled nutrition analyst. Please follow these exact instructions for analyzing the food or dish in the image:
@@ -1,6 +1,11 @@
-import requests
+import os
+import sys
 import json
 
+# Shared helpers (http_sessions.py) live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_sessions import get_session
+
 # Grok API configuration
 GROK_API_KEY = "<GROK_API_KEY>"
 GROK_API_URL = "https://api.x.ai/v1/chat/completions"
@@ -32,7 +37,7 @@ def test_grok_api():
         print("Testing Grok API...")
         print(f"Sending request to: {GROK_API_URL}")
         
-        response = requests.post(GROK_API_URL, json=payload, headers=headers, timeout=30)
+        response = get_session("xai").post(GROK_API_URL, json=payload, headers=headers, timeout=30)
         
         print(f"\nStatus Code: {response.status_code}")
         
@@ -1,7 +1,12 @@
 
-import requests
+import os
+import sys
 import json
 
+# Shared helpers (http_sessions.py) live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_sessions import get_session
+
 # OpenRouter API configuration
 OPENROUTER_API_KEY = "<OPENROUTER_API_KEY>"
 OPENROUTER_URL = "https://openrouter.ai/v1/chat/completions"  # Correct URL
@@ -41,7 +46,7 @@ def test_openrouter_grok_vision():
         print("Testing OpenRouter + Grok Vision API (Image)")
         print("=" * 50)
         
-        response = requests.post(OPENROUTER_URL, json=payload, headers=headers, timeout=60)
+        response = get_session("openrouter").post(OPENROUTER_URL, json=payload, headers=headers, timeout=60)
         
         print(f"\nStatus Code: {response.status_code}")
         print(f"Raw Response: {response.text}")  # Print the raw response
@@ -0,0 +1,54 @@
+import os
+
+
+# ---------------------- Server ------------------------
+# gunicorn -c gunicorn.conf.py   (picked up automatically from this directory)
+# APP_MODULE=async_app:app WORKER_CLASS=uvicorn.workers.UvicornWorker serves the async app instead
+wsgi_app = os.getenv("APP_MODULE", "final:create_app()")
+bind = os.getenv("BIND", "0.0.0.0:5000")
+backlog = 2048
+
+# Pre-forked workers, each with a pool of threads: requests mostly wait on the model API,
+# so threads cover the concurrency and processes cover the CPU work (decode, resize, encode)
+workers = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 2)))
+worker_class = os.getenv("WORKER_CLASS", "gthread")
+threads = int(os.getenv("WEB_THREADS", "16"))
+keepalive = 5
+
+# Model calls time out after 60 s; a request also decodes and encodes around it
+timeout = 120
+# On restart (SIGHUP) or stop (SIGTERM) workers stop accepting and get this long to finish
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "90"))
+
+# Recycle workers now and then so slow leaks (Pillow, fragmentation) cannot build up; 0 = never
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+# Import the app once in the master; workers share its memory copy-on-write.
+# With preload, SIGHUP restarts workers on the loaded code: deploy with a full restart
+# (or USR2 + WINCH + QUIT of the old master).
+preload_app = True
+
+
+# ---------------------- Hooks ------------------------
+def on_starting(server):
+    import final
+    # Jobs a previous server left 'running' are re-queued once, here: a worker doing it at
+    # its own start would re-queue the jobs its siblings are running
+    final.job_queue.recover()
+    final.job_queue.recover_on_start = False
+
+
+def pre_fork(server, worker):
+    import final
+    final.before_fork()
+
+
+def post_worker_init(worker):
+    import final
+    final.after_fork()
+
+
+def worker_exit(server, worker):
+    import final
+    final.drain(timeout=server.cfg.graceful_timeout / 2)
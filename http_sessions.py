@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+# ---------------------- Settings ------------------------
+# One pooled, keep-alive session per model backend instead of a bare
+# requests.post (and a fresh TCP + TLS handshake) for every image.
+BACKENDS = {
+    "openrouter": {"pool_size": int(os.getenv("OPENROUTER_POOL_SIZE", "32"))},
+    "anthropic": {"pool_size": int(os.getenv("ANTHROPIC_POOL_SIZE", "16"))},
+    "xai": {"pool_size": int(os.getenv("XAI_POOL_SIZE", "16"))},
+    "gemini": {"pool_size": int(os.getenv("GEMINI_POOL_SIZE", "16"))},
+}
+
+# Retry failed connects and 429/502/503/504 with exponential backoff (0.5 s, 1 s, 2 s), honouring
+# Retry-After. Those requests never reached the model. A read timeout or a 500 may mean the
+# model is generating, or has generated, a billed answer: they are not retried
+RETRY_TOTAL = int(os.getenv("HTTP_RETRY_TOTAL", "3"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# HTTP/2 goes through httpx and needs the h2 package (pip install "httpx[http2]")
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "0") == "1"
+
+TIMING_HISTORY = 1000
+
+
+# ---------------------- Timing records ------------------------
+_local = threading.local()
+_timings_lock = threading.Lock()
+timings = deque(maxlen=TIMING_HISTORY)
+
+
+def _record(backend, status, elapsed_ms, connect_ms, tls_ms):
+    # TTFB is what is left of the request once handshakes are taken out
+    ttfb_ms = max(0.0, elapsed_ms - (connect_ms or 0.0) - (tls_ms or 0.0))
+    record = {
+        "backend": backend,
+        "status": status,
+        "reused": connect_ms is None,
+        "connect_ms": connect_ms,
+        "tls_ms": tls_ms,
+        "ttfb_ms": ttfb_ms,
+        "total_ms": elapsed_ms,
+        "time": time.time(),
+    }
+    with _timings_lock:
+        timings.append(record)
+    return record
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timing_summary():
+    """
+    Aggregate recent request timings per backend
+    Returns: dict backend -> counts and p50/p95 of connect, TLS and TTFB in ms
+    """
+    with _timings_lock:
+        records = list(timings)
+
+    summary = {}
+    for backend in sorted({r["backend"] for r in records}):
+        rows = [r for r in records if r["backend"] == backend]
+        fresh = [r for r in rows if not r["reused"]]
+        summary[backend] = {
+            "requests": len(rows),
+            "new_connections": len(fresh),
+            "reused_connections": len(rows) - len(fresh),
+            "connect_ms_p50": _percentile([r["connect_ms"] for r in fresh], 0.5),
+            "tls_ms_p50": _percentile([r["tls_ms"] for r in fresh if r["tls_ms"] is not None], 0.5),
+            "ttfb_ms_p50": _percentile([r["ttfb_ms"] for r in rows], 0.5),
+            "ttfb_ms_p95": _percentile([r["ttfb_ms"] for r in rows], 0.95),
+            "total_ms_p50": _percentile([r["total_ms"] for r in rows], 0.5),
+        }
+    return summary
+
+
+# ---------------------- Timed urllib3 connections ------------------------
+def _add(name, ms):
+    setattr(_local, name, (getattr(_local, name, None) or 0.0) + ms)
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        _add("connect_ms", (time.perf_counter() - start) * 1000)
+        return sock
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        _add("connect_ms", (time.perf_counter() - start) * 1000)
+        return sock
+
+    def connect(self):
+        # connect() = TCP (_new_conn, timed above) + TLS handshake
+        start = time.perf_counter()
+        before = getattr(_local, "connect_ms", None) or 0.0
+        super().connect()
+        tcp_ms = (getattr(_local, "connect_ms", None) or 0.0) - before
+        _add("tls_ms", (time.perf_counter() - start) * 1000 - tcp_ms)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that records connect, TLS and time-to-first-byte for every request
+    """
+
+    def __init__(self, backend, **kwargs):
+        self.backend = backend
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        _local.connect_ms = None
+        _local.tls_ms = None
+        start = time.perf_counter()
+        # Returns once the response headers are in; the body is read later by the Session
+        response = super().send(request, **kwargs)
+        _record(
+            self.backend,
+            response.status_code,
+            (time.perf_counter() - start) * 1000,
+            _local.connect_ms,
+            _local.tls_ms,
+        )
+        return response
+
+
+# ---------------------- HTTP/2 session (optional) ------------------------
+class Http2Session:
+    """
+    Minimal requests-compatible wrapper around httpx.Client(http2=True)
+    post() returns an httpx.Response, which has status_code, text and json()
+    """
+
+    def __init__(self, backend, pool_size, retry_total=RETRY_TOTAL):
+        import httpx
+
+        self.backend = backend
+        self.retry_total = retry_total
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    def post(self, url, timeout=None, **kwargs):
+        # Responses are always read in full; iter_lines() still works on them
+        kwargs.pop("stream", None)
+        for attempt in range(self.retry_total + 1):
+            marks = {}
+
+            def trace(event, info):
+                marks[event] = time.perf_counter()
+
+            start = time.perf_counter()
+            response = self._client.post(url, timeout=timeout, extensions={"trace": trace}, **kwargs)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            connect_ms = tls_ms = None
+            if "connection.connect_tcp.complete" in marks:
+                connect_ms = (marks["connection.connect_tcp.complete"] - marks["connection.connect_tcp.started"]) * 1000
+            if "connection.start_tls.complete" in marks:
+                tls_ms = (marks["connection.start_tls.complete"] - marks["connection.start_tls.started"]) * 1000
+            _record(self.backend, response.status_code, elapsed_ms, connect_ms, tls_ms)
+
+            if response.status_code not in RETRY_STATUSES or attempt == self.retry_total:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else RETRY_BACKOFF * (2 ** attempt)
+            time.sleep(delay)
+        return response
+
+
+# ---------------------- Session registry ------------------------
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _build_session(backend, retry_total, retry_connect):
+    pool_size = BACKENDS.get(backend, {}).get("pool_size", 10)
+
+    if HTTP2_ENABLED:
+        return Http2Session(backend, pool_size, retry_total)
+
+    retry = Retry(
+        total=retry_total,
+        connect=retry_connect,
+        read=False,
+        other=0,
+        status=retry_total,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        # Model calls are POSTs: retried only when the request was refused (see RETRY_STATUSES)
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimedHTTPAdapter(backend, pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(backend, retry_total=None, retry_connect=None):
+    """
+    Shared keep-alive session for a backend ("openrouter", "anthropic", "xai", ...)
+    retry_total overrides HTTP_RETRY_TOTAL, e.g. 0 when the caller fails over instead
+    retry_connect: retries of failed connects (default retry_total), e.g. 0 behind a circuit
+    breaker, which bounds a backend that does not answer by itself
+    Returns: requests.Session (or Http2Session when HTTP2_ENABLED=1)
+    """
+    if retry_total is None:
+        retry_total = RETRY_TOTAL
+    if retry_connect is None:
+        retry_connect = retry_total
+    key = (backend, retry_total, retry_connect)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _build_session(backend, retry_total, retry_connect)
+    return session
@@ -0,0 +1,123 @@
+from io import BytesIO
+
+from PIL import Image, features
+
+from image_encoder import MODEL_MAX_SIDE, encode_image_for_model, load_for_model
+
+
+# ---------------------- Derivative settings ------------------------
+# Bump when a size or format below changes. Derivative URLs carry the version, so
+# browsers holding the old (immutable) responses fetch the new renditions.
+DERIVATIVE_VERSION = "1"
+
+# Longest edge of the renditions shown on the page
+DISPLAY_SIDES = {"thumb": 320, "display": 1024}
+DISPLAY_QUALITY = 80
+
+# Longest edge each provider analyses at; anything larger is downscaled on their side
+MODEL_INPUT_SIDES = {
+    "qwen": MODEL_MAX_SIDE,
+    "claude": 1568,
+    "grok": 1568,
+    "gemini": 1536,
+    "llama": 1120,
+}
+
+if features.check("webp"):
+    DISPLAY_FORMAT, DISPLAY_MIME = "WEBP", "image/webp"
+else:
+    DISPLAY_FORMAT, DISPLAY_MIME = "JPEG", "image/jpeg"
+
+
+# ---------------------- Derivatives ------------------------
+class ImageDerivatives:
+    """
+    Page and model renditions of the uploads in a BlobStore.
+
+    One decode, at the largest size any rendition needs, produces all of them:
+    each smaller one is resized from the previous, never from the original.
+    Renditions are blobs themselves (so their sha256 key is a strong ETag) and are
+    linked to their source key, so each is made once per source and looked up after.
+    The model input keeps the upload's aspect ratio at the backend's target size.
+    """
+
+    def __init__(self, store, model_backend="qwen", max_size_mb=4.5):
+        self.store = store
+        self.model_backend = model_backend
+        self.max_size_mb = max_size_mb
+        self.counters = {"decodes": 0, "generated": 0, "hits": 0}
+
+    def sides(self):
+        sides = dict(DISPLAY_SIDES)
+        sides["model"] = MODEL_INPUT_SIDES.get(self.model_backend, MODEL_MAX_SIDE)
+        return sides
+
+    def _label(self, variant):
+        # The model input depends on the backend, and every rendition on the version
+        if variant == "model":
+            return f"model-{self.model_backend}.v{DERIVATIVE_VERSION}"
+        return f"{variant}.v{DERIVATIVE_VERSION}"
+
+    def decode(self, source_key):
+        """
+        Returns: RGB image of the stored upload at the largest size any rendition needs
+        """
+        self.counters["decodes"] += 1
+        return load_for_model(self.store.path(source_key), max_side=max(self.sides().values()))
+
+    def generate(self, source_key, image=None, variants=None, return_images=False):
+        """
+        Render and store variants (default: all) of a source
+        image: the source as returned by decode(), when the caller already has it
+        return_images: also return the resized PIL images, e.g. for checks on the thumbnail
+        Returns: dict variant -> rendition bytes, or (that dict, dict variant -> PIL image)
+        """
+        sides = self.sides()
+        variants = sides if variants is None else variants
+        if image is None:
+            image = self.decode(source_key)
+
+        rendered = {}
+        images = {}
+        # Largest first, so each resize starts from the smallest image that still suffices
+        for variant in sorted(variants, key=lambda name: -sides[name]):
+            side = sides[variant]
+            if max(image.size) > side:
+                image = image.copy()
+                image.thumbnail((side, side), Image.BILINEAR, reducing_gap=2.0)
+
+            if variant == "model":
+                data, mime = encode_image_for_model(image, max_size_mb=self.max_size_mb), "image/jpeg"
+            else:
+                output = BytesIO()
+                image.save(output, format=DISPLAY_FORMAT, quality=DISPLAY_QUALITY)
+                data, mime = output.getvalue(), DISPLAY_MIME
+
+            key = self.store.put(data, mime=mime)
+            self.store.link(source_key, self._label(variant), key)
+            rendered[variant] = data
+            images[variant] = image
+            self.counters["generated"] += 1
+        return (rendered, images) if return_images else rendered
+
+    def get(self, source_key, variant):
+        """
+        A page rendition, generated on first use if the upload is still stored
+        Returns: blob dict (see BlobStore.get) or None
+        """
+        if variant not in DISPLAY_SIDES:
+            return None
+
+        key = self.store.derivative(source_key, self._label(variant))
+        blob = self.store.get(key) if key else None
+        if blob is not None:
+            self.counters["hits"] += 1
+            return blob
+
+        if self.store.get(source_key) is None:
+            return None
+        self.generate(source_key, variants=list(DISPLAY_SIDES))
+        return self.store.get(self.store.derivative(source_key, self._label(variant)))
+
+    def stats(self):
+        return dict(self.counters, model_backend=self.model_backend, sides=self.sides(), format=DISPLAY_FORMAT)
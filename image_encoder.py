@@ -0,0 +1,160 @@
+from io import BytesIO
+
+from PIL import Image
+
+
+# ---------------------- Encoder settings ------------------------
+# Longest edge the vision models actually look at; anything larger is
+# downscaled by the provider anyway, so sending it only costs upload time.
+MODEL_MAX_SIDE = 1568
+
+DEFAULT_QUALITY = 85
+MIN_QUALITY = 20
+
+# Side of the thumbnail used to predict the full-size output
+PROBE_SIDE = 256
+
+
+# ---------------------- Upload check ------------------------
+# Formats an upload may be in, and the type it is stored and served as
+UPLOAD_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "MPO": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+}
+
+
+def sniff_image(stream):
+    """
+    Identify an upload from its header (Pillow reads a few KB, nothing is decoded) and rewind it
+    stream: seekable binary file
+    Returns: its mime type from UPLOAD_MIME_TYPES, or None when it is not an image we accept
+    """
+    position = stream.tell()
+    try:
+        with Image.open(stream) as img:
+            return UPLOAD_MIME_TYPES.get(img.format)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        stream.seek(position)
+
+
+def load_for_model(source, max_side=MODEL_MAX_SIDE):
+    """
+    Decode an upload straight to model resolution
+    source: image bytes, or a path / binary file to decode from without reading it into memory first
+    JPEG sources use draft mode so the decoder itself downsamples by 1/2, 1/4 or 1/8
+    Returns: RGB PIL image whose longest edge is at most max_side; the upload's own
+    (width, height) is kept in its info["source_size"]
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    img = Image.open(source)
+    source_size = img.size
+
+    if max_side and img.format == "JPEG" and max(img.size) > max_side:
+        # draft() only downsamples while both sides stay >= the requested size, so ask
+        # for the aspect-correct target; (max_side, max_side) would rule out every
+        # scale for non-square photos. Load now so thumbnail() cannot redo the draft.
+        scale = max_side / float(max(img.size))
+        img.draft("RGB", (round(img.width * scale), round(img.height * scale)))
+        img.load()
+
+    if img.mode == "P":
+        img = img.convert("RGBA")
+
+    if max_side and max(img.size) > max_side:
+        # reducing_gap makes Pillow box-reduce by an integer factor first, so the
+        # bilinear pass only ever works on at most 2x the target size
+        img.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+
+    # Flatten after resizing so alpha compositing runs on the small image
+    img = flatten_to_rgb(img)
+    img.info["source_size"] = source_size
+    return img
+
+
+def flatten_to_rgb(img):
+    """
+    Composite transparent images on white and convert everything else to RGB
+    Returns: RGB PIL image
+    """
+    if img.mode == "P":
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img.convert("RGBA"), mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def encode_jpeg(img, quality):
+    output = BytesIO()
+    img.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def pick_quality(img, max_bytes, quality=DEFAULT_QUALITY):
+    """
+    Predict the highest quality (<= quality) whose full-size encode fits max_bytes
+    Binary-searches on a small probe thumbnail and scales its size by pixel count
+    Returns: JPEG quality
+    """
+    # Even uncompressed RGB would fit: no need to probe
+    if img.width * img.height * 3 <= max_bytes:
+        return quality
+
+    probe = img.copy()
+    probe.thumbnail((PROBE_SIDE, PROBE_SIDE), Image.BILINEAR)
+    scale = (img.width * img.height) / float(probe.width * probe.height)
+
+    def predicted(q):
+        return len(encode_jpeg(probe, q)) * scale
+
+    # Thumbnails carry more detail per pixel than the full image, so the
+    # prediction overestimates and errs on the side of fitting the limit
+    if predicted(quality) <= max_bytes:
+        return quality
+
+    low, high = MIN_QUALITY, quality
+    while low < high:
+        mid = (low + high + 1) // 2
+        if predicted(mid) <= max_bytes:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def encode_for_model(image_bytes, max_size_mb=4.5, max_side=MODEL_MAX_SIDE):
+    """
+    Single-pass replacement for compress_image's quality loop:
+    decode at model resolution, predict the quality, encode once
+    Returns: JPEG bytes under max_size_mb (unless MIN_QUALITY still does not fit)
+    """
+    img = load_for_model(image_bytes, max_side=max_side)
+    return encode_image_for_model(img, max_size_mb=max_size_mb)
+
+
+def encode_image_for_model(img, max_size_mb=4.5):
+    """
+    encode_for_model for an image already decoded by load_for_model
+    Returns: JPEG bytes under max_size_mb (unless MIN_QUALITY still does not fit)
+    """
+    max_bytes = int(max_size_mb * 1024 * 1024)
+    quality = pick_quality(img, max_bytes)
+    encoded = encode_jpeg(img, quality)
+
+    # The prediction is conservative, but fall back to stepping down if it missed
+    while len(encoded) > max_bytes and quality > MIN_QUALITY:
+        quality = max(MIN_QUALITY, quality - 10)
+        encoded = encode_jpeg(img, quality)
+
+    return encoded
@@ -0,0 +1,386 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+
+# ---------------------- Job queue ------------------------
+class JobQueue:
+    """
+    SQLite-backed job queue with a pool of worker threads.
+
+    submit() stores the upload in spool_dir (or, given a BlobStore, pins it in
+    the store) and returns a job id immediately; a worker later claims the job,
+    runs handler(image_bytes, filename, progress) and stores its
+    (JSON-serialisable) return value as the job result.
+    progress(key, value) publishes partial results while the job runs.
+    Jobs left 'running' by a crashed process are re-queued on start().
+    A claimed job holds a lease of lease_seconds, renewed by its process while it runs;
+    a job whose lease ran out (its process died or was recycled) is re-queued by the
+    worker threads of any process. Those threads also delete finished jobs ttl_seconds
+    after they finish (None: kept). Both happen every PRUNE_EVERY seconds.
+    """
+
+    PRUNE_EVERY = 60
+
+    def __init__(self, path, handler, workers=4, spool_dir=None, store=None, ttl_seconds=None, lease_seconds=60):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.spool_dir = spool_dir or os.path.join(os.path.dirname(os.path.abspath(path)), "spool")
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self._pruned = 0.0
+        self._prune_lock = threading.Lock()
+        self.counters = {"pruned": 0, "expired": 0}
+        # job id -> claim token of each job this process is running, for the lease renewals
+        self._running = {}
+        self._running_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self.recover_on_start = True
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " filename TEXT,"
+            " created REAL NOT NULL,"
+            " started REAL,"
+            " finished REAL,"
+            " result TEXT,"
+            " error TEXT,"
+            " partial TEXT,"
+            " blob TEXT,"
+            " owner TEXT,"
+            " lease_until REAL)"
+        )
+        columns = [row[1] for row in db.execute("PRAGMA table_info(jobs)")]
+        for column, kind in (("partial", "TEXT"), ("blob", "TEXT"), ("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)")
+        db.commit()
+
+    def _db(self):
+        # One connection per thread; WAL lets readers and the writer proceed together
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+        return db
+
+    def close(self):
+        """
+        Close this thread's connection; the next call opens a fresh one.
+        Call before fork: an SQLite connection must not be used on both sides of one.
+        """
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    # ---------------------- Lifecycle ------------------------
+    def recover(self):
+        """
+        Re-queue jobs left 'running' by a crashed process. Runs once per start() unless
+        recover_on_start is False: with several worker processes on one queue, the
+        server does it once before forking, since the other workers' jobs are 'running' too.
+        Later, jobs of a process that dies are re-queued once their lease runs out (requeue_expired).
+        """
+        db = self._db()
+        db.execute(
+            "UPDATE jobs SET status = 'queued', started = NULL, owner = NULL, lease_until = NULL"
+            " WHERE status = 'running'"
+        )
+        db.commit()
+
+    def requeue_expired(self):
+        """
+        Re-queue running jobs whose lease ran out: the process running them is gone
+        Returns: number of jobs re-queued
+        """
+        db = self._db()
+        requeued = db.execute(
+            "UPDATE jobs SET status = 'queued', started = NULL, owner = NULL, lease_until = NULL"
+            " WHERE status = 'running' AND lease_until < ?",
+            (time.time(),),
+        ).rowcount
+        db.commit()
+        self.counters["expired"] += requeued
+        if requeued:
+            self._notify()
+        return requeued
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            if self.recover_on_start:
+                self.recover()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            threading.Thread(target=self._renew_leases, name="job-leases", daemon=True).start()
+
+    def prune(self):
+        """
+        Delete jobs that finished more than ttl_seconds ago; their uploads were released when they finished
+        Returns: number of jobs deleted
+        """
+        if not self.ttl_seconds:
+            return 0
+        db = self._db()
+        deleted = db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+            (time.time() - self.ttl_seconds,),
+        ).rowcount
+        db.commit()
+        self.counters["pruned"] += deleted
+        return deleted
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        self._notify()
+        # Jobs cut off keep their last lease and are re-queued once it runs out
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # ---------------------- Producer side ------------------------
+    def submit(self, image_bytes, filename):
+        """
+        Queue an upload for analysis
+        Returns: job id
+        """
+        if self.store is not None:
+            return self._enqueue(filename, self.store.put(image_bytes, pin=True))
+
+        job_id = uuid.uuid4().hex
+        with open(os.path.join(self.spool_dir, job_id), "wb") as f:
+            f.write(image_bytes)
+        return self._enqueue(filename, None, job_id)
+
+    def submit_stream(self, stream, filename, mime=None):
+        """
+        Queue an upload straight from a file-like object (needs a store)
+        Returns: job id
+        """
+        return self._enqueue(filename, self.store.put_stream(stream, mime=mime, pin=True))
+
+    def _enqueue(self, filename, blob, job_id=None):
+        self.start()
+        job_id = job_id or uuid.uuid4().hex
+        db = self._db()
+        db.execute(
+            "INSERT INTO jobs (id, status, filename, created, blob) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, filename, time.time(), blob),
+        )
+        db.commit()
+        self._notify()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns: job as a dict (with queue position while queued) or None
+        """
+        db = self._db()
+        row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = {
+            "id": row["id"],
+            "status": row["status"],
+            "filename": row["filename"],
+            "created": row["created"],
+            "started": row["started"],
+            "finished": row["finished"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "partial": json.loads(row["partial"]) if row["partial"] else None,
+        }
+        if row["status"] == "queued":
+            job["position"] = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?", (row["created"],)
+            ).fetchone()[0]
+        return job
+
+    def wait_for_change(self, timeout=1.0):
+        """
+        Block until any job changes state in this process (or timeout)
+        Jobs finished by other processes are picked up by the caller re-polling
+        """
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def stats(self, window=500):
+        """
+        Queue depth plus wait time (queued -> started) and service time (started -> finished)
+        over the last `window` finished jobs
+        Returns: dict
+        """
+        db = self._db()
+        counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        rows = db.execute(
+            "SELECT created, started, finished FROM jobs WHERE finished IS NOT NULL"
+            " ORDER BY finished DESC LIMIT ?",
+            (window,),
+        ).fetchall()
+        waits = sorted(r["started"] - r["created"] for r in rows)
+        services = sorted(r["finished"] - r["started"] for r in rows)
+        oldest = db.execute("SELECT MIN(created) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+        def pct(values, fraction):
+            return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+        return {
+            "depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "workers": self.workers,
+            "pruned": self.counters["pruned"],
+            "expired": self.counters["expired"],
+            "oldest_queued_age_s": time.time() - oldest if oldest else 0.0,
+            "wait_s_p50": pct(waits, 0.5),
+            "wait_s_p95": pct(waits, 0.95),
+            "service_s_p50": pct(services, 0.5),
+            "service_s_p95": pct(services, 0.95),
+        }
+
+    # ---------------------- Worker side ------------------------
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _claim(self):
+        """
+        Returns: the claimed job's row (id, filename, blob, owner) or None
+        """
+        now = time.time()
+        # Unique per claim: a job re-queued from under a stalled runner and claimed again
+        # (even by the same process) is not finished or released twice
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        db = self._db()
+        row = db.execute(
+            "UPDATE jobs SET status = 'running', started = ?, owner = ?, lease_until = ?"
+            " WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1)"
+            " AND status = 'queued'"
+            " RETURNING id, filename, blob, owner",
+            (now, owner, now + self.lease_seconds),
+        ).fetchone()
+        db.commit()
+        if row is not None:
+            with self._running_lock:
+                self._running[row["id"]] = owner
+        return row
+
+    def _renew_leases(self):
+        # A third of the lease: two renewals may fail (a busy database) before it runs out
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._running_lock:
+                running = list(self._running.items())
+            if not running:
+                continue
+            try:
+                db = self._db()
+                db.executemany(
+                    "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ?",
+                    [(time.time() + self.lease_seconds, job_id, owner) for job_id, owner in running],
+                )
+                db.commit()
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def _maybe_prune(self):
+        # One worker thread at a time, every PRUNE_EVERY seconds
+        now = time.monotonic()
+        if now - self._pruned < self.PRUNE_EVERY or not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._pruned = now
+            self.requeue_expired()
+            self.prune()
+        except sqlite3.Error:
+            traceback.print_exc()
+        finally:
+            self._prune_lock.release()
+
+    def _work(self):
+        while not self._stopping:
+            self._maybe_prune()
+            row = self._claim()
+            if row is None:
+                self.wait_for_change(timeout=1.0)
+                continue
+            self._notify()
+
+            spool_path = os.path.join(self.spool_dir, row["id"])
+            # Only a finish recorded under this claim releases the upload: a job re-queued from under
+            # us, or cut off before finishing, keeps it for its next run
+            owned = False
+            try:
+                if row["blob"]:
+                    image_bytes = self.store.read(row["blob"])
+                    if image_bytes is None:
+                        raise RuntimeError("upload is no longer in the store")
+                else:
+                    with open(spool_path, "rb") as f:
+                        image_bytes = f.read()
+                result = self.handler(image_bytes, row["filename"], self._progress_for(row["id"]))
+                owned = self._finish(row["id"], row["owner"], "done", result=json.dumps(result))
+            except Exception as e:
+                traceback.print_exc()
+                owned = self._finish(row["id"], row["owner"], "failed", error=str(e))
+            finally:
+                with self._running_lock:
+                    self._running.pop(row["id"], None)
+                if owned and row["blob"]:
+                    # The job held the upload pinned since submit
+                    self.store.decref(row["blob"])
+                elif owned and os.path.exists(spool_path):
+                    os.remove(spool_path)
+
+    def _progress_for(self, job_id):
+        partial = {}
+
+        def progress(key, value):
+            partial[key] = value
+            db = self._db()
+            db.execute("UPDATE jobs SET partial = ? WHERE id = ?", (json.dumps(partial), job_id))
+            db.commit()
+            self._notify()
+
+        return progress
+
+    def _finish(self, job_id, owner, status, result=None, error=None):
+        """
+        Returns: False when the job is no longer this claim's (its lease ran out and it was re-queued)
+        """
+        db = self._db()
+        updated = db.execute(
+            "UPDATE jobs SET status = ?, finished = ?, result = ?, error = ?, owner = NULL, lease_until = NULL"
+            " WHERE id = ? AND owner = ?",
+            (status, time.time(), result, error, job_id, owner),
+        ).rowcount
+        db.commit()
+        self._notify()
+        return updated > 0
@@ -113,8 +113,9 @@ app = Flask(__name__)
 
 # Image processing function
 def process_image(image):
-    # Resize image for better processing
-    image = image.resize((800, 800))
+    # Shrink to at most 800 px on the longest edge, keeping the aspect ratio
+    image = image.convert("RGB")
+    image.thumbnail((800, 800))
     
     # Convert the image to base64 for API submission
     buffered = BytesIO()
@@ -0,0 +1,213 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from admission import Overloaded
+from circuit_breaker import CircuitOpen
+
+
+# ---------------------- Token / latency accounting ------------------------
+class UsageMeter:
+    """
+    Tokens and model time per image for one-by-one calls ("single") and
+    multi-image calls ("batch"), from the usage block of each response
+    """
+
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=history)
+
+    def record(self, path, images, seconds, usage=None):
+        usage = usage or {}
+        with self._lock:
+            self._calls.append({
+                "path": path,
+                "images": images,
+                "seconds": seconds,
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+            })
+
+    def summary(self):
+        """
+        Returns: dict path -> per-image averages, plus savings of batch over single (percent)
+        """
+        with self._lock:
+            calls = list(self._calls)
+
+        summary = {}
+        for path in ("single", "batch"):
+            rows = [c for c in calls if c["path"] == path]
+            images = sum(c["images"] for c in rows)
+            if not images:
+                continue
+            prompt = sum(c["prompt_tokens"] for c in rows) / images
+            completion = sum(c["completion_tokens"] for c in rows) / images
+            summary[path] = {
+                "calls": len(rows),
+                "images": images,
+                "prompt_tokens_per_image": prompt,
+                "completion_tokens_per_image": completion,
+                "total_tokens_per_image": prompt + completion,
+                "model_seconds_per_image": sum(c["seconds"] for c in rows) / images,
+            }
+
+        if "single" in summary and "batch" in summary:
+            single, batch = summary["single"], summary["batch"]
+
+            def saved(key):
+                return 100.0 * (1 - batch[key] / single[key]) if single[key] else None
+
+            summary["savings_percent"] = {
+                "total_tokens_per_image": saved("total_tokens_per_image"),
+                "model_seconds_per_image": saved("model_seconds_per_image"),
+            }
+        return summary
+
+
+# ---------------------- Micro-batcher ------------------------
+class MicroBatcher:
+    """
+    Gathers concurrent requests into small batches:
+
+        batcher = MicroBatcher(send_batch, send_single, max_size=4, max_wait_ms=50)
+        result = batcher.analyze(item)   # blocks until this item's result is back
+
+    A batch is sent once it holds max_size items or its oldest item has waited
+    max_wait_ms, whichever comes first. send_batch(items) must return one result
+    per item, in order, or raise; a failed batch is retried item by item with
+    send_single(item). A batch of one goes straight to send_single. A batch turned
+    away by admission control or an open breaker is not retried: each caller gets
+    the Overloaded or CircuitOpen.
+
+    partition() names the batch an item may join (e.g. admission.current_traffic, so
+    bulk and interactive items are never sent under one class); it is called in the
+    submitter's context, and each batch is sent in the context of its first item.
+    """
+
+    def __init__(self, send_batch, send_single, max_size=4, max_wait_ms=50, workers=8, partition=None):
+        self.send_batch = send_batch
+        self.send_single = send_single
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.partition = partition or (lambda: None)
+
+        # partition -> entries (item, future, arrival time, submitter's context), oldest first
+        self._pending = {}
+        self._changed = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="micro-batch")
+        self._thread = None
+
+        self._stats_lock = threading.Lock()
+        self._waits = deque(maxlen=1000)
+        self.counters = {
+            "batches": 0,
+            "batched_items": 0,
+            "single_items": 0,
+            "fallback_batches": 0,
+            "shed_batches": 0,
+        }
+
+    # ---------------------- Caller side ------------------------
+    def submit(self, item):
+        """
+        Returns: Future resolving to the result for item
+        """
+        future = Future()
+        key = self.partition()
+        with self._changed:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name="micro-batch-dispatch", daemon=True)
+                self._thread.start()
+            self._pending.setdefault(key, []).append((item, future, time.monotonic(), contextvars.copy_context()))
+            self._changed.notify()
+        return future
+
+    def analyze(self, item):
+        return self.submit(item).result()
+
+    def stats(self):
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            counters = dict(self.counters)
+        items = counters["batched_items"] + counters["single_items"]
+        sent = counters["batches"] + counters["single_items"]
+        counters["avg_items_per_request"] = items / sent if sent else None
+        counters["wait_ms_p50"] = waits[len(waits) // 2] * 1000 if waits else None
+        counters["max_size"] = self.max_size
+        counters["max_wait_ms"] = self.max_wait * 1000
+        return counters
+
+    # ---------------------- Dispatcher ------------------------
+    def _next_batch(self):
+        """
+        Returns: (entries of a full or expired batch, None), else (None, seconds until one expires)
+        """
+        now = time.monotonic()
+        wait = None
+        for key, entries in self._pending.items():
+            remaining = entries[0][2] + self.max_wait - now
+            if len(entries) >= self.max_size or remaining <= 0:
+                batch = entries[:self.max_size]
+                del entries[:self.max_size]
+                if not entries:
+                    del self._pending[key]
+                return batch, None
+            wait = remaining if wait is None else min(wait, remaining)
+        return None, wait
+
+    def _dispatch(self):
+        while True:
+            with self._changed:
+                while True:
+                    batch, wait = self._next_batch()
+                    if batch is not None:
+                        break
+                    self._changed.wait(wait)
+
+            now = time.monotonic()
+            with self._stats_lock:
+                self._waits.extend(now - entry[2] for entry in batch)
+            # A copy: the fallback may run the first item's single call in its own context meanwhile
+            self._pool.submit(batch[0][3].copy().run, self._send, batch)
+
+    def _send(self, batch):
+        if len(batch) == 1:
+            self._send_single(batch[0])
+            return
+
+        try:
+            results = self.send_batch([entry[0] for entry in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"expected {len(batch)} results, got {len(results)}")
+        except (Overloaded, CircuitOpen) as e:
+            # One call per item would be turned away the same way
+            with self._stats_lock:
+                self.counters["shed_batches"] += 1
+            for entry in batch:
+                entry[1].set_exception(e)
+            return
+        except Exception:
+            with self._stats_lock:
+                self.counters["fallback_batches"] += 1
+            # Fallback calls run side by side on the pool instead of one after another
+            for entry in batch:
+                self._pool.submit(entry[3].run, self._send_single, entry)
+            return
+
+        with self._stats_lock:
+            self.counters["batches"] += 1
+            self.counters["batched_items"] += len(batch)
+        for entry, result in zip(batch, results):
+            entry[1].set_result(result)
+
+    def _send_single(self, entry):
+        item, future, _, _ = entry
+        with self._stats_lock:
+            self.counters["single_items"] += 1
+        try:
+            future.set_result(self.send_single(item))
+        except Exception as e:
+            future.set_exception(e)
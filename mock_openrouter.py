@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import json
+import random
+
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from quart import Quart, g, request, jsonify
+
+
+# ---------------------- Mock OpenRouter ------------------------
+# Local stand-in for https://openrouter.ai/api/v1/chat/completions used by the
+# load tests. Point the apps at it with
+#   QWEN_API_URL=http://127.0.0.1:8090/api/v1/chat/completions
+# It also speaks the Anthropic (/v1/messages) and Gemini
+# (/v1beta/models/<model>:generateContent) formats for the model router.
+app = Quart(__name__)
+
+LATENCY_SECONDS = 1.0
+JITTER_SECONDS = 0.0
+# "uniform": LATENCY_SECONDS +/- JITTER_SECONDS; "lognormal": median LATENCY_SECONDS with
+# log-space spread LATENCY_SIGMA, the long right tail real model APIs have
+LATENCY_DISTRIBUTION = "uniform"
+LATENCY_SIGMA = 0.5
+# Each extra image in a multi-image request adds this much (its answer still has to be generated)
+PER_IMAGE_SECONDS = 0.25
+# Fraction of multi-image answers returned as prose instead of a JSON array
+BAD_BATCH_RATE = 0.0
+# Fraction of requests answered with a 503, and of requests that take SLOW_SECONDS instead
+ERROR_RATE = 0.0
+SLOW_RATE = 0.0
+SLOW_SECONDS = 10.0
+# Provider concurrency quota: requests beyond this many in flight get a 429 with
+# Retry-After: QUOTA_RETRY_AFTER (0 = no quota)
+MAX_CONCURRENCY = 0
+QUOTA_RETRY_AFTER = 1
+
+# Outage switched on and off at runtime with POST /mock/fault {"mode": ...}: "hang" answers
+# after HANG_SECONDS, "error" answers every request with a 503, "ok" ends the outage
+FAULT = {"mode": "ok"}
+HANG_SECONDS = 300.0
+
+# Rough token costs: the text prompt once per request, then each image and each answer
+PROMPT_TOKENS = 400
+IMAGE_TOKENS = 500
+ANSWER_TOKENS = 120
+
+CANNED_ANALYSIS = {
+    "dish_name": "Mock Dish",
+    "description": "Canned response from the local mock OpenRouter server.",
+    "nutrition": {
+        "calories": "150-180 kcal",
+        "carbohydrates": "20-25 g",
+        "sugars": "3-5 g",
+        "fiber": "2-4 g",
+        "protein": "15-20 g",
+        "fat": "5-8 g"
+    },
+    "portion_estimate": "Single serving, approximately 200g, total estimated 300-350 kcal"
+}
+
+
+# How single-image answers are written, as weights: plain JSON, JSON in a markdown fence,
+# JSON after a sentence of prose, or the markdown line format of the Gemini/Claude prompts
+RESPONSE_FORMATS = {"json": 1.0}
+
+
+def render_answer(analysis, answer_format):
+    if answer_format == "fenced":
+        return "```json\n" + json.dumps(analysis, indent=2) + "\n```"
+    if answer_format == "prose":
+        return "Here is the nutrition analysis of the meal:\n" + json.dumps(analysis)
+    if answer_format == "lines":
+        lines = [f"**{analysis['dish_name']}**", analysis["description"], ""]
+        lines += [f"- {key.capitalize()}: {value}" for key, value in analysis["nutrition"].items()]
+        return "\n".join(lines + ["", analysis["portion_estimate"]])
+    return json.dumps(analysis)
+
+
+def parse_formats(text):
+    """
+    "json=0.7,lines=0.3" -> {"json": 0.7, "lines": 0.3}
+    """
+    formats = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        formats[name.strip()] = float(weight or 1)
+    return formats
+
+
+# Streamed answers arrive in chunks of this many characters, spread over the latency
+STREAM_CHUNK_CHARS = 8
+
+
+async def stream_completion(content, latency):
+    # OpenAI-style SSE: one 'data:' line per delta, then [DONE]
+    pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+    yield b": OPENROUTER PROCESSING\n\n"
+    for piece in pieces:
+        await asyncio.sleep(latency / len(pieces))
+        chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+        yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+    yield b"data: [DONE]\n\n"
+
+
+def plan_response(images):
+    """
+    Latency and answer text for a request carrying `images` images
+    Returns: (seconds, content, usage) - content is None for an injected error
+    """
+    latency = LATENCY_SECONDS + PER_IMAGE_SECONDS * (images - 1)
+    if random.random() < SLOW_RATE:
+        latency = SLOW_SECONDS
+    elif LATENCY_DISTRIBUTION == "lognormal":
+        latency *= random.lognormvariate(0.0, LATENCY_SIGMA)
+    latency = max(0.0, latency + random.uniform(-JITTER_SECONDS, JITTER_SECONDS))
+    if FAULT["mode"] == "hang":
+        latency = HANG_SECONDS
+
+    # Several images in one message get an array with one answer per image
+    if images <= 1:
+        answer_format = random.choices(list(RESPONSE_FORMATS), weights=list(RESPONSE_FORMATS.values()))[0]
+        content = render_answer(CANNED_ANALYSIS, answer_format)
+    else:
+        content = json.dumps([CANNED_ANALYSIS] * images)
+    if images > 1 and random.random() < BAD_BATCH_RATE:
+        content = "Here are the analyses you asked for: " + content[:len(content) // 2]
+    if random.random() < ERROR_RATE or FAULT["mode"] == "error":
+        content = None
+
+    usage = {
+        "prompt_tokens": PROMPT_TOKENS + IMAGE_TOKENS * images,
+        "completion_tokens": ANSWER_TOKENS * images,
+        "total_tokens": PROMPT_TOKENS + (IMAGE_TOKENS + ANSWER_TOKENS) * images,
+    }
+    return latency, content, usage
+
+
+async def injected_error(latency):
+    # Fail fast-ish, like an overloaded upstream
+    await asyncio.sleep(latency / 4)
+    return jsonify({"error": {"message": "mock overloaded", "code": 503}}), 503
+
+
+# In flight now, the most ever in flight, and requests turned away by the quota (served at /mock/stats)
+quota = {"in_flight": 0, "peak": 0, "served": 0, "rejected": 0}
+
+
+@app.before_request
+async def enforce_quota():
+    if request.path.startswith("/mock/"):
+        return None
+    if MAX_CONCURRENCY and quota["in_flight"] >= MAX_CONCURRENCY:
+        quota["rejected"] += 1
+        return (jsonify({"error": {"message": "rate limit exceeded", "code": 429}}), 429,
+                {"Retry-After": str(QUOTA_RETRY_AFTER)})
+    # Streamed answers leave the count when their headers are sent, not at the last token
+    g.counted = True
+    quota["in_flight"] += 1
+    quota["served"] += 1
+    quota["peak"] = max(quota["peak"], quota["in_flight"])
+    return None
+
+
+@app.teardown_request
+async def leave_quota(error=None):
+    if g.pop("counted", False):
+        quota["in_flight"] -= 1
+
+
+@app.route("/mock/stats")
+async def mock_stats():
+    return jsonify(dict(quota, fault=FAULT["mode"]))
+
+
+@app.route("/mock/fault", methods=["POST"])
+async def set_fault():
+    mode = (await request.get_json())["mode"]
+    if mode not in ("ok", "hang", "error"):
+        return jsonify({"error": f"unknown mode {mode}"}), 400
+    FAULT["mode"] = mode
+    return jsonify(FAULT)
+
+
+@app.route("/api/v1/chat/completions", methods=["POST"])
+async def chat_completions():
+    payload = await request.get_json()
+    parts = payload["messages"][0]["content"]
+    images = sum(1 for part in parts if part.get("type") == "image_url")
+    latency, content, usage = plan_response(images)
+    if content is None:
+        return await injected_error(latency)
+
+    if payload.get("stream"):
+        return stream_completion(content, latency), 200, {"Content-Type": "text/event-stream"}
+
+    await asyncio.sleep(latency)
+    return jsonify({
+        "id": "mock",
+        "model": payload.get("model"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": usage
+    })
+
+
+@app.route("/v1/messages", methods=["POST"])
+async def anthropic_messages():
+    payload = await request.get_json()
+    parts = payload["messages"][0]["content"]
+    images = sum(1 for part in parts if part.get("type") == "image")
+    latency, content, usage = plan_response(images)
+    if content is None:
+        return await injected_error(latency)
+
+    await asyncio.sleep(latency)
+    return jsonify({
+        "id": "mock",
+        "type": "message",
+        "role": "assistant",
+        "model": payload.get("model"),
+        "content": [{"type": "text", "text": content}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": usage["prompt_tokens"], "output_tokens": usage["completion_tokens"]}
+    })
+
+
+@app.route("/v1beta/models/<path:model_action>", methods=["POST"])
+async def gemini_generate_content(model_action):
+    payload = await request.get_json()
+    parts = payload["contents"][0]["parts"]
+    images = sum(1 for part in parts if "inline_data" in part)
+    latency, content, usage = plan_response(images)
+    if content is None:
+        return await injected_error(latency)
+
+    await asyncio.sleep(latency)
+    return jsonify({
+        "candidates": [
+            {"content": {"role": "model", "parts": [{"text": content}]}, "finishReason": "STOP"}
+        ],
+        "usageMetadata": {
+            "promptTokenCount": usage["prompt_tokens"],
+            "candidatesTokenCount": usage["completion_tokens"],
+            "totalTokenCount": usage["total_tokens"],
+        }
+    })
+
+
+# ---------------------- Run ------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenRouter chat completions server")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=LATENCY_SECONDS, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=JITTER_SECONDS, help="+/- seconds of uniform jitter")
+    parser.add_argument("--distribution", choices=["uniform", "lognormal"], default=LATENCY_DISTRIBUTION,
+                        help="latency distribution around --latency")
+    parser.add_argument("--sigma", type=float, default=LATENCY_SIGMA, help="log-space spread for --distribution lognormal")
+    parser.add_argument("--formats", type=parse_formats, default=RESPONSE_FORMATS,
+                        help="answer formats with weights, e.g. json=0.7,fenced=0.1,prose=0.1,lines=0.1")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible latencies, errors and formats")
+    parser.add_argument("--per-image", type=float, default=PER_IMAGE_SECONDS, help="extra seconds per additional image")
+    parser.add_argument("--bad-batch-rate", type=float, default=BAD_BATCH_RATE, help="fraction of broken multi-image answers")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="fraction of requests answered with 503")
+    parser.add_argument("--slow-rate", type=float, default=SLOW_RATE, help="fraction of requests that take --slow-seconds")
+    parser.add_argument("--slow-seconds", type=float, default=SLOW_SECONDS)
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY,
+                        help="concurrency quota: requests beyond it get a 429 (0 = none)")
+    parser.add_argument("--quota-retry-after", type=int, default=QUOTA_RETRY_AFTER, help="Retry-After of quota 429s")
+    args = parser.parse_args()
+
+    LATENCY_SECONDS = args.latency
+    JITTER_SECONDS = args.jitter
+    LATENCY_DISTRIBUTION = args.distribution
+    LATENCY_SIGMA = args.sigma
+    RESPONSE_FORMATS = args.formats
+    PER_IMAGE_SECONDS = args.per_image
+    BAD_BATCH_RATE = args.bad_batch_rate
+    ERROR_RATE = args.error_rate
+    SLOW_RATE = args.slow_rate
+    SLOW_SECONDS = args.slow_seconds
+    MAX_CONCURRENCY = args.max_concurrency
+    QUOTA_RETRY_AFTER = args.quota_retry_after
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # A deep accept backlog so hundreds of simultaneous connects are not dropped and retried
+    config = Config()
+    config.bind = [f"127.0.0.1:{args.port}"]
+    config.backlog = 2048
+    asyncio.run(serve(app, config))
@@ -0,0 +1,441 @@
+import base64
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+from admission import Overloaded
+from circuit_breaker import CircuitOpen, get_breaker
+from http_sessions import get_session
+
+
+# ---------------------- Backend defaults ------------------------
+# name -> adapter kind, endpoint, key variable, model, HTTP session.
+# Every value can be overridden with <NAME>_API_URL / <NAME>_API_KEY / <NAME>_MODEL,
+# which is also how the router is pointed at local stub servers.
+BACKEND_DEFAULTS = {
+    "qwen": {
+        "kind": "openai",
+        "url": "https://openrouter.ai/api/v1/chat/completions",
+        "key_env": "QWEN_API_KEY",
+        "model": "qwen/qwen3-vl-235b-a22b-instruct",
+        "session": "openrouter",
+    },
+    "llama": {
+        "kind": "openai",
+        "url": "https://openrouter.ai/api/v1/chat/completions",
+        "key_env": "OPENROUTER_API_KEY",
+        # The 3.3 70B model in llama response/test.py is text-only; this is the vision variant
+        "model": "meta-llama/llama-3.2-90b-vision-instruct",
+        "session": "openrouter",
+    },
+    "grok": {
+        "kind": "openai",
+        "url": "https://api.x.ai/v1/chat/completions",
+        "key_env": "GROK_API_KEY",
+        "model": "grok-2-vision-1212",
+        "session": "xai",
+    },
+    "claude": {
+        "kind": "anthropic",
+        "url": "https://api.anthropic.com/v1/messages",
+        "key_env": "CLAUDE_API_KEY",
+        "model": "claude-3-5-haiku-20241022",
+        "session": "anthropic",
+    },
+    "gemini": {
+        "kind": "gemini",
+        "url": "https://generativelanguage.googleapis.com/v1beta",
+        "key_env": "GEMINI_API_KEY",
+        "model": "gemini-2.0-flash-001",
+        "session": "gemini",
+    },
+}
+
+# Samples older than this no longer count towards a backend's latency and error rate
+STATS_WINDOW_SECONDS = 60
+# A backend whose recent error rate reaches this (over at least MIN_SAMPLES calls), or whose
+# last CONSECUTIVE_FAILURES calls all failed, is unhealthy
+MAX_ERROR_RATE = 0.5
+MIN_SAMPLES = 5
+CONSECUTIVE_FAILURES = 3
+
+
+class BackendError(Exception):
+    """A backend call failed (transport error, non-200 status or unexpected body); status: the HTTP status, if any"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------------------- Adapters ------------------------
+class ModelBackend:
+    """
+    One vision model behind one HTTP API
+    analyze(jpeg_bytes, prompt) returns the model's text or raises BackendError
+    """
+
+    kind = None
+
+    def __init__(self, name, url, api_key, model, session="openrouter", timeout=60):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.session = session
+        self.timeout = timeout
+
+    def analyze(self, compressed_image, prompt, timeout=None):
+        """timeout: overrides self.timeout, e.g. the backend breaker's adaptive (connect, read) pair"""
+        url, headers, payload = self.build_request(base64.b64encode(compressed_image).decode("utf-8"), prompt)
+        try:
+            # No HTTP-level retries: the router fails over to another backend instead
+            response = get_session(self.session, retry_total=0).post(
+                url, json=payload, headers=headers, timeout=timeout or self.timeout
+            )
+        except Exception as e:
+            raise BackendError(f"{self.name}: {e}") from e
+        if response.status_code != 200:
+            raise BackendError(f"{self.name}: API Error {response.status_code} - {response.text[:200]}",
+                               status=response.status_code)
+        try:
+            return self.extract_text(response.json())
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            raise BackendError(f"{self.name}: unexpected response body") from e
+
+    def build_request(self, encoded_image, prompt):
+        raise NotImplementedError
+
+    def extract_text(self, result):
+        raise NotImplementedError
+
+
+class OpenAIChatBackend(ModelBackend):
+    """OpenAI-style chat completions: OpenRouter (Qwen, Llama) and xAI (Grok)"""
+
+    kind = "openai"
+
+    def build_request(self, encoded_image, prompt):
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}},
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ],
+            "max_tokens": 1024,
+            "temperature": 0.3,
+        }
+        return self.url, headers, payload
+
+    def extract_text(self, result):
+        choice = result['choices'][0]
+        if choice.get('finish_reason') == "length":
+            # Cut off at max_tokens: another backend may give a whole answer
+            raise BackendError(f"{self.name}: answer cut off at max_tokens")
+        return choice['message']['content']
+
+
+class AnthropicBackend(ModelBackend):
+    """Anthropic Messages API (Claude)"""
+
+    kind = "anthropic"
+
+    def build_request(self, encoded_image, prompt):
+        headers = {
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json",
+        }
+        payload = {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": encoded_image}},
+                        {"type": "text", "text": prompt},
+                    ],
+                }
+            ],
+        }
+        return self.url, headers, payload
+
+    def extract_text(self, result):
+        return result['content'][0]['text']
+
+
+class GeminiBackend(ModelBackend):
+    """Gemini generateContent over REST (no google-generativeai SDK needed)"""
+
+    kind = "gemini"
+
+    def build_request(self, encoded_image, prompt):
+        url = f"{self.url.rstrip('/')}/models/{self.model}:generateContent"
+        headers = {"x-goog-api-key": self.api_key or "", "Content-Type": "application/json"}
+        payload = {
+            "contents": [
+                {
+                    "parts": [
+                        {"inline_data": {"mime_type": "image/jpeg", "data": encoded_image}},
+                        {"text": prompt},
+                    ]
+                }
+            ],
+            "generationConfig": {"maxOutputTokens": 1024, "temperature": 0.3},
+        }
+        return url, headers, payload
+
+    def extract_text(self, result):
+        return result['candidates'][0]['content']['parts'][0]['text']
+
+
+ADAPTERS = {cls.kind: cls for cls in (OpenAIChatBackend, AnthropicBackend, GeminiBackend)}
+
+
+def build_backend(name):
+    """
+    Adapter for a backend in BACKEND_DEFAULTS, with environment overrides applied
+    Returns: ModelBackend
+    """
+    defaults = BACKEND_DEFAULTS[name]
+    prefix = name.upper()
+    return ADAPTERS[defaults["kind"]](
+        name,
+        url=os.getenv(f"{prefix}_API_URL", defaults["url"]),
+        api_key=os.getenv(f"{prefix}_API_KEY", os.getenv(defaults["key_env"])),
+        model=os.getenv(f"{prefix}_MODEL", defaults["model"]),
+        session=defaults["session"],
+    )
+
+
+# ---------------------- Rolling stats ------------------------
+class BackendStats:
+    """
+    Latency and outcome of a backend's calls over the last STATS_WINDOW_SECONDS
+    """
+
+    def __init__(self, window_seconds=STATS_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        # Each sample: (time, seconds, ok)
+        self._samples = deque()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return list(self._samples)
+
+    def snapshot(self):
+        """
+        Returns: dict with calls, error_rate, p50/p95 seconds of successful calls, healthy
+        """
+        samples = self._recent()
+        latencies = sorted(seconds for _, seconds, ok in samples if ok)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        error_rate = errors / len(samples) if samples else 0.0
+        # An outage shows up here long before it moves a busy backend's error rate
+        failing = len(samples) >= CONSECUTIVE_FAILURES and not any(
+            ok for _, _, ok in samples[-CONSECUTIVE_FAILURES:]
+        )
+
+        def pct(fraction):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] if latencies else None
+
+        return {
+            "calls": len(samples),
+            "errors": errors,
+            "error_rate": error_rate,
+            "p50_s": pct(0.5),
+            "p95_s": pct(0.95),
+            "healthy": not failing and (len(samples) < MIN_SAMPLES or error_rate < MAX_ERROR_RATE),
+        }
+
+
+# ---------------------- Router ------------------------
+class RouterError(Exception):
+    """Every backend failed for a request"""
+
+
+class ModelRouter:
+    """
+    Sends each analysis to the fastest healthy backend (lowest rolling p50;
+    backends without samples yet are tried first so they get measured).
+
+    If the answer is not back after hedge_after seconds, the same request also
+    goes to the next backend and whichever answers first wins. hedge_after=None
+    uses the primary's rolling p95 (or default_hedge_after until it has samples);
+    hedge_after=0 disables hedging. A failed call fails over to the next backend
+    straight away; unhealthy backends are only used once healthy ones have failed.
+    A backend whose circuit breaker (circuit_breaker.get_breaker) is open fails at once,
+    without a request; while closed, the breaker sets its read timeout. When every backend
+    was refused by its breaker, the caller gets the CircuitOpen.
+
+    slot: context manager factory held around every backend call, hedges included
+    (e.g. AdmissionController.slot); calls run in the caller's context, so its traffic
+    class and trace apply. A call turned away by it (Overloaded) is not failed over:
+    the other backends share the same limit, so the caller gets the Overloaded.
+    """
+
+    def __init__(self, backends, hedge_after=None, default_hedge_after=10.0, workers=32, slot=nullcontext):
+        self.backends = list(backends)
+        self.hedge_after = hedge_after
+        self.default_hedge_after = default_hedge_after
+        self.slot = slot
+        self.stats = {backend.name: BackendStats() for backend in self.backends}
+        # Losing hedges finish in the background (their latency is still recorded)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="router")
+        self._counters_lock = threading.Lock()
+        self.counters = {"requests": 0, "hedges": 0, "hedge_wins": 0, "failovers": 0, "failures": 0}
+
+    def _count(self, name):
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def ranked(self):
+        """
+        Returns: backends in the order they would be tried
+        """
+        snapshots = {backend.name: self.stats[backend.name].snapshot() for backend in self.backends}
+
+        def key(backend):
+            snapshot = snapshots[backend.name]
+            p50 = snapshot["p50_s"] if snapshot["p50_s"] is not None else 0.0
+            return (not snapshot["healthy"] or get_breaker(backend.name).state == "open", p50)
+
+        return sorted(self.backends, key=key)
+
+    def _hedge_delay(self, backend):
+        if self.hedge_after is not None:
+            return self.hedge_after or None
+        snapshot = self.stats[backend.name].snapshot()
+        return snapshot["p95_s"] if snapshot["p95_s"] is not None else self.default_hedge_after
+
+    def _call(self, backend, compressed_image, prompt):
+        with get_breaker(backend.name).attempt() as attempt, self.slot():
+            attempt.start()
+            start = time.perf_counter()
+            try:
+                text = backend.analyze(compressed_image, prompt, timeout=attempt.timeout)
+            except BackendError as e:
+                if e.status is not None and e.status < 500:
+                    # A 4xx is about the request, not the backend's health (as upstream_verdict in final.py)
+                    attempt.skip()
+                else:
+                    self.stats[backend.name].record(time.perf_counter() - start, False)
+                raise
+            except Exception:
+                self.stats[backend.name].record(time.perf_counter() - start, False)
+                raise
+        self.stats[backend.name].record(time.perf_counter() - start, True)
+        return text
+
+    def analyze(self, compressed_image, prompt):
+        """
+        Returns: (response text, name of the backend that answered)
+        Raises: RouterError when every backend failed, Overloaded when the slot turned the call away,
+        CircuitOpen when every backend's breaker is open
+        """
+        self._count("requests")
+        order = self.ranked()
+        if not order:
+            raise RouterError("no model backends configured")
+
+        in_flight = {}
+        errors = []
+        shed = None
+        refused = None
+        remaining = iter(order)
+
+        def launch():
+            backend = next(remaining, None)
+            if backend is None:
+                return False
+            context = contextvars.copy_context()
+            in_flight[self._pool.submit(context.run, self._call, backend, compressed_image, prompt)] = backend
+            return True
+
+        launch()
+        primary = order[0]
+        delay = self._hedge_delay(primary) if len(order) > 1 else None
+        hedge_at = time.monotonic() + delay if delay else None
+
+        while in_flight:
+            timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Primary is slower than its usual p95: race it against the next backend
+                hedge_at = None
+                if launch():
+                    self._count("hedges")
+                continue
+
+            for future in done:
+                backend = in_flight.pop(future)
+                try:
+                    text = future.result()
+                except Overloaded as e:
+                    # Every backend is behind the same slot: wait for the calls still out, if any
+                    shed = e
+                    hedge_at = None
+                    continue
+                except CircuitOpen as e:
+                    # Not a failure of this request: try the next backend, which has its own breaker
+                    refused = e
+                    hedge_at = None
+                    launch()
+                    continue
+                except Exception as e:
+                    errors.append(str(e))
+                    # Fail over at once, even while a slow attempt is still running
+                    hedge_at = None
+                    launch()
+                    continue
+                if backend is not primary:
+                    self._count("hedge_wins" if len(errors) == 0 else "failovers")
+                return text, backend.name
+
+        if not errors:
+            raise shed or refused
+        self._count("failures")
+        raise RouterError("; ".join(errors))
+
+    def summary(self):
+        """
+        Returns: dict with counters and per-backend rolling stats, in routing order
+        """
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return {
+            "counters": counters,
+            "backends": {
+                backend.name: dict(self.stats[backend.name].snapshot(), model=backend.model,
+                                   breaker=get_breaker(backend.name).state)
+                for backend in self.ranked()
+            },
+        }
+
+
+def build_router(names, hedge_after=None, slot=nullcontext):
+    """
+    Router over the named backends, e.g. build_router(["qwen", "claude", "gemini"])
+    slot: see ModelRouter
+    Returns: ModelRouter
+    """
+    return ModelRouter([build_backend(name) for name in names], hedge_after=hedge_after, slot=slot)
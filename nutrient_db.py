@@ -0,0 +1,248 @@
+import csv
+import os
+import re
+import sqlite3
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+
+from nutrition_facts import NUTRIENTS, NutrientRange, NutritionFacts
+from nutrition_parser import NUTRITION_UNITS
+
+
+# ---------------------- Settings ------------------------
+SOURCE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv")
+
+# Minimum trigram similarity (Dice coefficient) for a dish name to count as a table food
+MIN_SCORE = 0.6
+
+# Reference values are shown as a range of +/- this fraction, like the model's estimates
+REFERENCE_SPREAD = 0.1
+
+# A model value is implausible when its range misses [reference / F, reference * F]
+PLAUSIBLE_FACTOR = 2.5
+
+# Words that describe the serving rather than the food
+_FILLER = {"a", "an", "the", "of", "fresh", "some", "bowl", "plate", "glass", "cup", "slice", "slices",
+           "sliced", "piece", "pieces", "scoop", "scoops", "cone", "whole", "ripe", "homemade", "serving",
+           "portion", "single", "small", "medium", "large", "few", "one", "two", "three"}
+
+_GRAMS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:g|grams?)\b", re.I)
+
+
+def normalize_name(name):
+    """
+    Returns: lowercase ASCII name with punctuation and serving words removed ("A bowl of Fresh Cherries!" -> "cherries")
+    """
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    words = [word for word in re.split(r"[^a-z0-9]+", name) if word and word not in _FILLER]
+    return " ".join(words)
+
+
+@lru_cache(maxsize=4096)
+def trigrams(name):
+    padded = f"  {name} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(a, b):
+    """
+    Returns: Dice coefficient of the trigram sets of a and b (1.0 = same trigrams)
+    """
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    return 2.0 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def covers(query, name):
+    """
+    True when every word of query is (nearly) a word of name, so that a dish with extra
+    components ("chicken salad" vs "chicken") is not taken for the plain food
+    """
+    words = name.split()
+    return all(any(word == other or similarity(word, other) >= 0.5 for other in words) for word in query.split())
+
+
+# ---------------------- Foods ------------------------
+@dataclass(frozen=True, slots=True)
+class Food:
+    """One row of the reference table; nutrients per 100 g in NUTRITION_UNITS"""
+
+    name: str
+    per_100g: tuple
+    portion_g: float
+    portion: str
+
+    def facts(self, grams=None):
+        """
+        Reference nutrition for grams of this food (default: one typical portion)
+        Returns: NutritionFacts with +/- REFERENCE_SPREAD ranges
+        """
+        scale = (grams or self.portion_g) / 100.0
+        values = {}
+        for key, per_100g in zip(NUTRIENTS, self.per_100g):
+            amount = per_100g * scale
+            low, high = amount * (1 - REFERENCE_SPREAD), amount * (1 + REFERENCE_SPREAD)
+            # Whole kcal and grams, except below 10 where a decimal still matters
+            if high >= 10:
+                low, high = round(low), round(high)
+            else:
+                low, high = round(low, 1), round(high, 1)
+            values[key] = NutrientRange(low, high, NUTRITION_UNITS[key])
+        return NutritionFacts(**values)
+
+
+# ---------------------- Database ------------------------
+class NutrientDB:
+    """
+    Local food-composition table for filling in and sanity-checking model answers.
+
+    The bundled CSV (data/foods.csv) is compiled once into an SQLite file at path
+    and rebuilt when the CSV changes. At startup the rows are read into memory
+    along with a trigram index of every name and alias. A lookup only scores the
+    names that share a trigram with the query, which takes microseconds.
+    """
+
+    def __init__(self, path, source=SOURCE_CSV, min_score=MIN_SCORE):
+        self.path = path
+        self.source = source
+        self.min_score = min_score
+        self.counters = {"lookups": 0, "hits": 0}
+
+        self._build_if_stale()
+        self.foods = []
+        # normalized name -> food index, for exact hits without scoring
+        self._names = {}
+        # trigram -> names containing it; name -> its trigram count
+        self._index = {}
+        self._sizes = {}
+        self._load()
+
+    def _build_if_stale(self):
+        source_mtime = os.path.getmtime(self.source)
+        if os.path.exists(self.path) and os.path.getmtime(self.path) >= source_mtime:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        db = sqlite3.connect(tmp_path)
+        db.execute(
+            "CREATE TABLE foods (id INTEGER PRIMARY KEY, name TEXT NOT NULL, portion_g REAL NOT NULL,"
+            " portion TEXT NOT NULL, " + ", ".join(f"{key} REAL NOT NULL" for key in NUTRIENTS) + ")"
+        )
+        db.execute("CREATE TABLE names (name TEXT PRIMARY KEY, food_id INTEGER NOT NULL)")
+        with open(self.source, newline="", encoding="utf-8") as f:
+            for food_id, row in enumerate(csv.DictReader(f)):
+                db.execute(
+                    "INSERT INTO foods VALUES (?, ?, ?, ?, " + ", ".join("?" for _ in NUTRIENTS) + ")",
+                    [food_id, row["name"], float(row["portion_g"]), row["portion"]]
+                    + [float(row["kcal" if key == "calories" else key]) for key in NUTRIENTS],
+                )
+                for name in [row["name"]] + [alias for alias in row["aliases"].split("|") if alias]:
+                    db.execute("INSERT OR IGNORE INTO names VALUES (?, ?)", (normalize_name(name), food_id))
+        db.commit()
+        db.close()
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            columns = ", ".join(NUTRIENTS)
+            rows = db.execute(f"SELECT id, name, portion_g, portion, {columns} FROM foods ORDER BY id").fetchall()
+            positions = {}
+            for row in rows:
+                positions[row[0]] = len(self.foods)
+                self.foods.append(Food(row[1], tuple(row[4:]), row[2], row[3]))
+            for name, food_id in db.execute("SELECT name, food_id FROM names"):
+                index = positions[food_id]
+                self._names[name] = index
+                grams = trigrams(name)
+                self._sizes[name] = len(grams)
+                for gram in grams:
+                    self._index.setdefault(gram, []).append(name)
+        finally:
+            db.close()
+
+    def __len__(self):
+        return len(self.foods)
+
+    def lookup(self, dish_name):
+        """
+        Fuzzy match of a dish name against the table's names and aliases
+        Returns: (Food, score) for the best match scoring at least min_score, or None
+        """
+        self.counters["lookups"] += 1
+        query = normalize_name(dish_name or "")
+        if not query:
+            return None
+
+        index = self._names.get(query)
+        if index is not None:
+            self.counters["hits"] += 1
+            return self.foods[index], 1.0
+
+        grams = trigrams(query)
+        shared = {}
+        for gram in grams:
+            for name in self._index.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+
+        candidates = []
+        for name, count in shared.items():
+            # Dice coefficient of the two trigram sets
+            score = 2.0 * count / (len(grams) + self._sizes[name])
+            if score >= self.min_score:
+                candidates.append((score, name))
+
+        for score, name in sorted(candidates, reverse=True):
+            if covers(query, name):
+                self.counters["hits"] += 1
+                return self.foods[self._names[name]], score
+        return None
+
+    def reference(self, dish_name, facts=None, portion_text=None, grams=None):
+        """
+        Compare (or supply) a meal's nutrition with the table's values for its dish name
+        facts: the model's NutritionFacts, or None when it gave none
+        grams: portion weight if known, else read from portion_text ("about 200 g"), else the food's typical portion
+        Returns: (NutritionFacts with missing nutrients filled in, reference dict) or (facts, None) without a match
+        """
+        match = self.lookup(dish_name)
+        if match is None:
+            return facts, None
+        food, score = match
+
+        if grams is None and portion_text:
+            found = _GRAMS.search(portion_text)
+            grams = float(found.group(1)) if found else None
+        reference = food.facts(grams)
+
+        filled = []
+        implausible = []
+        values = {}
+        for key in NUTRIENTS:
+            model_value = getattr(facts, key) if facts is not None else None
+            expected = getattr(reference, key)
+            if model_value is None:
+                values[key] = expected
+                filled.append(key)
+                continue
+            values[key] = model_value
+            center = (expected.min + expected.max) / 2
+            # Near-zero nutrients (fat in fruit) are left alone: any small number is plausible
+            if center >= 2 and (model_value.max < center / PLAUSIBLE_FACTOR or model_value.min > center * PLAUSIBLE_FACTOR):
+                implausible.append(key)
+
+        text = facts.text if facts is not None else None
+        return NutritionFacts(**values, text=text), {
+            "food": food.name,
+            "score": round(score, 2),
+            "portion_g": grams or food.portion_g,
+            "portion": food.portion if grams is None else None,
+            "filled": filled,
+            "implausible": implausible,
+        }
+
+    def stats(self):
+        return dict(self.counters, foods=len(self.foods), names=len(self._names))
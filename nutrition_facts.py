@@ -0,0 +1,198 @@
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+from nutrition_parser import NUTRITION_UNITS
+
+
+# ---------------------- Layout ------------------------
+# Column order of every array below (same order as NUTRITION_FIELDS in final.py)
+NUTRIENTS = tuple(NUTRITION_UNITS)
+
+# One meal per record: min and max of each nutrient, NaN where the model gave no number.
+# Units are fixed per column (NUTRITION_UNITS); other units are converted at parse time.
+NUTRITION_DTYPE = np.dtype([("min", np.float32, (len(NUTRIENTS),)), ("max", np.float32, (len(NUTRIENTS),))])
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_RANGE = re.compile(_NUMBER + r"(?:\s*(?:-|–|—|to)\s*" + _NUMBER + r")?\s*([a-zA-Zµ]+)?")
+
+# Unit written by the model -> (unit stored, factor)
+_CONVERSIONS = {
+    "kcal": ("kcal", 1.0),
+    "cal": ("kcal", 1.0),
+    "calories": ("kcal", 1.0),
+    "kj": ("kcal", 1 / 4.184),
+    "g": ("g", 1.0),
+    "grams": ("g", 1.0),
+    "mg": ("g", 0.001),
+    "µg": ("g", 0.000001),
+    "mcg": ("g", 0.000001),
+}
+
+
+def _number(text):
+    # "1,200" is a thousands separator, "2,5" a decimal comma
+    whole, comma, fraction = text.rpartition(",")
+    if not comma:
+        return float(text)
+    return float(whole.replace(",", "") + fraction) if len(fraction) == 3 else float(whole + "." + fraction)
+
+
+# ---------------------- Values ------------------------
+@dataclass(frozen=True, slots=True)
+class NutrientRange:
+    """An estimate such as "150-180 kcal"; min == max for a single number"""
+
+    min: float
+    max: float
+    unit: str
+
+    @classmethod
+    def parse(cls, text, unit):
+        """
+        text: model value such as "150-180 kcal", "~12 g", "1,200 mg"; unit: the nutrient's unit
+        Returns: NutrientRange in unit, or None when text has no number (or a unit that does not convert)
+        """
+        match = _RANGE.search(text)
+        if match is None:
+            return None
+        low = _number(match.group(1))
+        high = _number(match.group(2)) if match.group(2) else low
+
+        factor = 1.0
+        written = (match.group(3) or "").lower()
+        if written in _CONVERSIONS:
+            stored, factor = _CONVERSIONS[written]
+            if stored != unit:
+                return None
+        if low > high:
+            low, high = high, low
+        return cls(low * factor, high * factor, unit)
+
+    def __str__(self):
+        def number(value):
+            return f"{value:.1f}".rstrip("0").rstrip(".") if value < 10 else f"{value:.0f}"
+
+        if self.min == self.max:
+            return f"{number(self.min)} {self.unit}"
+        return f"{number(self.min)}-{number(self.max)} {self.unit}"
+
+
+@dataclass(slots=True)
+class NutritionFacts:
+    """
+    Typed nutrition of one meal, parsed once from the model's strings.
+    A nutrient is None when the model left it out or gave no number; its
+    original text is then kept in `text` for display.
+    """
+
+    calories: NutrientRange = None
+    carbohydrates: NutrientRange = None
+    sugars: NutrientRange = None
+    fiber: NutrientRange = None
+    protein: NutrientRange = None
+    fat: NutrientRange = None
+    text: dict = None
+
+    @classmethod
+    def from_strings(cls, nutrition):
+        """
+        nutrition: dict nutrient -> model string (see nutrition_parser.normalize_answer)
+        Returns: NutritionFacts
+        """
+        values = {}
+        unparsed = {}
+        for key, value in (nutrition or {}).items():
+            if key not in NUTRITION_UNITS:
+                continue
+            parsed = NutrientRange.parse(value, NUTRITION_UNITS[key])
+            if parsed is None:
+                unparsed[key] = value
+            else:
+                values[key] = parsed
+        return cls(**values, text=unparsed or None)
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Inverse of to_dict (the form stored in results, caches and JSONL)
+        Returns: NutritionFacts
+        """
+        values = {}
+        for key, value in (data or {}).items():
+            if key in NUTRITION_UNITS and isinstance(value, dict):
+                values[key] = NutrientRange(value["min"], value["max"], value["unit"])
+        unparsed = {key: value for key, value in (data or {}).items() if isinstance(value, str)}
+        return cls(**values, text=unparsed or None)
+
+    def to_dict(self):
+        """
+        Returns: JSON-safe dict nutrient -> {"min", "max", "unit"} (or the model's text when it had no number)
+        """
+        data = dict(self.text or {})
+        for key in NUTRIENTS:
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = {"min": value.min, "max": value.max, "unit": value.unit}
+        return data
+
+    def display(self, labels):
+        """
+        labels: list of (nutrient, label), e.g. NUTRITION_FIELDS
+        Returns: list of "Label: value" strings, "N/A" for missing nutrients
+        """
+        lines = []
+        for key, label in labels:
+            value = getattr(self, key)
+            if value is None:
+                value = (self.text or {}).get(key, "N/A")
+            lines.append(f"{label}: {value}")
+        return lines
+
+
+# ---------------------- Aggregation ------------------------
+def to_array(meals):
+    """
+    meals: iterable of NutritionFacts, or of stored dicts (see NutritionFacts.to_dict)
+    Returns: NUTRITION_DTYPE array, one record per meal
+    """
+    meals = list(meals)
+    array = np.empty(len(meals), dtype=NUTRITION_DTYPE)
+    array["min"] = array["max"] = np.nan
+    for index, meal in enumerate(meals):
+        if not isinstance(meal, NutritionFacts):
+            meal = NutritionFacts.from_dict(meal)
+        for column, key in enumerate(NUTRIENTS):
+            value = getattr(meal, key)
+            if value is not None:
+                array["min"][index, column] = value.min
+                array["max"][index, column] = value.max
+    return array
+
+
+def totals(array):
+    """
+    Sum of every nutrient over the meals in array (missing values count as 0)
+    Returns: dict nutrient -> NutrientRange
+    """
+    low = np.nansum(array["min"], axis=0, dtype=np.float64)
+    high = np.nansum(array["max"], axis=0, dtype=np.float64)
+    return {
+        key: NutrientRange(float(low[column]), float(high[column]), NUTRITION_UNITS[key])
+        for column, key in enumerate(NUTRIENTS)
+    }
+
+
+def daily_totals(array, days):
+    """
+    Per-day sums
+    days: array of day numbers (e.g. ordinal dates), one per record in array
+    Returns: (sorted unique days, float64 arrays of shape (len(days), len(NUTRIENTS)) for min and max)
+    """
+    unique, index = np.unique(np.asarray(days), return_inverse=True)
+    low = np.zeros((len(unique), len(NUTRIENTS)))
+    high = np.zeros((len(unique), len(NUTRIENTS)))
+    np.add.at(low, index, np.nan_to_num(array["min"]))
+    np.add.at(high, index, np.nan_to_num(array["max"]))
+    return unique, low, high
@@ -0,0 +1,331 @@
+import json
+import re
+
+
+# ---------------------- Schema ------------------------
+# Nutrition keys (as in NUTRITION_PROMPT) and the unit a bare number is given
+NUTRITION_UNITS = {
+    "calories": "kcal",
+    "carbohydrates": "g",
+    "sugars": "g",
+    "fiber": "g",
+    "protein": "g",
+    "fat": "g",
+}
+
+# Other spellings models use for the same keys
+NUTRITION_ALIASES = {
+    "calorie": "calories",
+    "energy": "calories",
+    "kcal": "calories",
+    "carbohydrate": "carbohydrates",
+    "carbs": "carbohydrates",
+    "carb": "carbohydrates",
+    "sugar": "sugars",
+    "fibre": "fiber",
+    "fibers": "fiber",
+    "dietary_fiber": "fiber",
+    "proteins": "protein",
+    "fats": "fat",
+    "total_fat": "fat",
+}
+
+# Python literals some models write inside otherwise valid JSON
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+_FENCE = re.compile(r"```[a-zA-Z]*\s*(.*?)(?:```|$)", re.S)
+
+_NUTRITION_LINE = re.compile(
+    r"^[\s*•#>-]*\**\s*([a-z][a-z _]*?)\s*\**\s*[:=]\s*\**\s*(.+?)\s*\**\s*$", re.I
+)
+_SEPARATOR = re.compile(r"^[\s\-=_*#]*$")
+_RETAKE = re.compile(r"retake (?:the )?picture", re.I)
+
+_decoder = json.JSONDecoder()
+
+
+# ---------------------- JSON extraction ------------------------
+def extract_json(text, container=dict):
+    """
+    Find the JSON object (container=dict) or array (container=list) in a model answer
+    Tried cheapest first: the whole text, the first value inside a markdown fence or
+    after leading prose (trailing prose ignored), then one repair pass for trailing
+    commas, single quotes, Python literals and truncated closing brackets
+    Returns: (value, method) with method "json", "extracted" or "repaired"; (None, None) if nothing parses
+    """
+    opener = "{" if container is dict else "["
+    stripped = text.strip()
+    if stripped.startswith(opener):
+        try:
+            value = json.loads(stripped)
+            if isinstance(value, container):
+                return value, "json"
+        except ValueError:
+            pass
+
+    fenced = _FENCE.search(stripped)
+    candidate = fenced.group(1) if fenced and opener in fenced.group(1) else stripped
+    start = candidate.find(opener)
+    if start < 0:
+        return None, None
+
+    try:
+        value, _ = _decoder.raw_decode(candidate, start)
+        if isinstance(value, container):
+            return value, "extracted"
+    except ValueError:
+        pass
+
+    try:
+        value = json.loads(repair_json(candidate, start))
+        if isinstance(value, container):
+            return value, "repaired"
+    except ValueError:
+        pass
+    return None, None
+
+
+def repair_json(text, start=0):
+    """
+    One pass over the JSON value starting at text[start]: single-quoted strings become
+    double-quoted, True/False/None become JSON literals, commas before a closing
+    bracket are dropped, anything after the value's closing bracket is ignored, and a
+    value cut off mid-way (truncated answer) is closed, dropping an incomplete last member
+    Returns: the repaired JSON text (not guaranteed to parse)
+    """
+    out = []
+    closers = []
+    # Output length and open brackets after each completed member, for cutting back a truncated tail
+    cut_points = []
+    quote = None
+    escape = False
+    i = start
+    length = len(text)
+
+    while i < length:
+        char = text[i]
+        if quote:
+            if escape:
+                escape = False
+                out.append(char)
+            elif char == "\\":
+                escape = True
+                out.append(char)
+            elif char == quote:
+                quote = None
+                out.append('"')
+            elif char == '"':
+                # A double quote inside a single-quoted string
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            else:
+                out.append(char)
+        elif char in "\"'":
+            quote = char
+            out.append('"')
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            if closers:
+                closers.pop()
+            out.append(char)
+            if not closers:
+                return "".join(out)
+        elif char == ",":
+            _drop_trailing_comma(out)
+            cut_points.append((len(out), "".join(closers)))
+            out.append(char)
+        elif char.isalpha():
+            end = i
+            while end < length and (text[end].isalnum() or text[end] == "_"):
+                end += 1
+            word = text[i:end]
+            out.append(_LITERALS.get(word, word))
+            i = end
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    # Truncated: close what is open. If the last member is incomplete (a key with no
+    # value, a dangling colon), fall back to the last complete member instead.
+    if quote:
+        out.append('"')
+    closing = "".join(reversed(closers))
+    repaired = "".join(out).rstrip().rstrip(",") + closing
+    try:
+        json.loads(repaired)
+        return repaired
+    except ValueError:
+        pass
+    for position, open_closers in reversed(cut_points):
+        repaired = "".join(out[:position]) + "".join(reversed(open_closers))
+        try:
+            json.loads(repaired)
+            return repaired
+        except ValueError:
+            continue
+    return "".join(out) + closing
+
+
+def _drop_trailing_comma(out):
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index]
+
+
+# ---------------------- Line format ------------------------
+def parse_lines(text):
+    """
+    The line-oriented answer of the Gemini/Claude prompts:
+
+        Grilled Chicken Salad
+        A bowl of greens with sliced chicken ...
+        Calories: 350-400 kcal
+        Carbohydrates: 10-15 g
+        ...
+        Looks like ~350 kcal, one large bowl.
+
+    Lines before the nutrition block are the dish name and description, the lines after it the portion
+    Returns: answer dict (see normalize_answer) or None when fewer than three nutrition lines are found
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if line and not _SEPARATOR.match(line) and not line.startswith("```")]
+
+    nutrition = {}
+    first = last = None
+    for index, line in enumerate(lines):
+        match = _NUTRITION_LINE.match(line)
+        if not match:
+            continue
+        key = _nutrition_key(match.group(1))
+        if key is None or key in nutrition:
+            continue
+        nutrition[key] = match.group(2)
+        first = index if first is None else first
+        last = index
+
+    if len(nutrition) < 3:
+        if _RETAKE.search(text):
+            return {"error": "Please Retake Picture"}
+        return None
+
+    head = [_clean_line(line) for line in lines[:first]]
+    tail = [_clean_line(line) for line in lines[last + 1:]]
+    return normalize_answer({
+        "dish_name": head[0] if head else None,
+        "description": " ".join(head[1:]) or None,
+        "nutrition": nutrition,
+        "portion_estimate": " ".join(tail) or None,
+    })
+
+
+def _clean_line(line):
+    line = line.strip("*•#>- ").strip()
+    # "Dish: Pad Thai" / "**Description:** ..." labels
+    label, sep, rest = line.partition(":")
+    if sep and label.strip("* ").lower() in ("dish", "dish name", "name", "description", "portion", "portion estimate"):
+        line = rest.strip("* ").strip()
+    return line
+
+
+# ---------------------- Validation ------------------------
+def _nutrition_key(name):
+    if name in NUTRITION_UNITS:
+        return name
+    key = name.strip().lower().replace(" ", "_").replace("-", "_")
+    if key in NUTRITION_UNITS:
+        return key
+    return NUTRITION_ALIASES.get(key)
+
+
+def _nutrition_value(key, value):
+    unit = NUTRITION_UNITS[key]
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return f"{value:g} {unit}"
+    if isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(v, (int, float)) for v in value):
+        return f"{value[0]:g}-{value[1]:g} {unit}"
+    if isinstance(value, dict) and {"min", "max"} <= value.keys():
+        return _nutrition_value(key, [value["min"], value["max"]])
+    if isinstance(value, str):
+        return value.strip() or None
+    return None
+
+
+def normalize_answer(data):
+    """
+    Check a decoded answer against the NUTRITION_PROMPT schema and normalise it:
+    nutrition keys mapped to their canonical names (values as display strings,
+    bare numbers given their unit), nutrition keys written at the top level moved
+    under "nutrition", strings stripped
+    Returns: {"error": message} or dict with dish_name, description, nutrition
+    (dict or None), portion_estimate, portion_grams (number or None); None when
+    data does not fit the schema
+    """
+    if not isinstance(data, dict):
+        return None
+    if data.get("error"):
+        return {"error": str(data["error"])}
+
+    raw = data.get("nutrition")
+    if raw is None:
+        raw = {name: value for name, value in data.items() if _nutrition_key(name)}
+    if not isinstance(raw, dict):
+        return None
+
+    nutrition = {}
+    for name, value in raw.items():
+        key = _nutrition_key(name)
+        if key is not None and key not in nutrition:
+            value = _nutrition_value(key, value)
+            if value is not None:
+                nutrition[key] = value
+
+    dish_name = data.get("dish_name") or data.get("name") or data.get("dish")
+    if not isinstance(dish_name, str) or not dish_name.strip():
+        dish_name = None
+    if dish_name is None and not nutrition:
+        return None
+
+    def text(value):
+        return value.strip() or None if isinstance(value, str) else None
+
+    grams = data.get("portion_grams")
+    if isinstance(grams, str):
+        grams = re.match(r"\s*(\d+(?:\.\d+)?)", grams)
+        grams = float(grams.group(1)) if grams else None
+    if isinstance(grams, bool) or not isinstance(grams, (int, float)) or grams <= 0:
+        grams = None
+
+    return {
+        "dish_name": dish_name.strip() if dish_name else None,
+        "description": text(data.get("description")),
+        "nutrition": nutrition or None,
+        "portion_estimate": text(data.get("portion_estimate")),
+        "portion_grams": grams,
+    }
+
+
+def parse_nutrition(text):
+    """
+    Best-effort structured answer from raw model text: JSON (see extract_json)
+    first, then the line format (see parse_lines)
+    Returns: (answer dict, method) with method "json", "extracted", "repaired" or "lines"; (None, None) if neither fits
+    """
+    data, method = extract_json(text)
+    if data is not None:
+        answer = normalize_answer(data)
+        if answer is not None:
+            return answer, method
+
+    answer = parse_lines(text)
+    if answer is not None:
+        return answer, "lines"
+    return None, None
@@ -0,0 +1,250 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+from shared_store import pack, unpack
+
+
+# ---------------------- Perceptual hash ------------------------
+def dhash(image, hash_size=8):
+    """
+    Difference hash: compare neighbouring pixels of a tiny grayscale copy
+    Accepts a PIL image or raw image bytes
+    Returns: hash_size * hash_size bit integer
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(BytesIO(image))
+
+    # Let the JPEG decoder skip most of the work when the source is large
+    if image.format == "JPEG":
+        image.draft("L", (hash_size * 8, hash_size * 8))
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+# ---------------------- Multi-index hash table ------------------------
+class PerceptualIndex:
+    """
+    Near-duplicate lookup over 64-bit perceptual hashes.
+
+    Uses multi-index hashing: the hash is split into max_distance + 1 chunks and
+    each chunk gets its own exact-match table. By the pigeonhole principle any
+    hash within max_distance bits of the query matches it exactly on at least
+    one chunk, so only the few entries sharing a chunk are compared.
+
+    With a store (shared_store.py) hashes are appended to its "phashes" log instead of the
+    SQLite table, and lookups first read what other processes or hosts appended, at most
+    every sync_seconds.
+
+    Entries carry the version they were made under (model and prompt) and the time they
+    were added: entries of another version are not loaded, entries older than ttl_seconds
+    are not returned, and beyond max_entries the oldest are dropped, from memory, the
+    table and the store's log alike.
+    """
+
+    LOG = "phashes"
+    # Trim the table every this many adds
+    TRIM_EVERY = 1000
+
+    def __init__(self, path=None, max_distance=4, bits=64, store=None, sync_seconds=1.0, version="",
+                 ttl_seconds=None, max_entries=None):
+        self.path = None if store is not None else path
+        self.store = store
+        self.sync_seconds = sync_seconds
+        self.max_distance = max_distance
+        self.bits = bits
+        self.version = version
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # hash -> (value, time added), oldest first; chunk tables hold the hashes themselves
+        self._entries = OrderedDict()
+        self._chunks = self._chunk_layout(bits, max_distance + 1)
+        self._tables = [{} for _ in self._chunks]
+        self._db = None
+        self._adds = 0
+        # Position in the store's log, and when it was last read (or failed to be)
+        self._cursor = 0
+        self._synced = 0.0
+        self._sync_lock = threading.Lock()
+
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.reopen()
+        elif store is not None:
+            self.sync()
+
+    def reopen(self):
+        """
+        (Re)open the table and load the hashes other processes added since; server
+        workers call this after fork, as an SQLite connection must not cross one
+        """
+        if self.store is not None:
+            self.sync()
+        if not self.path:
+            return
+        with self._lock:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS phashes (hash INTEGER PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self._db.commit()
+            # INSERT OR REPLACE gives a rewritten hash a new rowid, so rowid order is write order
+            rows = self._db.execute(
+                "SELECT hash, value FROM (SELECT rowid, hash, value FROM phashes ORDER BY rowid DESC LIMIT ?)"
+                " ORDER BY rowid",
+                (self.max_entries or -1,),
+            ).fetchall()
+            for stored, text in rows:
+                hash_value = stored & ((1 << self.bits) - 1)
+                if hash_value not in self._entries:
+                    self._load(hash_value, json.loads(text))
+
+    def close(self):
+        """
+        Close the table; lookups keep using the hashes in memory, new ones are not persisted until reopen()
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, hash_value, value):
+        """
+        Remember value (a parsed analysis) under hash_value
+        """
+        added = time.time()
+        entry = [value, self.version, added]
+        with self._lock:
+            self._insert(hash_value, value, added)
+            if self._db is not None:
+                # SQLite integers are signed 64-bit
+                stored = hash_value - (1 << 64) if hash_value >= (1 << 63) else hash_value
+                self._db.execute(
+                    "INSERT OR REPLACE INTO phashes (hash, value) VALUES (?, ?)",
+                    (stored, json.dumps(entry)),
+                )
+                self._adds += 1
+                if self.max_entries and self._adds % self.TRIM_EVERY == 0:
+                    self._db.execute(
+                        "DELETE FROM phashes WHERE rowid <= (SELECT MAX(rowid) FROM phashes) - ?",
+                        (self.max_entries,),
+                    )
+                self._db.commit()
+        if self.store is not None:
+            try:
+                self.store.append(self.LOG, pack([hash_value] + entry), max_entries=self.max_entries,
+                                  ttl=self.ttl_seconds)
+            except Exception:
+                # Kept in this process; the others will analyze that photo themselves
+                pass
+
+    def sync(self):
+        """
+        Load the hashes other processes appended to the store since the last sync
+        """
+        # One thread reads the log; the others go on with what is already loaded
+        if self.store is None or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            try:
+                entries, cursor = self.store.read_log(self.LOG, self._cursor)
+            except Exception:
+                # Store unreachable: try again after sync_seconds, not on every lookup
+                return
+            finally:
+                self._synced = time.monotonic()
+            with self._lock:
+                for entry in entries:
+                    hash_value, *stored = unpack(entry)
+                    self._load(hash_value, stored)
+            self._cursor = cursor
+        finally:
+            self._sync_lock.release()
+
+    def lookup(self, hash_value, max_distance=None):
+        """
+        Find the closest stored hash within max_distance bits
+        Returns: (value, distance) or None
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        if self.store is not None and time.monotonic() - self._synced >= self.sync_seconds:
+            self.sync()
+
+        oldest = time.time() - self.ttl_seconds if self.ttl_seconds else 0.0
+        best = None
+        best_distance = max_distance + 1
+        with self._lock:
+            entry = self._entries.get(hash_value)
+            if entry is not None and entry[1] >= oldest:
+                return entry[0], 0
+
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                for candidate in table.get((hash_value >> shift) & mask, ()):
+                    distance = (candidate ^ hash_value).bit_count()
+                    if distance < best_distance and self._entries[candidate][1] >= oldest:
+                        best, best_distance = candidate, distance
+            if best is None:
+                return None
+            return self._entries[best][0], best_distance
+
+    def _load(self, hash_value, stored):
+        # stored: [value, version, time added] from the table or the log; entries written
+        # before versions were recorded, or under another version, are left out
+        if not isinstance(stored, list) or len(stored) != 3:
+            return
+        value, version, added = stored
+        if version != self.version or (self.ttl_seconds and added < time.time() - self.ttl_seconds):
+            return
+        self._insert(hash_value, value, added)
+
+    def _insert(self, hash_value, value, added):
+        if hash_value in self._entries:
+            self._entries[hash_value] = (value, added)
+            self._entries.move_to_end(hash_value)
+            return
+        self._entries[hash_value] = (value, added)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((hash_value >> shift) & mask, []).append(hash_value)
+        if self.max_entries and len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, hash_value):
+        del self._entries[hash_value]
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            key = (hash_value >> shift) & mask
+            bucket = table[key]
+            bucket.remove(hash_value)
+            if not bucket:
+                del table[key]
+
+    @staticmethod
+    def _chunk_layout(bits, count):
+        # Split bits into count nearly equal (shift, mask) pairs
+        layout = []
+        shift = 0
+        for i in range(count):
+            width = bits // count + (1 if i < bits % count else 0)
+            layout.append((shift, (1 << width) - 1))
+            shift += width
+        return layout
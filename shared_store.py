@@ -0,0 +1,356 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qs, urlparse
+
+
+# ---------------------- Serialization ------------------------
+# msgpack when installed (pip install msgpack), else JSON; values over COMPRESS_OVER bytes are
+# also zlib-compressed when that helps. A parsed analysis is mostly text: 614 bytes as JSON,
+# 566 as msgpack, 348 compressed. The first byte says which, so any value can be read back.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESS_OVER = 256
+
+
+def pack(value):
+    """
+    Returns: value (str, numbers, lists, dicts) as compact bytes
+    """
+    if msgpack is not None:
+        tag, body = b"M", msgpack.packb(value, use_bin_type=True)
+    else:
+        tag, body = b"J", json.dumps(value, separators=(",", ":")).encode("utf-8")
+    if len(body) > COMPRESS_OVER:
+        compressed = zlib.compress(body, 6)
+        if len(compressed) < len(body):
+            # Lower-case tag: compressed
+            return tag.lower() + compressed
+    return tag + body
+
+
+def unpack(data):
+    tag, body = data[:1], data[1:]
+    if tag.islower():
+        tag, body = tag.upper(), zlib.decompress(body)
+    if tag == b"M":
+        if msgpack is None:
+            raise ValueError("value was written with msgpack, which is not installed here")
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+# ---------------------- Interface ------------------------
+class SharedStore:
+    """
+    State the server processes of one deployment share, whatever the host they run on:
+
+      - values under a key, with an optional TTL (analysis results)
+      - append-only logs read from a cursor, bounded in length and age (perceptual hashes:
+        each process keeps the index in memory and catches up on what the others added)
+      - token buckets taken atomically (per-client rate limits)
+
+    Values are bytes (see pack/unpack). Implementations: SQLiteStore for the processes of a
+    single host, RedisStore for several hosts. open_store(url) picks one.
+    """
+
+    kind = None
+
+    def get(self, key):
+        """
+        Returns: the bytes stored under key, or None
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """ttl: seconds until the value expires (None: never)"""
+        raise NotImplementedError
+
+    def append(self, log, value, max_entries=None, ttl=None):
+        """
+        max_entries: keep only the newest entries of log; ttl: seconds an entry is kept for
+        (Redis: the whole log expires ttl seconds after its last append). None: no bound
+        """
+        raise NotImplementedError
+
+    def read_log(self, log, after=0):
+        """
+        Returns: (values appended to log after cursor `after` and still kept, in order; the new cursor)
+        """
+        raise NotImplementedError
+
+    def take(self, bucket, rate_per_second, burst, amount=1):
+        """
+        Take amount tokens from a bucket that fills at rate_per_second up to burst
+        (a new bucket starts full); nothing is taken when there are not enough
+        Returns: 0.0 when taken, else seconds until amount tokens would be available
+        """
+        raise NotImplementedError
+
+    def reopen(self):
+        """Connect (again) after a fork; connections must not cross one"""
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+# ---------------------- SQLite (one host) ------------------------
+class SQLiteStore(SharedStore):
+    """
+    SharedStore in one SQLite file in WAL mode: the worker processes of one host read
+    it concurrently while one of them writes. Expired values are removed as they are
+    read and in a sweep every SWEEP_EVERY writes, which also drops the oldest values
+    once they take more than max_mb, expired log entries, and log entries beyond
+    the max_entries of their log's last append.
+    """
+
+    kind = "sqlite"
+    SWEEP_EVERY = 1000
+    # Buckets untouched this long are full again, so their rows can go
+    BUCKET_IDLE_SECONDS = 24 * 3600
+
+    def __init__(self, path, max_mb=None):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        # log name -> max_entries of its last append, for the sweep
+        self._log_limits = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.reopen()
+
+    def reopen(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            # Autocommit; take() opens its own transaction
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " name TEXT NOT NULL, value BLOB NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS logs_name ON logs (name, id)")
+            if "expires" not in [row[1] for row in self._db.execute("PRAGMA table_info(logs)")]:
+                # Files written before log entries could expire
+                self._db.execute("ALTER TABLE logs ADD COLUMN expires REAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < time.time():
+                self._db.execute("DELETE FROM kv WHERE key = ? AND expires = ?", (key, expires))
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+            self._wrote()
+
+    def append(self, log, value, max_entries=None, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._db.execute("INSERT INTO logs (name, value, expires) VALUES (?, ?, ?)", (log, value, expires))
+            self._log_limits[log] = max_entries
+            self._wrote()
+
+    def read_log(self, log, after=0):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, value FROM logs WHERE name = ? AND id > ? AND (expires IS NULL OR expires >= ?) ORDER BY id",
+                (log, after, time.time()),
+            ).fetchall()
+        # Ids only grow, so a cursor stays valid while older entries are removed
+        return [value for _, value in rows], rows[-1][0] if rows else after
+
+    def take(self, bucket, rate_per_second, burst, amount=1):
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE: the read and the write happen under the file's write lock
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (bucket,)).fetchone()
+                tokens, updated = row if row is not None else (burst, now)
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate_per_second)
+                wait = 0.0
+                if tokens < amount:
+                    wait = (amount - tokens) / rate_per_second
+                else:
+                    tokens -= amount
+                self._db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                                 (bucket, tokens, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._wrote()
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "values": self._db.execute("SELECT COUNT(*) FROM kv").fetchone()[0],
+                "log_entries": self._db.execute("SELECT COUNT(*) FROM logs").fetchone()[0],
+                "buckets": self._db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0],
+            }
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            now = time.time()
+            self._db.execute("DELETE FROM kv WHERE expires < ?", (now,))
+            self._db.execute("DELETE FROM buckets WHERE updated < ?", (now - self.BUCKET_IDLE_SECONDS,))
+            self._db.execute("DELETE FROM logs WHERE expires < ?", (now,))
+            for log, max_entries in self._log_limits.items():
+                if max_entries:
+                    self._db.execute(
+                        "DELETE FROM logs WHERE name = ? AND id <= (SELECT id FROM logs WHERE name = ?"
+                        " ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (log, log, max_entries),
+                    )
+            if self.max_bytes is None:
+                return
+            # INSERT OR REPLACE gives a rewritten value a new rowid, so rowid order is write order
+            excess = self._db.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM kv").fetchone()[0] - self.max_bytes
+            while excess > 0:
+                rows = self._db.execute("SELECT rowid, LENGTH(value) FROM kv ORDER BY rowid LIMIT 256").fetchall()
+                if not rows:
+                    break
+                for rowid, size in rows:
+                    self._db.execute("DELETE FROM kv WHERE rowid = ?", (rowid,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+
+
+# ---------------------- Redis (several hosts) ------------------------
+# Refill, take and save in one step on the server, timed by the server's clock (no skew between hosts)
+TAKE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local rate, burst, amount = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens < amount then
+    wait = (amount - tokens) / rate
+else
+    tokens = tokens - amount
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+# A log is a list trimmed to its newest entries plus a count of every entry ever appended;
+# the cursor is that count, so it stays valid while the list's head is trimmed away
+READ_LOG_SCRIPT = """
+local total = tonumber(redis.call('GET', KEYS[2]) or '0')
+local after = tonumber(ARGV[1])
+local start = 0
+if after <= total then
+    start = math.max(0, after - (total - redis.call('LLEN', KEYS[1])))
+end
+return {total, redis.call('LRANGE', KEYS[1], start, -1)}
+"""
+
+
+class RedisStore(SharedStore):
+    """
+    SharedStore on a Redis server (or anything speaking its protocol: Valkey, KeyDB, ...),
+    for processes on several hosts. Needs the redis package (pip install redis).
+    Keys are prefixed; logs are trimmed lists with an append count, read by a Lua script;
+    buckets are hashes updated by a Lua script. Size the server with maxmemory and an
+    eviction policy such as volatile-lru (logs appended with a ttl can be evicted too).
+    """
+
+    kind = "redis"
+
+    def __init__(self, url, prefix="meal:"):
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        # The connection pool notices a fork and reconnects in the child by itself
+        self._client = redis.Redis.from_url(url, socket_timeout=5, socket_connect_timeout=2)
+        self._take = self._client.register_script(TAKE_SCRIPT)
+        self._read_log = self._client.register_script(READ_LOG_SCRIPT)
+
+    def close(self):
+        self._client.close()
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def append(self, log, value, max_entries=None, ttl=None):
+        key, count = self.prefix + log, self.prefix + log + ":count"
+        pipeline = self._client.pipeline(transaction=True)
+        pipeline.rpush(key, value)
+        pipeline.incr(count)
+        if max_entries:
+            pipeline.ltrim(key, -max_entries, -1)
+        if ttl:
+            pipeline.expire(key, int(ttl))
+            pipeline.expire(count, int(ttl))
+        pipeline.execute()
+
+    def read_log(self, log, after=0):
+        # A cursor past the count means the log expired and started again: read it from the start
+        total, values = self._read_log(keys=[self.prefix + log, self.prefix + log + ":count"], args=[after])
+        return values, int(total)
+
+    def take(self, bucket, rate_per_second, burst, amount=1):
+        return float(self._take(keys=[self.prefix + bucket], args=[rate_per_second, burst, amount]))
+
+    def stats(self):
+        # Memory and evictions are the server's to report (INFO, or its exporter)
+        return {"keys": self._client.dbsize()}
+
+
+def open_store(url):
+    """
+    url: "sqlite:///cache/shared.sqlite3" (relative path; "sqlite:////abs/path" for an absolute
+    one; "?max_mb=256" bounds its values) or "redis://host:6379/0" ("rediss://" for TLS)
+    Returns: SharedStore
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        max_mb = parse_qs(parsed.query).get("max_mb")
+        return SQLiteStore(parsed.path[1:], max_mb=float(max_mb[0]) if max_mb else None)
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisStore(url)
+    raise ValueError(f"unknown shared store URL: {url}")
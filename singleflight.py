@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class LeaderGone(Exception):
+    """The call the others were waiting on was interrupted (not failed); a waiter takes over"""
+
+
+# ---------------------- Flights ------------------------
+class Flight:
+    """One call in progress: its result, and the events it has emitted so far"""
+
+    __slots__ = ("future", "events", "listeners", "waiters", "_lock")
+
+    def __init__(self):
+        self.future = Future()
+        self.events = []
+        self.listeners = []
+        self.waiters = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        # Late joiners first get every event they missed, in order
+        with self._lock:
+            for event in self.events:
+                listener(*event)
+            self.listeners.append(listener)
+
+    def emit(self, *event):
+        with self._lock:
+            self.events.append(event)
+            for listener in self.listeners:
+                listener(*event)
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key (an upload's content hash) share one execution:
+    the first caller runs it, the others wait for its result, or its exception, and get
+    the same. Nothing is kept once the call returns; that is the analysis cache's job.
+
+    Threads: do(key, func, on_event) runs func(emit); each emit(*event) reaches every
+    caller's on_event, late joiners included (so streamed answer fields fan out too).
+    A leader interrupted by something that is not an Exception (worker shutdown) passes
+    the call on to one of its waiters instead of failing them.
+
+    Coroutines: do_async(key, func) runs func() as its own task; a caller that is
+    cancelled (client gone) just stops waiting, and the task is cancelled only when no
+    caller is left waiting for it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._tasks = {}
+        self.counters = {"leaders": 0, "shared": 0, "shared_errors": 0, "handovers": 0, "cancelled": 0}
+
+    def do(self, key, func, on_event=None):
+        """
+        Returns: (func's result, True when it came from another caller's call)
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+                    self.counters["leaders"] += 1
+            if on_event is not None:
+                flight.subscribe(on_event)
+            if leader:
+                return self._lead(key, flight, func), False
+
+            try:
+                result = flight.future.result()
+            except LeaderGone:
+                with self._lock:
+                    self.counters["handovers"] += 1
+                continue
+            except Exception:
+                with self._lock:
+                    self.counters["shared_errors"] += 1
+                raise
+            with self._lock:
+                self.counters["shared"] += 1
+            return result, True
+
+    def _lead(self, key, flight, func):
+        try:
+            result = func(flight.emit)
+        except Exception as e:
+            flight.future.set_exception(e)
+            raise
+        except BaseException:
+            flight.future.set_exception(LeaderGone())
+            raise
+        else:
+            flight.future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    async def do_async(self, key, func):
+        """
+        func: coroutine function taking no arguments
+        Returns: (func's result, True when another caller started the call)
+        """
+        with self._lock:
+            flight = self._tasks.get(key)
+            shared = flight is not None
+            if not shared:
+                flight = self._tasks[key] = Flight()
+                flight.future = asyncio.ensure_future(func())
+                flight.future.add_done_callback(lambda _: self._forget(key, flight))
+                self.counters["leaders"] += 1
+            flight.waiters += 1
+
+        try:
+            result = await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            if not flight.future.cancelled():
+                # Only this caller went away; the call goes on while anyone waits for it
+                with self._lock:
+                    last = flight.waiters == 1
+                    if last:
+                        self.counters["cancelled"] += 1
+                if last:
+                    flight.future.cancel()
+            raise
+        except Exception:
+            if shared:
+                with self._lock:
+                    self.counters["shared_errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+        if shared:
+            with self._lock:
+                self.counters["shared"] += 1
+        return result, shared
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._tasks.get(key) is flight:
+                del self._tasks[key]
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, in_flight=len(self._flights) + len(self._tasks))
@@ -0,0 +1,129 @@
+# ---------------------- Incremental JSON parser ------------------------
+class IncrementalJsonParser:
+    """
+    Feed a JSON document in arbitrary text chunks (e.g. streamed model tokens)
+    and get every scalar value back as soon as it is complete:
+
+        parser = IncrementalJsonParser()
+        parser.feed('{"dish_name": "Ome')      -> []
+        parser.feed('lette", "nutrition": {')  -> [(("dish_name",), "Omelette")]
+
+    Paths are tuples of object keys / array indexes. Anything before the first
+    '{' (prose, a ```json fence) is skipped, and parsing stops at the matching
+    closing brace. Input is assumed to be roughly valid JSON; the parser is
+    for early display, the complete text is still parsed normally afterwards.
+    """
+
+    _LITERALS = {"true": True, "false": False, "null": None}
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        # Each frame: [container_type, current_key_or_index, expecting_key]
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+        self._buffer = []
+        self._scalar = []
+
+    def feed(self, text):
+        """
+        Returns: list of (path, value) for values completed by this chunk
+        """
+        completed = []
+        for char in text:
+            if self.finished:
+                break
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self._stack.append(["object", None, True])
+                continue
+
+            if self._in_string:
+                self._string_char(char, completed)
+                continue
+
+            if self._scalar:
+                if char in ",}] \t\r\n":
+                    self._end_scalar(completed)
+                else:
+                    self._scalar.append(char)
+                    continue
+
+            self._structural_char(char, completed)
+        return completed
+
+    # ---------------------- Internals ------------------------
+    def _path(self):
+        return tuple(frame[1] for frame in self._stack if frame[1] is not None)
+
+    def _string_char(self, char, completed):
+        if self._unicode is not None:
+            self._unicode.append(char)
+            if len(self._unicode) == 4:
+                self._buffer.append(chr(int("".join(self._unicode), 16)))
+                self._unicode = None
+            return
+        if self._escape:
+            self._escape = False
+            if char == "u":
+                self._unicode = []
+            else:
+                self._buffer.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(char, char))
+            return
+        if char == "\\":
+            self._escape = True
+            return
+        if char != '"':
+            self._buffer.append(char)
+            return
+
+        self._in_string = False
+        value = "".join(self._buffer)
+        self._buffer = []
+        frame = self._stack[-1]
+        if frame[0] == "object" and frame[2]:
+            frame[1] = value
+            frame[2] = False
+        else:
+            completed.append((self._path(), value))
+
+    def _end_scalar(self, completed):
+        token = "".join(self._scalar)
+        self._scalar = []
+        if token in self._LITERALS:
+            value = self._LITERALS[token]
+        else:
+            try:
+                value = int(token)
+            except ValueError:
+                try:
+                    value = float(token)
+                except ValueError:
+                    value = token
+        completed.append((self._path(), value))
+
+    def _structural_char(self, char, completed):
+        frame = self._stack[-1]
+        if char == '"':
+            self._in_string = True
+        elif char == "{":
+            self._stack.append(["object", None, True])
+        elif char == "[":
+            self._stack.append(["array", 0, False])
+        elif char in "}]":
+            self._stack.pop()
+            if not self._stack:
+                self.finished = True
+        elif char == ",":
+            if frame[0] == "object":
+                frame[1] = None
+                frame[2] = True
+            else:
+                frame[1] += 1
+        elif char in " \t\r\n:":
+            pass
+        else:
+            self._scalar.append(char)
@@ -0,0 +1,94 @@
+import io
+import os
+import time
+
+from blob_store import BlobStore
+
+
+def blob(byte, size=60):
+    return bytes([byte]) * size
+
+
+def refs(store, key):
+    row = store._db().execute("SELECT refs FROM blobs WHERE key = ?", (key,)).fetchone()
+    return None if row is None else row["refs"]
+
+
+# ---------------------- Writing ------------------------
+def test_put_stores_each_content_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    key = store.put(blob(1), mime="image/jpeg")
+    assert store.put_stream(io.BytesIO(blob(1))) == key
+
+    assert store.read(key) == blob(1)
+    assert store.get(key)["mime"] == "image/jpeg"
+    assert store.stats()["blobs"] == 1
+    assert store.counters["dedup_hits"] == 1
+
+
+def test_pins_are_counted(tmp_path):
+    store = BlobStore(str(tmp_path))
+    key = store.put(blob(1), pin=True)
+    store.put_stream(io.BytesIO(blob(1)), pin=True)
+    assert refs(store, key) == 2
+    store.decref(key)
+    store.decref(key)
+    store.decref(key)
+    assert refs(store, key) == 0
+
+
+# ---------------------- Garbage collection ------------------------
+def test_gc_evicts_unpinned_blobs_over_budget(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=100)
+    pinned = store.put(blob(1), pin=True)
+    loose = store.put(blob(2))
+
+    # 120 bytes > 100: the unpinned blob goes, the pinned one stays
+    assert store.get(loose) is None
+    assert not os.path.exists(store.path(loose))
+    assert store.read(pinned) == blob(1)
+
+    # Once unpinned, the least recently used blob goes first
+    store.decref(pinned)
+    time.sleep(0.01)
+    newest = store.put(blob(3))
+    assert store.get(pinned) is None
+    assert store.read(newest) == blob(3)
+
+
+def test_running_total_matches_the_index(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=1000)
+    for byte in range(5):
+        store.put(blob(byte))
+    store.put(blob(0))
+    assert store._total == store.total_bytes() == 300
+
+    store.max_bytes = 200
+    removed, freed = store.gc()
+    assert (removed, freed) == (2, 120)
+    assert store._total == store.total_bytes() == 180
+
+
+def test_gc_removes_expired_unpinned_blobs(tmp_path):
+    store = BlobStore(str(tmp_path), max_age_seconds=0)
+    pinned = store.put(blob(1), pin=True)
+    loose = store.put(blob(2))
+    time.sleep(0.01)
+    store.gc()
+    assert store.get(loose) is None
+    assert store.get(pinned) is not None
+
+
+# ---------------------- Temp files ------------------------
+def test_only_stale_temp_files_are_removed_on_open(tmp_path):
+    BlobStore(str(tmp_path))
+    stale = tmp_path / "tmp" / "stale"
+    live = tmp_path / "tmp" / "live"
+    stale.write_bytes(b"partial")
+    live.write_bytes(b"partial")
+    old = time.time() - BlobStore.STALE_TMP_SECONDS - 10
+    os.utime(stale, (old, old))
+
+    BlobStore(str(tmp_path))
+    assert not stale.exists()
+    assert live.exists()
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from blob_store import BlobStore
+from jobs import JobQueue
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def queues():
+    opened = []
+
+    def open_queue(path, handler, **kwargs):
+        queue = JobQueue(str(path), handler, workers=1, **kwargs)
+        opened.append(queue)
+        return queue
+
+    yield open_queue
+    for queue in opened:
+        queue.stop(timeout=2)
+
+
+def crashed_claim(queues, path, lease_seconds):
+    """A job claimed by a process that then stopped renewing its lease"""
+    crashed = queues(path, lambda *args: None, lease_seconds=lease_seconds)
+    # No worker threads or lease renewals: as if the process had died after claiming
+    crashed._started = True
+    job_id = crashed.submit(b"image", "meal.jpg")
+    row = crashed._claim()
+    assert row["id"] == job_id
+    return crashed, row
+
+
+# ---------------------- Recovery ------------------------
+def test_start_requeues_jobs_left_running(tmp_path, queues):
+    path = tmp_path / "jobs.sqlite3"
+    _, row = crashed_claim(queues, path, lease_seconds=60)
+
+    queue = queues(path, lambda image, filename, progress: {"size": len(image)})
+    queue.start()
+
+    assert wait_for(lambda: queue.get(row["id"])["status"] == "done")
+    assert queue.get(row["id"])["result"] == {"size": 5}
+
+
+def test_expired_lease_is_requeued_without_a_restart(tmp_path, queues):
+    path = tmp_path / "jobs.sqlite3"
+    crashed, row = crashed_claim(queues, path, lease_seconds=0.2)
+
+    # A sibling worker that started earlier: it does not recover at start
+    queue = queues(path, lambda image, filename, progress: {"ok": True})
+    queue.recover_on_start = False
+    queue.PRUNE_EVERY = 0.1
+    queue.start()
+
+    assert wait_for(lambda: queue.get(row["id"])["status"] == "done")
+    assert queue.counters["expired"] == 1
+    # The stale runner finishing late neither overwrites the result nor counts as the owner
+    assert crashed._finish(row["id"], row["owner"], "failed", error="late") is False
+    assert queue.get(row["id"])["status"] == "done"
+
+
+def test_running_job_keeps_its_lease(tmp_path, queues):
+    path = tmp_path / "jobs.sqlite3"
+    release = threading.Event()
+    calls = []
+
+    def handler(image, filename, progress):
+        calls.append(filename)
+        release.wait(5)
+        return {"ok": True}
+
+    queue = queues(path, handler, lease_seconds=0.3)
+    job_id = queue.submit(b"image", "meal.jpg")
+    assert wait_for(lambda: queue.get(job_id)["status"] == "running")
+
+    # Well past the lease: renewals keep the job with its runner
+    other = queues(path, handler, lease_seconds=0.3)
+    time.sleep(0.8)
+    assert other.requeue_expired() == 0
+
+    release.set()
+    assert wait_for(lambda: queue.get(job_id)["status"] == "done")
+    assert calls == ["meal.jpg"]
+
+
+def test_finished_job_releases_its_upload_once(tmp_path, queues):
+    store = BlobStore(str(tmp_path / "uploads"))
+    queue = queues(tmp_path / "jobs.sqlite3", lambda image, filename, progress: {"ok": True}, store=store)
+    job_id = queue.submit(b"image", "meal.jpg")
+
+    assert wait_for(lambda: queue.get(job_id)["status"] == "done")
+    assert wait_for(lambda: store.stats()["pinned"] == 0)
+
+
+# ---------------------- Pruning ------------------------
+def test_prune_deletes_only_old_finished_jobs(tmp_path, queues):
+    queue = queues(tmp_path / "jobs.sqlite3", lambda image, filename, progress: {"ok": True}, ttl_seconds=60)
+    job_id = queue.submit(b"image", "meal.jpg")
+    assert wait_for(lambda: queue.get(job_id)["status"] == "done")
+
+    assert queue.prune() == 0
+    db = queue._db()
+    db.execute("UPDATE jobs SET finished = finished - 120 WHERE id = ?", (job_id,))
+    db.commit()
+    assert queue.prune() == 1
+    assert queue.get(job_id) is None
@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from circuit_breaker import CircuitOpen, get_breaker
+from model_router import ModelRouter, OpenAIChatBackend, RouterError
+
+
+# ---------------------- Stub servers ------------------------
+class StubBackend:
+    """OpenAI-style chat endpoint on localhost answering with status after delay seconds"""
+
+    def __init__(self, answer="ok", status=200, delay=0.0):
+        self.answer = answer
+        self.status = status
+        self.delay = delay
+        self.calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.calls += 1
+                time.sleep(stub.delay)
+                if stub.status == 200:
+                    body = json.dumps({"choices": [{"message": {"content": stub.answer}}]}).encode()
+                else:
+                    body = b'{"error": "stub"}'
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def backend(self):
+        # A fresh name per backend: breakers are shared per name for the whole process
+        name = f"stub-{uuid.uuid4().hex[:8]}"
+        url = f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions"
+        return OpenAIChatBackend(name, url, "key", "model", session=name, timeout=10)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stubs():
+    started = []
+
+    def start(**kwargs):
+        stub = StubBackend(**kwargs)
+        started.append(stub)
+        return stub
+
+    yield start
+    for stub in started:
+        stub.close()
+
+
+# ---------------------- Failover ------------------------
+def test_fails_over_to_the_next_backend_on_5xx(stubs):
+    broken, healthy = stubs(status=500), stubs(answer="from healthy")
+    router = ModelRouter([broken.backend(), healthy.backend()], hedge_after=0)
+
+    text, _ = router.analyze(b"jpeg", "prompt")
+
+    assert text == "from healthy"
+    assert broken.calls == 1
+    assert router.counters["failovers"] == 1
+
+
+def test_raises_router_error_when_every_backend_fails(stubs):
+    router = ModelRouter([stubs(status=500).backend(), stubs(status=502).backend()], hedge_after=0)
+
+    with pytest.raises(RouterError):
+        router.analyze(b"jpeg", "prompt")
+    assert router.counters["failures"] == 1
+
+
+def test_4xx_counts_against_neither_breaker_nor_stats(stubs):
+    rejecting, healthy = stubs(status=400), stubs()
+    backend = rejecting.backend()
+    router = ModelRouter([backend, healthy.backend()], hedge_after=0)
+
+    for _ in range(10):
+        router.analyze(b"jpeg", "prompt")
+
+    breaker = get_breaker(backend.name)
+    assert breaker.state == "closed"
+    assert breaker.counters["failures"] == 0
+    assert router.stats[backend.name].snapshot()["calls"] == 0
+
+
+def test_every_breaker_open_raises_circuit_open(stubs):
+    backends = [stubs().backend(), stubs().backend()]
+    for backend in backends:
+        breaker = get_breaker(backend.name)
+        for _ in range(breaker.failures):
+            with breaker.attempt() as attempt:
+                attempt.start()
+                attempt.failure()
+        assert breaker.state == "open"
+
+    router = ModelRouter(backends, hedge_after=0)
+    with pytest.raises(CircuitOpen):
+        router.analyze(b"jpeg", "prompt")
+    assert router.counters["failures"] == 0
+
+
+# ---------------------- Hedging ------------------------
+def test_hedge_answers_when_the_primary_is_slow(stubs):
+    slow, fast = stubs(answer="slow", delay=1.0), stubs(answer="fast")
+    fast_backend = fast.backend()
+    router = ModelRouter([slow.backend(), fast_backend], hedge_after=0.1)
+
+    start = time.perf_counter()
+    text, name = router.analyze(b"jpeg", "prompt")
+
+    assert (text, name) == ("fast", fast_backend.name)
+    assert time.perf_counter() - start < 0.9
+    assert router.counters["hedges"] == 1
+    assert router.counters["hedge_wins"] == 1
+
+
+def test_hedge_takes_a_slot_of_its_own(stubs):
+    held = []
+    peak = []
+    lock = threading.Lock()
+
+    @contextmanager
+    def slot():
+        with lock:
+            held.append(1)
+            peak.append(len(held))
+        try:
+            yield
+        finally:
+            with lock:
+                held.pop()
+
+    router = ModelRouter([stubs(delay=0.5).backend(), stubs(delay=0.5).backend()], hedge_after=0.1, slot=slot)
+    router.analyze(b"jpeg", "prompt")
+
+    assert max(peak) == 2
@@ -0,0 +1,82 @@
+import time
+
+import fakeredis
+import pytest
+import redis
+
+from shared_store import RedisStore, SQLiteStore, pack, unpack
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        store = SQLiteStore(str(tmp_path / "shared.sqlite3"))
+    else:
+        # In-process Redis that runs the Lua scripts (token bucket, log reads) itself
+        server = fakeredis.FakeServer()
+        monkeypatch.setattr(redis.Redis, "from_url", lambda url, **kwargs: fakeredis.FakeRedis(server=server))
+        store = RedisStore("redis://localhost:6379/0", prefix="test:")
+    yield store
+    store.close()
+
+
+# ---------------------- Values ------------------------
+def test_get_returns_what_was_set(store):
+    assert store.get("missing") is None
+    store.set("key", b"value")
+    assert store.get("key") == b"value"
+    store.set("key", b"newer")
+    assert store.get("key") == b"newer"
+
+
+def test_values_expire_after_their_ttl(store):
+    store.set("short", b"value", ttl=1)
+    store.set("long", b"value", ttl=60)
+    time.sleep(1.2)
+    assert store.get("short") is None
+    assert store.get("long") == b"value"
+
+
+def test_pack_round_trips_through_the_store(store):
+    value = [time.time(), '{"dish_name": "Soup"}']
+    store.set("packed", pack(value))
+    assert unpack(store.get("packed")) == value
+
+
+# ---------------------- Logs ------------------------
+def test_read_log_returns_entries_after_the_cursor(store):
+    for value in (b"a", b"b", b"c"):
+        store.append("hashes", value)
+    values, cursor = store.read_log("hashes")
+    assert values == [b"a", b"b", b"c"]
+
+    store.append("hashes", b"d")
+    values, cursor = store.read_log("hashes", after=cursor)
+    assert values == [b"d"]
+    assert store.read_log("hashes", after=cursor) == ([], cursor)
+
+
+def test_logs_are_kept_apart(store):
+    store.append("one", b"a")
+    store.append("two", b"b")
+    assert store.read_log("one")[0] == [b"a"]
+    assert store.read_log("two")[0] == [b"b"]
+
+
+# ---------------------- Token buckets ------------------------
+def test_take_allows_the_burst_then_reports_the_wait(store):
+    # 1 token per second, bursts of 2
+    assert store.take("client:a", 1.0, 2) == 0.0
+    assert store.take("client:a", 1.0, 2) == 0.0
+    wait = store.take("client:a", 1.0, 2)
+    assert 0.5 < wait <= 1.0
+    # A refused take leaves the bucket as it was
+    assert 0.0 < store.take("client:a", 1.0, 2) <= wait
+
+
+def test_buckets_refill_and_are_kept_apart(store):
+    assert store.take("client:a", 10.0, 1) == 0.0
+    assert store.take("client:a", 10.0, 1) > 0.0
+    assert store.take("client:b", 10.0, 1) == 0.0
+    time.sleep(0.15)
+    assert store.take("client:a", 10.0, 1) == 0.0
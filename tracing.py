@@ -0,0 +1,291 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+# ---------------------- Settings ------------------------
+# Fraction of traces logged with every span; traces slower than TRACE_SLOW_SECONDS are always logged
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+# Trace log lines go to this file, or to stderr when unset
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH")
+
+# Histogram buckets in seconds: sub-millisecond parsing up to the 60 s model timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+logger = logging.getLogger("meal_mingle.trace")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addHandler(logging.FileHandler(TRACE_LOG_PATH) if TRACE_LOG_PATH else logging.StreamHandler())
+
+
+# ---------------------- Metrics ------------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """Monotonic count per label set, e.g. analyses by outcome"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labels, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label set, exported as cumulative Prometheus buckets.
+    observe() is a bisect and three additions under a lock.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        rows = []
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                rows.append((self.name + "_bucket", self.labels + ("le",), key + (bound,), cumulative))
+            rows.append((self.name + "_sum", self.labels, key, total))
+            rows.append((self.name + "_count", self.labels, key, count))
+        return rows
+
+
+class Registry:
+    """
+    Metrics plus collectors: functions returning the numeric stats a component already
+    keeps (analysis_cache.stats() and the like), exported as gauges at scrape time
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, prefix, stats):
+        """
+        prefix: metric name prefix, e.g. "meal_analysis_cache"
+        stats: function returning a (possibly nested) dict; numbers become gauges prefix_key
+        """
+        self._collectors.append((prefix, stats))
+
+    def render(self):
+        """
+        Returns: every metric in the Prometheus text exposition format (version 0.0.4)
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, label_names, label_values, value in metric.samples():
+                lines.append(f"{name}{_label_text(label_names, label_values)} {_number(value)}")
+
+        for prefix, stats in self._collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                lines.append(f"# {prefix}: collector failed: {e}")
+                continue
+            for name, value in sorted(_flatten(values, prefix)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    # Integers exactly (byte counts overflow %g's six digits), floats at full precision
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _flatten(values, prefix):
+    if isinstance(values, bool):
+        yield prefix, int(values)
+    elif isinstance(values, (int, float)):
+        yield prefix, values
+    elif isinstance(values, dict):
+        for key, value in values.items():
+            name = "".join(char if char.isalnum() else "_" for char in str(key)).strip("_").lower()
+            yield from _flatten(value, f"{prefix}_{name}")
+
+
+# ---------------------- Shared metrics ------------------------
+metrics = Registry()
+
+stage_seconds = metrics.histogram(
+    "meal_stage_seconds", "Time spent in each stage of an analysis", labels=("stage",)
+)
+request_seconds = metrics.histogram(
+    "meal_request_seconds", "End-to-end time of traced requests and jobs", labels=("route",)
+)
+analyses = metrics.counter(
+    "meal_analyses_total",
+    "Analyses by how they were answered (model, cache, near_duplicate, screened) and outcome",
+    labels=("source", "outcome"),
+)
+model_calls = metrics.counter(
+    "meal_model_calls_total", "Model API calls by backend and status", labels=("backend", "status")
+)
+
+
+# ---------------------- Tracing ------------------------
+class Trace:
+    """One request or job: its id, whether it is sampled, and the spans recorded while sampled"""
+
+    __slots__ = ("name", "trace_id", "sampled", "start", "spans", "attributes", "depth")
+
+    def __init__(self, name, sampled, attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.spans = []
+        self.attributes = attributes
+        self.depth = 0
+
+
+_current = contextvars.ContextVar("meal_mingle_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def begin_trace(name, **attributes):
+    """
+    Start the root span of a request or job in the current context (see trace())
+    Returns: handle for end_trace
+    """
+    active = Trace(name, random.random() < TRACE_SAMPLE_RATE, attributes)
+    return active, _current.set(active)
+
+
+def end_trace(handle):
+    """
+    Finish a trace from begin_trace: time it into meal_request_seconds{route=name} and,
+    when sampled (TRACE_SAMPLE_RATE) or slower than TRACE_SLOW_SECONDS, log every span
+    in it as one JSON line on the "meal_mingle.trace" logger
+    """
+    active, token = handle
+    _current.reset(token)
+    elapsed = time.perf_counter() - active.start
+    request_seconds.observe(elapsed, route=active.name)
+    if active.sampled or elapsed >= TRACE_SLOW_SECONDS:
+        logger.info(json.dumps({
+            "trace_id": active.trace_id,
+            "name": active.name,
+            "ms": round(elapsed * 1000, 3),
+            "sampled": active.sampled,
+            "attributes": active.attributes,
+            "spans": sorted(active.spans, key=lambda item: item["offset_ms"]),
+        }, default=str))
+
+
+@contextmanager
+def trace(name, **attributes):
+    """
+    begin_trace / end_trace around a block
+    Yields: the Trace, so callers can add attributes (trace.attributes["dish"] = ...)
+    """
+    handle = begin_trace(name, **attributes)
+    try:
+        yield handle[0]
+    finally:
+        end_trace(handle)
+
+
+@contextmanager
+def span(stage):
+    """
+    Time one stage into meal_stage_seconds{stage=...}; inside a sampled trace the
+    span is also kept (offset from the trace start, duration, nesting depth) for its log line
+    """
+    active = _current.get()
+    start = time.perf_counter()
+    if active is not None:
+        active.depth += 1
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        if active is not None:
+            active.depth -= 1
+            if active.sampled:
+                active.spans.append({
+                    "stage": stage,
+                    "offset_ms": round((start - active.start) * 1000, 3),
+                    "ms": round(elapsed * 1000, 3),
+                    "depth": active.depth,
+                })
+
+
+def traced(stage):
+    """Decorator form of span()"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate